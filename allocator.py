@@ -0,0 +1,76 @@
+''' budget-constrained allocation of units to invest
+
+Rounding every position on its own can make the total order overshoot (or undershoot) the saving of the period
+by up to half a share price per position. allocate_units() instead picks units such that the net cost of all
+orders stays within the budget while the deviation |units * priceUsd - need2invest| summed over the stocks is kept
+small:
+
+1. if the net need2invest exceeds the budget (possible with VA), the buying needs are scaled down so that the net
+   target equals the budget. selling needs are kept as they are
+2. fractionally investable stocks get exactly target / priceUsd units
+3. the other stocks get floor(target / priceUsd) units, which never costs more than the target
+4. with the cash left, units are rounded up greedily in the order of the reduction of deviation per USD spent, as
+   long as rounding up reduces the deviation and fits in the leftover cash
+
+Everything but step 4 is vectorized and step 4 only visits the stocks whose rounding up reduces the deviation, so
+thousands of stocks are allocated within milliseconds.
+'''
+import logging
+import numpy as np
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+ALLOCATIONS = ('round', 'budget')
+BUDGET_TOLERANCE = 1e-9  # USD. absorbs floating point errors of the sums
+
+
+def allocate_units(need2invest: np.ndarray, price_usd: np.ndarray, fractional: np.ndarray, budget: float) -> tuple:
+    ''' return (units to invest, leftover cash in USD) of the stocks
+
+    need2invest: amount to invest in each stock in USD (negative for selling)
+    price_usd: price of each stock in USD
+    fractional: whether each stock can be invested fractionally
+    budget: cash available for the net cost of all orders in USD (i.e. the saving of the period)
+    '''
+    need2invest = np.asarray(need2invest, dtype=float)
+    price_usd = np.asarray(price_usd, dtype=float)
+    fractional = np.asarray(fractional, dtype=bool)
+    if not (price_usd > 0.0).all():
+        logger.error('every price should be positive to allocate units within a budget')
+        raise ValueError
+
+    # 1. scale the buying needs down if the net need exceeds the budget
+    target = need2invest
+    net_need = need2invest.sum()
+    if net_need > budget + BUDGET_TOLERANCE:
+        buying = need2invest > 0.0
+        buying_need = need2invest[buying].sum()
+        if buying_need == 0.0:
+            # nothing is bought (e.g. a negative budget), so there is nothing to scale down
+            logger.info(f'need2invest of {net_need:.2f} USD exceeds the budget of {budget:.2f} USD '
+                        f'with no buying needs to scale')
+        else:
+            # the selling needs (and the budget) fund the buying needs
+            scale = max(budget - need2invest[~buying].sum(), 0.0) / buying_need
+            target = np.where(buying, need2invest * scale, need2invest)
+            logger.info(f'need2invest of {net_need:.2f} USD exceeds the budget of {budget:.2f} USD. '
+                        f'buying needs are scaled by {scale:.4f}')
+
+    # 2. and 3. exact units for fractional stocks and floored units for the others
+    exact_units = target / price_usd
+    units = np.where(fractional, exact_units, np.floor(exact_units))
+    leftover = budget - float((units * price_usd).sum())
+
+    # 4. round up where it reduces the deviation the most per USD, as long as the leftover cash allows it
+    residual = target - units * price_usd  # in [0, price) for the floored stocks
+    gain = 2.0 * residual - price_usd  # reduction of deviation by rounding up (positive if residual > price / 2)
+    candidates = np.flatnonzero(~fractional & (gain > 0.0))
+    order = candidates[np.argsort(-gain[candidates] / price_usd[candidates], kind='stable')]
+    for i, price in zip(order.tolist(), price_usd[order].tolist()):
+        if price <= leftover + BUDGET_TOLERANCE:
+            units[i] += 1.0
+            leftover -= price
+
+    return units, leftover
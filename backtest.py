@@ -0,0 +1,170 @@
+''' vectorized historical backtest of the CA/VA accounting of Portfolio
+
+Runs the same accounting as Portfolio.distribute_saving (cumSumCaInvested, need2investCA, need2investVA,
+unit rounding and cum_inv_deviation) over a time series of prices and exchange rates, assuming that every
+period's need2investInUnits is executed in full at that period's price.
+
+Arrays are indexed as [..., period, stock]. Any leading dimensions (e.g. scenarios of different weights or
+price paths) are broadcast, so many backtests can be run at once.
+'''
+import logging
+import numpy as np
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+def initial_state_from_report(report: dict) -> dict:
+    ''' extract stock keys and the initial arrays of run_backtest() from a (reference) report '''
+    stockkeys = []
+    state = {
+        'weights': [],
+        'is_krw': [],
+        'fractional': [],
+        'initial_holdings': [],
+        'initial_cum_sum_ca_invested': [],
+        'initial_need2invest_ca': [],
+        'initial_need2invest': [],
+        'initial_cum_inv_deviation': []
+    }
+    for stockgroupkey, stockgroup in report['stockgroups'].items():
+        for stockkey, stock in stockgroup['stocks'].items():
+            stockkeys.append((stockgroupkey, stockkey))
+            state['weights'].append(stock['weight'])
+            state['is_krw'].append(stock['currency'] == 'KRW')
+            state['fractional'].append(stockgroupkey == 'CoinGecko')  # Cryptocurrencies can be fractionally invested
+            state['initial_holdings'].append(stock.get('holdings', 0))
+            state['initial_cum_sum_ca_invested'].append(stock.get('cumSumCaInvested', 0.0))
+            state['initial_need2invest_ca'].append(stock.get('need2investCA', 0.0))
+            state['initial_need2invest'].append(stock.get('need2invest', 0.0))
+            state['initial_cum_inv_deviation'].append(stock.get('cum_inv_deviation', 0.0))
+
+    state = {key: np.asarray(value, dtype=bool if key in ('is_krw', 'fractional') else float) for key, value in state.items()}
+    state['stockkeys'] = stockkeys
+
+    return state
+
+
+def run_backtest(strategy: str,
+                 weights: np.ndarray,
+                 prices: np.ndarray,
+                 exchange_rates: np.ndarray,
+                 savings: np.ndarray,
+                 is_krw: np.ndarray,
+                 fractional: np.ndarray,
+                 initial_holdings: np.ndarray,
+                 initial_cum_sum_ca_invested: np.ndarray,
+                 initial_need2invest_ca: np.ndarray = None,
+                 initial_need2invest: np.ndarray = None,
+                 initial_cum_inv_deviation: np.ndarray = None) -> dict:
+    ''' run CA or VA over T periods of n stocks
+
+    strategy: 'CA' or 'VA'
+    weights: [..., n] target weights
+    prices: [..., T, n] prices in each stock's currency
+    exchange_rates: [..., T] KRW per USD
+    savings: [..., T] saving of each period in USD
+    is_krw: [n] whether the price of each stock is in KRW (otherwise in USD)
+    fractional: [n] whether each stock can be invested fractionally (otherwise units are rounded)
+    initial_*: [..., n] values of the reference report of the first period (missing need2invest* and
+               cum_inv_deviation are regarded as 0 just like Portfolio does)
+
+    returns a dict of arrays named after the report fields ([..., T, n] unless noted):
+        holdings (before investing in the period), priceUsd, appraisement, cumSumCaInvested,
+        need2investCA, need2invest, need2investInUnits, cash_flow (USD spent by executing need2investInUnits),
+        cum_inv_deviation, total_appraisement [..., T], total_cash_flow [..., T]
+    '''
+    if strategy not in ('CA', 'VA'):
+        logger.error('Only supports CA and VA for strategy')
+        raise NotImplementedError
+
+    weights = np.asarray(weights, dtype=float)
+    prices = np.asarray(prices, dtype=float)
+    exchange_rates = np.asarray(exchange_rates, dtype=float)
+    savings = np.asarray(savings, dtype=float)
+    is_krw = np.asarray(is_krw, dtype=bool)
+    fractional = np.asarray(fractional, dtype=bool)
+    initial_holdings = np.asarray(initial_holdings, dtype=float)
+    initial_cum_sum_ca_invested = np.asarray(initial_cum_sum_ca_invested, dtype=float)
+    zeros = np.zeros(prices.shape[-1])
+    initial_need2invest_ca = zeros if initial_need2invest_ca is None else np.asarray(initial_need2invest_ca, dtype=float)
+    initial_need2invest = zeros if initial_need2invest is None else np.asarray(initial_need2invest, dtype=float)
+    initial_cum_inv_deviation = \
+        zeros if initial_cum_inv_deviation is None else np.asarray(initial_cum_inv_deviation, dtype=float)
+
+    num_periods = prices.shape[-2]
+    fx = exchange_rates[..., :, np.newaxis]  # [..., T, 1]
+    # same operation order as Portfolio so that results match bit for bit
+    price_usd = np.where(is_krw, prices / fx, prices)
+
+    # CA amounts do not depend on the holdings, so they are derived for every period at once
+    need2invest_ca = savings[..., :, np.newaxis] * weights[..., np.newaxis, :]
+    # cumSumCaInvested of period t = cumSumCaInvested of period t-1 + need2investCA of period t-1
+    # (cumsum over [initial + initial CA, CA_0, CA_1, ...] adds in the same order as chained reports do)
+    cum_sum_ca_invested = np.cumsum(
+        np.concatenate([np.broadcast_to((initial_cum_sum_ca_invested + initial_need2invest_ca)[..., np.newaxis, :],
+                                        need2invest_ca[..., :1, :].shape),
+                        need2invest_ca[..., :-1, :]], axis=-2),
+        axis=-2
+    )
+
+    def to_appraisement(holdings, t):
+        return np.where(is_krw, holdings * prices[..., t, :] / fx[..., t, :], holdings * prices[..., t, :])
+
+    def to_units(need2invest, t):
+        units = need2invest / price_usd[..., t, :]
+        return np.where(fractional, units, np.round(units))  # np.round rounds half to even like round()
+
+    shape = np.broadcast_shapes(price_usd.shape, need2invest_ca.shape, initial_holdings.shape[:-1] + (1, prices.shape[-1]))
+    holdings = np.empty(shape)
+    need2invest = np.empty(shape)
+    units = np.empty(shape)
+
+    if strategy == 'CA':
+        # units do not depend on the holdings either, so everything is derived at once
+        need2invest[...] = need2invest_ca
+        units[...] = np.where(fractional, need2invest / price_usd, np.round(need2invest / price_usd))
+        holdings[...] = np.cumsum(
+            np.concatenate([np.broadcast_to(initial_holdings[..., np.newaxis, :], units[..., :1, :].shape),
+                            units[..., :-1, :]], axis=-2),
+            axis=-2
+        )
+    else:
+        # VA depends on the appraisement of the holdings resulting from the previous period
+        period_holdings = np.broadcast_to(initial_holdings, shape[:-2] + shape[-1:]).copy()
+        for t in range(num_periods):
+            holdings[..., t, :] = period_holdings
+            need2invest[..., t, :] = \
+                cum_sum_ca_invested[..., t, :] + need2invest_ca[..., t, :] - to_appraisement(period_holdings, t)
+            units[..., t, :] = to_units(need2invest[..., t, :], t)
+            period_holdings = period_holdings + units[..., t, :]
+
+    appraisement = np.where(is_krw, holdings * prices / fx, holdings * prices)
+    cash_flow = units * price_usd
+
+    # cum_inv_deviation of period t adds need2invest of period t-1 minus what was actually invested in period t-1
+    # evaluated with the price of period t-1 (converted with the exchange rate of period t as Portfolio does)
+    actual_inv_increment = np.where(is_krw,
+                                    prices[..., :-1, :] * units[..., :-1, :] / fx[..., 1:, :],
+                                    prices[..., :-1, :] * units[..., :-1, :])
+    inv_deviation = need2invest[..., :-1, :] - actual_inv_increment
+    cum_inv_deviation = np.cumsum(
+        np.concatenate([np.broadcast_to((initial_cum_inv_deviation + initial_need2invest)[..., np.newaxis, :],
+                                        need2invest[..., :1, :].shape),
+                        inv_deviation], axis=-2),
+        axis=-2
+    )
+
+    return {
+        'holdings': holdings,
+        'priceUsd': np.broadcast_to(price_usd, shape),
+        'appraisement': appraisement,
+        'cumSumCaInvested': np.broadcast_to(cum_sum_ca_invested, shape),
+        'need2investCA': np.broadcast_to(need2invest_ca, shape),
+        'need2invest': need2invest,
+        'need2investInUnits': units,
+        'cash_flow': cash_flow,
+        'cum_inv_deviation': cum_inv_deviation,
+        'total_appraisement': appraisement.sum(axis=-1),
+        'total_cash_flow': cash_flow.sum(axis=-1)
+    }
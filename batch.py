@@ -0,0 +1,420 @@
+import glob
+import json
+import logging
+import os
+import sys
+import time
+import click
+import portfolio
+from setup_logger import setup_logger
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+class BatchEntry:
+    ''' a portfolio to compute in a batch run '''
+
+    def __init__(self, ref_report_path: str, output_report_path: str, secrets_path: str, tokens_path: str,
+                 saving_in_krw: float, saving_in_usd: float):
+        self.ref_report_path = ref_report_path
+        self.output_report_path = output_report_path
+        self.secrets_path = secrets_path
+        self.tokens_path = tokens_path
+        self.saving_in_krw = saving_in_krw
+        self.saving_in_usd = saving_in_usd
+        self.portfolio = None
+        self.elapsed_in_sec = 0.0
+        self.error = None
+
+
+PATH_KEYS = ('ref_report_path', 'output_report_path', 'secrets_path', 'tokens_path')  # keys of paths in a manifest
+
+
+def load_entries(source: str, output_dir: str, defaults: dict) -> list:
+    ''' build BatchEntry list from either a directory of ref reports or a manifest JSON file
+
+    manifest format:
+        {
+            "defaults": {"secrets_path": ..., "tokens_path": ..., "saving_in_krw": ..., "saving_in_usd": ...},
+            "portfolios": [
+                {"ref_report_path": ..., "output_report_path": ..., and optionally any key of "defaults"},
+                ...
+            ]
+        }
+    relative paths in the manifest are resolved against the directory of the manifest, whereas paths of defaults
+    (i.e. given on the command line) are used as they are.
+    '''
+    if os.path.isdir(source):
+        if output_dir is None:
+            logger.error('OUTPUT_DIR must be given when SOURCE is a directory of ref reports')
+            raise ValueError
+
+        return [
+            BatchEntry(ref_report_path,
+                       os.path.join(output_dir, os.path.basename(ref_report_path)),
+                       defaults['secrets_path'],
+                       defaults['tokens_path'],
+                       defaults['saving_in_krw'],
+                       defaults['saving_in_usd'])
+            for ref_report_path in sorted(glob.glob(os.path.join(source, '*.json')))
+        ]
+
+    with open(source, 'r') as f:
+        manifest = json.load(f)
+    manifest_dir = os.path.dirname(os.path.abspath(source))
+    manifest_defaults = manifest.get('defaults', {})
+
+    def resolve(item: dict) -> dict:
+        ''' item with its paths resolved against the directory of the manifest '''
+        return {key: os.path.join(manifest_dir, value) if key in PATH_KEYS else value for key, value in item.items()}
+
+    entries = []
+    for item in manifest['portfolios']:
+        # only values from the manifest are resolved. those of defaults are relative to the current directory
+        item = dict(defaults, **resolve(dict(manifest_defaults, **item)))
+        if 'output_report_path' in item.keys():
+            output_report_path = item['output_report_path']
+        elif output_dir is not None:
+            output_report_path = os.path.join(output_dir, os.path.basename(item['ref_report_path']))
+        else:
+            logger.error(f'No output_report_path for {item["ref_report_path"]} and no OUTPUT_DIR given')
+            raise ValueError
+
+        entries.append(BatchEntry(item['ref_report_path'],
+                                  output_report_path,
+                                  item['secrets_path'],
+                                  item['tokens_path'],
+                                  float(item['saving_in_krw']),
+                                  float(item['saving_in_usd'])))
+
+    return entries
+
+
+def prefetch_market_data(entries: list, exchange_rate: float, price_cache):
+    ''' fetch the prices of every stock of every portfolio once, so that portfolios only read the price cache '''
+    import stockwrapper
+    from concurrent.futures import ThreadPoolExecutor
+
+    def cache_market(stockgroupkey: str, stockkey: str, stock: dict) -> str:
+        ''' market of the price cache key of a stock (coins are cached by their symbol only) '''
+        if stockgroupkey == 'KIS':
+            return stock['market']
+        elif stockgroupkey == 'KRX':
+            return stockwrapper.KrxStock._get_isu_cd(stockkey, stock)
+        return None
+
+    # union of the stocks of each provider keyed by (stockkey, market of the price cache), so that a stockkey given
+    # different markets by portfolios is prefetched for each of them. only the fields needed for price queries are copied
+    union_stocks = {'KIS': {}, 'CoinGecko': {}, 'KRX': {}}
+    union_coin_ids = {}  # coinIds of every CoinGecko stockgroup
+    kis_entry = None
+    for entry in entries:
+        if entry.portfolio is None:
+            continue
+        for stockgroupkey, stockgroup in entry.portfolio.ref_report['stockgroups'].items():
+            if stockgroupkey not in union_stocks.keys():
+                continue
+            if stockgroupkey == 'KIS' and kis_entry is None:
+                kis_entry = entry  # any account's token can be used for price queries
+            for coin_symb, coin_id in stockgroup.get('coinIds', {}).items():
+                if union_coin_ids.setdefault(coin_symb, coin_id) != coin_id:
+                    logger.warning(f'{coin_symb} is given different coinIds by portfolios. '
+                                   f'{union_coin_ids[coin_symb]} is prefetched')
+            for stockkey, stock in stockgroup['stocks'].items():
+                price_fields = {
+                    key: value for key, value in stock.items() if key in ('market', 'currency', 'isuCd', 'krxMarket')
+                }
+                union_key = (stockkey, cache_market(stockgroupkey, stockkey, stock))
+                if union_stocks[stockgroupkey].setdefault(union_key, price_fields) != price_fields:
+                    logger.warning(f'{stockkey} of {stockgroupkey} is given different {price_fields} by portfolios. '
+                                   f'{union_stocks[stockgroupkey][union_key]} is prefetched')
+
+    def split_stocks(stockgroupkey: str) -> list:
+        ''' stocks of the union split into as few stockgroups as possible, none of which holds a stockkey twice '''
+        split = []
+        for (stockkey, _), stock in union_stocks[stockgroupkey].items():
+            stocks = next((stocks for stocks in split if stockkey not in stocks.keys()), None)
+            if stocks is None:
+                stocks = {}
+                split.append(stocks)
+            stocks[stockkey] = stock
+
+        return split
+
+    def prefetch_kis():
+        for stocks in split_stocks('KIS'):
+            kis_stock = stockwrapper.KisStock(exchange_rate, exchange_rate, kis_entry.secrets_path, kis_entry.tokens_path,
+                                              {'stocks': stocks}, price_cache)
+            kis_stock._collect_prices()
+
+    def prefetch_gecko():
+        for stocks in split_stocks('CoinGecko'):
+            gecko_stock = stockwrapper.GeckoStock(exchange_rate, exchange_rate,
+                                                  {'stocks': stocks, 'coinIds': union_coin_ids}, price_cache)
+            gecko_stock._collect_international_prices()
+            gecko_stock._collect_domestic_prices()
+
+    def prefetch_krx():
+        for stocks in split_stocks('KRX'):
+            krx_stock = stockwrapper.KrxStock(exchange_rate, exchange_rate, {'stocks': stocks}, price_cache)
+            krx_stock._collect_prices()
+
+    prefetchers = {'KIS': prefetch_kis, 'CoinGecko': prefetch_gecko, 'KRX': prefetch_krx}
+    with ThreadPoolExecutor(max_workers=len(prefetchers)) as executor:
+        futures = {
+            stockgroupkey: executor.submit(prefetcher)
+            for stockgroupkey, prefetcher in prefetchers.items() if len(union_stocks[stockgroupkey]) != 0
+        }
+
+    for stockgroupkey, future in futures.items():
+        if future.exception() is not None:
+            # portfolios holding these stocks will fail with missing cached prices and be reported in the summary
+            logger.error(f'Prefetching {stockgroupkey} prices failed: {future.exception()!r}')
+
+
+def run_entry(entry: BatchEntry):
+    started = time.perf_counter()
+    try:
+        entry.portfolio.distribute_saving()
+        entry.portfolio.write_report_to_file(entry.output_report_path)
+    except Exception as e:
+        logger.error(f'Deriving {entry.output_report_path} from {entry.ref_report_path} failed: {e!r}')
+        entry.error = e
+    entry.elapsed_in_sec += time.perf_counter() - started
+
+
+def print_summary(entries: list, elapsed_in_sec: float):
+    from tabulate import tabulate
+
+    table_data = [
+        [entry.ref_report_path,
+         entry.output_report_path,
+         f'{entry.elapsed_in_sec:.2f}',
+         'OK' if entry.error is None else f'FAILED: {entry.error!r}']
+        for entry in entries
+    ]
+    print(tabulate(table_data,
+                   headers=('ref report', 'output report', 'seconds', 'result'),
+                   tablefmt='pretty',
+                   colalign=('left', 'left', 'right', 'left')))
+    num_failed = len([entry for entry in entries if entry.error is not None])
+    print(f'{len(entries) - num_failed} succeeded, {num_failed} failed in {elapsed_in_sec:.2f} seconds')
+
+
+@click.command()
+@click.option(
+    '--debug-level',
+    type=click.Choice(['DEBUG', 'INFO', 'WARNING'], case_sensitive=False),
+    default='INFO',
+    show_default=True,
+    help='debug level for logger'
+)
+@click.option(
+    '--saving-in-krw',
+    type=float,
+    default=0,
+    show_default=True,
+    help='default amount of money to save in KRW for each portfolio'
+)
+@click.option(
+    '--saving-in-usd',
+    type=float,
+    default=0.0,
+    show_default=True,
+    help='default amount of money to save in USD for each portfolio'
+)
+@click.option(
+    '--secrets-path',
+    type=click.Path(dir_okay=False),
+    default='secrets.json',
+    show_default=True,
+    help='default path to the secrets JSON file of each portfolio'
+)
+@click.option(
+    '--tokens-path',
+    type=click.Path(dir_okay=False),
+    default='tokens.json',
+    show_default=True,
+    help='default path to the tokens JSON file'
+)
+@click.option(
+    '--workers',
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help='number of portfolios computed in parallel'
+)
+@click.option(
+    '--refresh-workers',
+    type=click.IntRange(min=1),
+    default=portfolio.Portfolio.REFRESH_MAX_WORKERS,
+    show_default=True,
+    help='number of stockgroups of a portfolio to refresh in parallel'
+)
+@click.option(
+    '--unit-allocation',
+    type=click.Choice(['round', 'budget']),
+    default='round',
+    show_default=True,
+    help='round: round the units of each stock on its own, '
+         'budget: allocate units minimizing the deviation from need2invest within the saving'
+)
+@click.option(
+    '--cache-dir',
+    type=click.Path(file_okay=False),
+    default='.cache',
+    show_default=True,
+    help='directory of the price cache shared across runs'
+)
+@click.option(
+    '--refresh-prices',
+    is_flag=True,
+    help='ignore cached prices and fetch every price live (once for the whole batch)'
+)
+@click.option(
+    '--cached-prices-only',
+    is_flag=True,
+    help='use cached prices regardless of their age and never fetch prices live'
+)
+@click.option(
+    '--record-cassette',
+    type=click.Path(dir_okay=False),
+    default=None,
+    help='record every HTTP response into this cassette (secrets are redacted)'
+)
+@click.option(
+    '--replay-cassette',
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help='answer every HTTP request from this cassette without network access'
+)
+@click.option(
+    '--stand-in-url',
+    type=str,
+    default=None,
+    help='send every HTTP request to this stand-in server (see standin.py) instead of the real APIs'
+)
+@click.option(
+    '--trace-output',
+    type=click.Path(dir_okay=False),
+    default=None,
+    help='write timings of HTTP calls and stages as a JSON trace (Chrome trace event format)'
+)
+@click.option(
+    '--metrics-output',
+    type=click.Path(dir_okay=False),
+    default=None,
+    help='write timings of HTTP calls and stages as a Prometheus textfile'
+)
+@click.argument(
+    'source',
+    type=click.Path(exists=True),
+    nargs=1
+)
+@click.argument(
+    'output_dir',
+    type=click.Path(file_okay=False, writable=True),
+    nargs=1,
+    required=False
+)
+def main(
+    debug_level,
+    saving_in_krw,
+    saving_in_usd,
+    secrets_path,
+    tokens_path,
+    workers,
+    refresh_workers,
+    unit_allocation,
+    cache_dir,
+    refresh_prices,
+    cached_prices_only,
+    record_cassette,
+    replay_cassette,
+    stand_in_url,
+    trace_output,
+    metrics_output,
+    source,
+    output_dir
+):
+    ''' derive reports of many portfolios (a directory of ref reports or a manifest JSON) in one run '''
+    import coinindex
+    import httpclient
+    import marketcache
+    import metrics
+    import sessionindex
+    from concurrent.futures import ThreadPoolExecutor
+
+    setup_logger('autoinvestment_logger', debug_level)
+    logger.debug('Batch started')
+    if trace_output is not None or metrics_output is not None:
+        metrics.enable()
+    started = time.perf_counter()
+
+    if refresh_prices and cached_prices_only:
+        logger.error('--refresh-prices and --cached-prices-only cannot be given together')
+        raise Exception
+    elif refresh_prices:
+        price_cache_mode = 'refresh'
+    elif cached_prices_only:
+        price_cache_mode = 'cached-only'
+    else:
+        price_cache_mode = 'normal'
+
+    defaults = {
+        'secrets_path': secrets_path,
+        'tokens_path': tokens_path,
+        'saving_in_krw': saving_in_krw,
+        'saving_in_usd': saving_in_usd
+    }
+    entries = load_entries(source, output_dir, defaults)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    httpclient.install_transports(record_cassette, replay_cassette, stand_in_url)
+    sessionindex.configure(cache_dir)
+    coinindex.configure(cache_dir)
+    price_cache = marketcache.PriceCache(cache_dir, price_cache_mode)
+    exchange_rate_cache = marketcache.ExchangeRateCache(cache_dir)
+
+    # instantiate every portfolio. the exchange rate is looked up only once and shared
+    exchange_rate = None
+    for entry in entries:
+        entry_started = time.perf_counter()
+        try:
+            entry.portfolio = portfolio.Portfolio(entry.ref_report_path,
+                                                  entry.secrets_path,
+                                                  entry.tokens_path,
+                                                  entry.saving_in_krw,
+                                                  entry.saving_in_usd,
+                                                  refresh_max_workers=refresh_workers,
+                                                  unit_allocation=unit_allocation,
+                                                  price_cache=price_cache,
+                                                  exchange_rate_cache=exchange_rate_cache,
+                                                  exchange_rate=exchange_rate)
+            exchange_rate = entry.portfolio.exchange_rate
+        except Exception as e:
+            logger.error(f'Loading {entry.ref_report_path} failed: {e!r}')
+            entry.error = e
+        entry.elapsed_in_sec += time.perf_counter() - entry_started
+
+    if exchange_rate is not None:
+        # fetch market data once for all portfolios and let them read it from the price cache afterwards
+        prefetch_market_data(entries, exchange_rate, price_cache)
+        price_cache.mode = 'cached-only'
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            executor.map(run_entry, [entry for entry in entries if entry.error is None])
+    httpclient.close()  # e.g. saves a cassette being recorded
+
+    print_summary(entries, time.perf_counter() - started)
+    metrics.write(trace_output, metrics_output)
+    logger.debug('Batch ended')
+
+    if any(entry.error is not None for entry in entries):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
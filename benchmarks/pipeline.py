@@ -0,0 +1,332 @@
+''' end-to-end and per-stage benchmark of the refresh pipeline
+
+Derives reports of synthetic portfolios of increasing size against the local stand-in server (standin.py) or
+against a cassette recorded from it (cassette.py), so no real API is touched. Every stage is timed by wrapping the
+methods of Portfolio, PortfolioArrays and the stockgroup handlers: Portfolio.__init__ (incl. the exchange rate
+lookup), each stage of update_all() of KisStock/GeckoStock/KrxStock/BaseStock, the CA/VA derivations,
+_print_report and the JSON write.
+
+A synthetic portfolio of N stocks holds min(N // 2, MAX_KIS_STOCKS) KIS stocks (half DOM, half US), the three
+supported coins, KRX GLD and OTHER stocks for the rest. KIS stocks are capped since a real account holds at most
+a few hundred stocks (and the holdings inquiry stops at KisStock.HOLDINGS_MAX_PAGES pages).
+
+usage: python -m benchmarks.pipeline [--size N ...] [--strategy CA|VA ...] [--runs N] [--transport stand-in|replay]
+                                     [--latency-ms MS] [--kis-rate-limit] [--gecko-rate-limit] [--output JSON]
+                                     [--compare JSON]
+'''
+import contextlib
+import functools
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import click
+
+
+DEFAULT_SIZES = (10, 1000, 10000)
+MAX_KIS_STOCKS = 400
+HOLDINGS_PAGE_SIZE = 50
+COIN_SYMBS = ('BTC', 'ETH', 'BNB')
+SAVING_IN_KRW = 1000000.0
+# (module, class, methods) timed as stages. methods of BaseStock are reported per stockgroup handler class
+INSTRUMENTED_METHODS = (
+    ('portfolio', 'Portfolio', ('__init__', '_get_exchange_rate', 'distribute_saving', '_refresh_stockgroups',
+                                '_distribute_saving_CA', '_distribute_saving_VA', '_derive_units_to_invest',
+                                '_derive_cum_inv_deviation', '_derive_total_appraisement', '_print_report',
+                                'write_report_to_file')),
+    ('portfolioarrays', 'PortfolioArrays', ('__init__', 'write_back')),
+    ('stockwrapper', 'BaseStock', ('__init__', '_update_holdings', '_update_ca_invested', '_derive_appraisement')),
+    ('stockwrapper', 'KisStock', ('__init__', '_collect_prices', '_collect_holdings')),
+    ('stockwrapper', 'GeckoStock', ('_collect_international_prices', '_collect_domestic_prices',
+                                    '_query_ticker_page', '_derive_kimchi_premium')),
+    ('stockwrapper', 'KrxStock', ('_collect_prices',)),
+    ('krxdata', 'KrxMarketData', ('_generate_otp', '_download_prices'))
+)
+
+
+class StageTimer:
+    ''' accumulate the wall time of the instrumented methods per run. stages are labeled {class of self}.{method} '''
+
+    def __init__(self):
+        self.timings = {}  # label -> seconds of the current run
+        self.lock = threading.Lock()
+        self.active = threading.local()  # labels running in this thread (e.g. KisStock.__init__ calling super())
+        self.originals = []
+
+    def _wrap(self, method_name: str, method):
+        @functools.wraps(method)
+        def timed_method(obj, *args, **kwargs):
+            label = f'{type(obj).__name__}.{method_name}'
+            active_labels = self.active.__dict__.setdefault('labels', set())
+            if label in active_labels:  # already timed by an outer call
+                return method(obj, *args, **kwargs)
+
+            active_labels.add(label)
+            started = time.perf_counter()
+            try:
+                return method(obj, *args, **kwargs)
+            finally:
+                elapsed_in_sec = time.perf_counter() - started
+                active_labels.discard(label)
+                with self.lock:
+                    self.timings[label] = self.timings.get(label, 0.0) + elapsed_in_sec
+
+        return timed_method
+
+    def install(self):
+        import importlib
+
+        for module_name, class_name, method_names in INSTRUMENTED_METHODS:
+            cls = getattr(importlib.import_module(module_name), class_name)
+            for method_name in method_names:
+                method = cls.__dict__[method_name]
+                self.originals.append((cls, method_name, method))
+                setattr(cls, method_name, self._wrap(method_name, method))
+
+    def uninstall(self):
+        for cls, method_name, method in reversed(self.originals):
+            setattr(cls, method_name, method)
+        self.originals = []
+
+    def pop_run(self) -> dict:
+        ''' timings of the run so far in ms. starts a new run '''
+        with self.lock:
+            timings, self.timings = self.timings, {}
+        return {label: elapsed_in_sec * 1000 for label, elapsed_in_sec in timings.items()}
+
+
+def synthetic_portfolio(size: int, strategy: str) -> tuple:
+    ''' return (ref report, stand-in fixture) of a portfolio of size stocks '''
+    num_kis = min(size // 2, MAX_KIS_STOCKS)
+    num_dom = num_kis // 2
+    num_other = size - num_kis - len(COIN_SYMBS) - 1  # 1 for KRX GLD
+    weight = 1.0 / size
+    prices = {}
+    holdings = {'DOM': {}, 'US': {}}
+
+    def stock_entry(i: int, currency: str, price: float, holdings_: float) -> dict:
+        return {
+            'weight': weight,
+            'holdings': holdings_,
+            'price': price,
+            'currency': currency,
+            'cumSumCaInvested': 100.0 + i % 97,
+            'need2investCA': 10.0,
+            'need2invest': 5.0 + i % 7,
+            'cum_inv_deviation': float(i % 5 - 2)
+        }
+
+    kis_stocks = {}
+    for i in range(num_kis):
+        if i < num_dom:
+            stockkey, market, currency, price = f'{i:06d}', 'DOM', 'KRW', 10000.0 + 100 * (i % 500)
+        else:
+            stockkey, market, currency, price = f'US{i:04d}', 'NAS', 'USD', 20.0 + i % 480
+        kis_stocks[stockkey] = dict(stock_entry(i, currency, price, 1 + i % 30), market=market)
+        prices[stockkey] = price * 1.01
+        holdings[market if market == 'DOM' else 'US'][stockkey] = 2 + i % 30
+
+    coin_stocks = {coin_symb: dict(stock_entry(i, 'USD', 100.0 * (i + 1), 0.5), market='GLOBAL')
+                   for i, coin_symb in enumerate(COIN_SYMBS)}
+    krx_stocks = {'GLD': dict(stock_entry(0, 'KRW', 100000.0, 5), market='KRX')}
+    other_stocks = {f'OTHER{i:05d}': stock_entry(i, 'KRW' if i % 2 == 0 else 'USD', 1.0 if i % 2 == 0 else 50.0, 100 + i)
+                    for i in range(num_other)}
+
+    stockgroups = {}
+    if num_kis != 0:
+        stockgroups['KIS'] = {'accountNo': '12345678-01', 'stocks': kis_stocks}
+    stockgroups['CoinGecko'] = {'stocks': coin_stocks}
+    stockgroups['KRX'] = {'stocks': krx_stocks}
+    stockgroups['OTHER'] = {'stocks': other_stocks}
+    ref_report = {'strategy': strategy, 'exchange_rate': 1300.0, 'total_appraisement': 0.0, 'stockgroups': stockgroups}
+    fixture = {'prices': prices, 'holdings': holdings, 'holdings_page_size': HOLDINGS_PAGE_SIZE}
+
+    return ref_report, fixture
+
+
+def summarize(runs: list) -> dict:
+    ''' {stage: {median_ms, min_ms, max_ms}} of the timings of the runs '''
+    stages = {}
+    for label in sorted(set().union(*runs)):
+        elapsed_ms = [run.get(label, 0.0) for run in runs]
+        stages[label] = {'median_ms': statistics.median(elapsed_ms), 'min_ms': min(elapsed_ms), 'max_ms': max(elapsed_ms)}
+    return stages
+
+
+def run_pipeline(ref_report_path: str, output_report_path: str, secrets_path: str, tokens_path: str):
+    ''' one run of main.py: derive, print and write a report '''
+    import portfolio
+
+    my_portfolio = portfolio.Portfolio(ref_report_path, secrets_path, tokens_path, SAVING_IN_KRW, 0.0)
+    my_portfolio.distribute_saving()
+    with contextlib.redirect_stdout(io.StringIO()):
+        my_portfolio.print_this_report()
+    my_portfolio.write_report_to_file(output_report_path)
+
+
+def benchmark(size: int, strategy: str, runs: int, transport: str, latency_in_sec: float, tmp_dir: str,
+              timer: StageTimer) -> dict:
+    import cassette
+    import httpclient
+    import standin
+
+    ref_report, fixture = synthetic_portfolio(size, strategy)
+    case_name = f'{strategy}_{size}'
+    ref_report_path = os.path.join(tmp_dir, f'{case_name}_ref.json')
+    output_report_path = os.path.join(tmp_dir, f'{case_name}_out.json')
+    secrets_path = os.path.join(tmp_dir, 'secrets.json')
+    tokens_path = os.path.join(tmp_dir, 'tokens.json')
+    cassette_path = os.path.join(tmp_dir, f'{case_name}_cassette.json')
+    with open(ref_report_path, 'w') as f:
+        json.dump(ref_report, f)
+
+    server = standin.start_server(fixture=fixture, latency_in_sec=latency_in_sec)
+    try:
+        # warm-up run (issues the KIS token, builds the KRX session index and records the cassette to replay)
+        stand_in_transport = standin.StandInTransport(server.url, httpclient.default_pool)
+        if transport == 'replay':
+            httpclient.set_transport(cassette.RecordingTransport(cassette_path, stand_in_transport))
+        else:
+            httpclient.set_transport(stand_in_transport)
+        run_pipeline(ref_report_path, output_report_path, secrets_path, tokens_path)
+        if transport == 'replay':
+            httpclient.close()
+        timer.pop_run()
+
+        timings = []
+        for _ in range(runs):
+            if transport == 'replay':
+                # a fresh transport per run so that paginated requests are answered from the first page again
+                httpclient.set_transport(cassette.ReplayTransport(cassette_path, latency_in_sec))
+            started = time.perf_counter()
+            run_pipeline(ref_report_path, output_report_path, secrets_path, tokens_path)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            run_timings = timer.pop_run()
+            run_timings['total'] = elapsed_ms
+            timings.append(run_timings)
+    finally:
+        httpclient.set_transport(httpclient.default_pool)
+        server.shutdown()
+        server.server_close()
+
+    return {
+        'size': size,
+        'strategy': strategy,
+        'stockgroups': {stockgroupkey: len(stockgroup['stocks'])
+                        for stockgroupkey, stockgroup in ref_report['stockgroups'].items()},
+        'stages': summarize(timings)
+    }
+
+
+def compare(results: list, baseline: dict, max_slowdown: float, min_ms: float) -> list:
+    ''' print the ratio of every stage to the baseline and return the stages slower than max_slowdown '''
+    baseline_stages = {(result['size'], result['strategy']): result['stages'] for result in baseline['results']}
+    regressions = []
+    for result in results:
+        case = (result['size'], result['strategy'])
+        if case not in baseline_stages.keys():
+            continue
+        for label, stage in result['stages'].items():
+            if label not in baseline_stages[case].keys():
+                continue
+            baseline_ms = baseline_stages[case][label]['median_ms']
+            if baseline_ms < min_ms and stage['median_ms'] < min_ms:
+                continue  # too short to compare
+            ratio = stage['median_ms'] / baseline_ms if baseline_ms > 0.0 else float('inf')
+            print(f'{result["strategy"]:<3} {result["size"]:>6} {label:<42} '
+                  f'{baseline_ms:10.2f} -> {stage["median_ms"]:10.2f} ms  x{ratio:.2f}')
+            if max_slowdown is not None and ratio > max_slowdown:
+                regressions.append(f'{result["strategy"]} {result["size"]} {label} x{ratio:.2f}')
+
+    return regressions
+
+
+@click.command()
+@click.option('--size', 'sizes', type=click.IntRange(min=10), multiple=True, default=DEFAULT_SIZES, show_default=True,
+              help='number of stocks of a synthetic portfolio (repeatable)')
+@click.option('--strategy', 'strategies', type=click.Choice(['CA', 'VA']), multiple=True, default=('CA', 'VA'),
+              show_default=True, help='strategy of the synthetic portfolios (repeatable)')
+@click.option('--runs', type=click.IntRange(min=1), default=3, show_default=True, help='number of timed runs per case')
+@click.option('--transport', type=click.Choice(['stand-in', 'replay']), default='replay', show_default=True,
+              help='stand-in: a local server emulating the APIs, replay: responses recorded from it (no sockets)')
+@click.option('--latency-ms', type=float, default=0.0, show_default=True, help='delay of every HTTP response')
+@click.option('--kis-rate-limit/--no-kis-rate-limit', default=False, show_default=True,
+              help='keep the KIS request quota (dominates the KIS stages when on)')
+@click.option('--gecko-rate-limit/--no-gecko-rate-limit', default=False, show_default=True,
+              help='keep the CoinGecko request quota (dominates the CoinGecko stages after the first runs when on)')
+@click.option('--output', type=click.Path(dir_okay=False, writable=True), default=None, help='path to write results as JSON')
+@click.option('--compare', 'baseline_path', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='results JSON of a previous run to compare with')
+@click.option('--max-slowdown', type=float, default=None, help='fail if a stage is slower than the baseline by this ratio')
+@click.option('--min-ms', type=float, default=1.0, show_default=True,
+              help='stages shorter than this in both runs are not compared')
+def main(sizes, strategies, runs, transport, latency_ms, kis_rate_limit, gecko_rate_limit, output, baseline_path,
+         max_slowdown, min_ms):
+    import numpy as np
+    from tabulate import tabulate
+    import coinindex
+    import ratelimit
+    import sessionindex
+    import stockwrapper
+    from setup_logger import setup_logger
+
+    setup_logger('autoinvestment_logger', 'WARNING')
+    if not kis_rate_limit:
+        stockwrapper.KisStock.RATE_LIMITER = ratelimit.TokenBucket(1e9, 1000000)
+    if not gecko_rate_limit:
+        stockwrapper.GeckoStock.RATE_LIMITER = ratelimit.TokenBucket(1e9, 1000000)
+
+    timer = StageTimer()
+    timer.install()
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, 'secrets.json'), 'w') as f:
+                json.dump({'ExchangerateSecrets': {'AUTH_KEY': 'benchmark'},
+                           'KisSecrets': {'APP_KEY': 'benchmark', 'APP_SECRET': 'benchmark'}}, f)
+            sessionindex.configure(tmp_dir)
+            coinindex.configure(tmp_dir)
+
+            for size in sizes:
+                for strategy in strategies:
+                    results.append(benchmark(size, strategy, runs, transport, latency_ms / 1000.0, tmp_dir, timer))
+    finally:
+        timer.uninstall()
+
+    table_data = [[result['strategy'], result['size'], label, f'{stage["median_ms"]:.2f}', f'{stage["min_ms"]:.2f}',
+                   f'{stage["max_ms"]:.2f}']
+                  for result in results for label, stage in result['stages'].items()]
+    print(tabulate(table_data, headers=('strategy', 'stocks', 'stage', 'median ms', 'min ms', 'max ms'),
+                   tablefmt='simple', colalign=('left', 'right', 'left')))
+
+    summary = {
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'runs': runs,
+        'transport': transport,
+        'latency_ms': latency_ms,
+        'kis_rate_limit': kis_rate_limit,
+        'gecko_rate_limit': gecko_rate_limit,
+        'results': results
+    }
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(summary, f, indent=4)
+
+    if baseline_path is not None:
+        with open(baseline_path, 'r') as f:
+            baseline = json.load(f)
+        print(f'\ncompared with {baseline_path} (median)')
+        regressions = compare(results, baseline, max_slowdown, min_ms)
+        if len(regressions) != 0:
+            for regression in regressions:
+                print(f'FAIL: {regression}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
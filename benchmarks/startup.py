@@ -0,0 +1,116 @@
+''' start-up time benchmark of main.py
+
+Measures the wall time of a print-only run (main.py REF --print-report) and the import time of every module
+a full refresh needs, each in a fresh interpreter. Fails when a threshold is exceeded or when a heavy module
+leaks into the print-only path.
+
+usage: python -m benchmarks.startup [--runs N] [--max-print-only-ms MS] [--max-full-refresh-import-ms MS] [--output JSON]
+'''
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import click
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FULL_REFRESH_MODULES = ('main', 'portfolio', 'portfolioarrays', 'httpclient', 'marketcache', 'sessionindex', 'stockwrapper',
+                        'requests')
+HEAVY_MODULES = ('requests', 'urllib3', 'pandas', 'numpy', 'exchange_calendars')  # must not load on the print-only path
+SAMPLE_REPORT = {
+    'strategy': 'VA',
+    'exchange_rate': 1300.0,
+    'total_appraisement': 2000.0,
+    'stockgroups': {
+        'OTHER': {
+            'stocks': {
+                'KRW': {'weight': 0.5, 'holdings': 1300000, 'price': 1, 'currency': 'KRW', 'appraisement': 1000.0},
+                'USD': {'weight': 0.5, 'holdings': 1000, 'price': 1, 'currency': 'USD', 'appraisement': 1000.0}
+            }
+        }
+    }
+}
+
+
+def time_command(command: list, runs: int) -> dict:
+    elapsed_ms = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=REPO_DIR, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed_ms.append((time.perf_counter() - started) * 1000)
+
+    return {'median_ms': statistics.median(elapsed_ms), 'min_ms': min(elapsed_ms), 'max_ms': max(elapsed_ms)}
+
+
+def imported_modules(command: list) -> set:
+    ''' top-level names of the modules imported by command, collected with -X importtime '''
+    res = subprocess.run([sys.executable, '-X', 'importtime'] + command,
+                         cwd=REPO_DIR, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = set()
+    for line in res.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            modules.add(line.rsplit('|', 1)[1].strip().split('.')[0])
+
+    return modules
+
+
+@click.command()
+@click.option('--runs', type=click.IntRange(min=1), default=5, show_default=True, help='number of runs per measurement')
+@click.option('--max-print-only-ms', type=float, default=None, help='fail if the print-only run is slower than this')
+@click.option('--max-full-refresh-import-ms', type=float, default=None,
+              help='fail if importing the full-refresh modules is slower than this')
+@click.option('--output', type=click.Path(dir_okay=False, writable=True), default=None, help='path to write results as JSON')
+def main(runs, max_print_only_ms, max_full_refresh_import_ms, output):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report_path = os.path.join(tmp_dir, 'report.json')
+        with open(report_path, 'w') as f:
+            json.dump(SAMPLE_REPORT, f)
+        secrets_path = os.path.join(tmp_dir, 'secrets.json')  # not read on the print-only path but must exist
+        with open(secrets_path, 'w') as f:
+            json.dump({}, f)
+
+        print_only_command = [os.path.join(REPO_DIR, 'main.py'),
+                              '--debug-level=WARNING',
+                              f'--secrets-path={secrets_path}',
+                              '--print-report',
+                              report_path]
+        full_refresh_import_command = ['-c', f'import {", ".join(FULL_REFRESH_MODULES)}']
+
+        results = {
+            'python': sys.version.split()[0],
+            'runs': runs,
+            'baseline': time_command([sys.executable, '-c', 'pass'], runs),
+            'print_only': time_command([sys.executable] + print_only_command, runs),
+            'full_refresh_import': time_command([sys.executable] + full_refresh_import_command, runs),
+            'print_only_heavy_modules': sorted(imported_modules(print_only_command) & set(HEAVY_MODULES))
+        }
+
+    for name in ('baseline', 'print_only', 'full_refresh_import'):
+        print(f'{name:<20} median {results[name]["median_ms"]:8.1f} ms  '
+              f'(min {results[name]["min_ms"]:.1f}, max {results[name]["max_ms"]:.1f})')
+    print(f'heavy modules loaded by the print-only path: {results["print_only_heavy_modules"] or "none"}')
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    failures = []
+    if len(results['print_only_heavy_modules']) != 0:
+        failures.append(f'print-only path imports {results["print_only_heavy_modules"]}')
+    if max_print_only_ms is not None and results['print_only']['median_ms'] > max_print_only_ms:
+        failures.append(f'print-only run took {results["print_only"]["median_ms"]:.1f} ms > {max_print_only_ms} ms')
+    if max_full_refresh_import_ms is not None and results['full_refresh_import']['median_ms'] > max_full_refresh_import_ms:
+        failures.append(f'full-refresh imports took {results["full_refresh_import"]["median_ms"]:.1f} ms '
+                        f'> {max_full_refresh_import_ms} ms')
+
+    if len(failures) != 0:
+        for failure in failures:
+            print(f'FAIL: {failure}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+''' record real HTTP responses into a cassette (a JSON file) and replay them deterministically
+
+Install a transport with httpclient.set_transport(). Secrets in request parameters and bodies (SECRET_KEYS) and
+access tokens in response bodies (RESPONSE_SECRET_KEYS) are redacted before being written, so cassettes can be
+shared. Request headers are not recorded at all.
+
+Requests are matched by method, URL, parameters and body. Identical requests are answered in the recorded order
+(the last answer is repeated once exhausted). Since some requests carry dates (e.g. the search date of the exchange
+rate or the trading days of KRX), a request without an exact match is retried with its YYYYMMDD values shifted by
+the days passed since the recording, and then with every YYYYMMDD value ignored.
+'''
+import base64
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import date, datetime
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+SECRET_KEYS = ('authkey', 'appkey', 'appsecret')
+RESPONSE_SECRET_KEYS = ('access_token',)
+REDACTED = 'REDACTED'
+DATE_PATTERN = re.compile(r'(19|20)\d{6}')
+DATE_FORMAT = '%Y%m%d'
+ANY_DATE = '<date>'
+
+
+class CassetteResponse:
+    ''' the part of requests.Response used by this program '''
+
+    def __init__(self, status_code: int, headers: dict, content: bytes, encoding: str):
+        from requests.structures import CaseInsensitiveDict  # header names are case-insensitive as in requests
+
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_content(self, chunk_size: int = 1):
+        for offset in range(0, len(self.content), chunk_size):
+            yield self.content[offset:offset + chunk_size]
+
+    def close(self):
+        pass
+
+
+def _is_date(value: str) -> bool:
+    if not DATE_PATTERN.fullmatch(value):
+        return False
+    try:
+        datetime.strptime(value, DATE_FORMAT)
+    except ValueError:
+        return False
+    return True
+
+
+def _redact(fields: dict) -> dict:
+    return {key: REDACTED if key.lower() in SECRET_KEYS else value for key, value in fields.items()}
+
+
+def _canonical_fields(fields) -> dict:
+    ''' params or body of a request as a dict of strings (a body which is not a dict or JSON object is kept in "") '''
+    if fields is None:
+        return {}
+    if isinstance(fields, (bytes, str)):
+        try:
+            fields = json.loads(fields)
+        except ValueError:
+            return {'': fields.decode('utf-8', errors='replace') if isinstance(fields, bytes) else fields}
+        if not isinstance(fields, dict):
+            return {'': json.dumps(fields, sort_keys=True)}
+    return _redact({str(key): str(value) for key, value in dict(fields).items()})
+
+
+def _request_key(method: str, url: str, params: dict, data: dict, transform_date=None) -> str:
+    if transform_date is not None:
+        params = {key: transform_date(value) if _is_date(value) else value for key, value in params.items()}
+        data = {key: transform_date(value) if _is_date(value) else value for key, value in data.items()}
+    return json.dumps([method, url, sorted(params.items()), sorted(data.items())])
+
+
+class RecordingTransport:
+    ''' pass requests to another transport (e.g. httpclient.default_pool) and record the responses '''
+
+    def __init__(self, cassette_path: str, inner_transport):
+        self.cassette_path = cassette_path
+        self.inner_transport = inner_transport
+        self.interactions = []
+        self.lock = threading.Lock()
+
+    def request(self, method: str, url: str, timeout=None, **kwargs):
+        res = self.inner_transport.request(method, url, timeout=timeout, **kwargs)
+
+        body = res.content
+        try:
+            res_json = json.loads(body)
+            if isinstance(res_json, dict) and any(key in res_json.keys() for key in RESPONSE_SECRET_KEYS):
+                body = json.dumps({key: REDACTED if key in RESPONSE_SECRET_KEYS else value
+                                   for key, value in res_json.items()}).encode('utf-8')
+        except ValueError:
+            pass
+
+        interaction = {
+            'method': method,
+            'url': url,
+            'params': _canonical_fields(kwargs.get('params')),
+            'data': _canonical_fields(kwargs.get('data')),
+            'status_code': res.status_code,
+            'headers': dict(res.headers),
+            'encoding': res.encoding,
+            'content': base64.b64encode(body).decode('ascii')
+        }
+        with self.lock:
+            self.interactions.append(interaction)
+
+        return res
+
+    def close(self):
+        ''' write the cassette and close the inner transport '''
+        with self.lock:
+            cassette = {'recorded_on': date.today().isoformat(), 'interactions': self.interactions}
+            os.makedirs(os.path.dirname(os.path.abspath(self.cassette_path)), exist_ok=True)
+            tmp_fname = f'{self.cassette_path}.{os.getpid()}.tmp'
+            with open(tmp_fname, 'w') as f:
+                json.dump(cassette, f, indent=1)
+            os.replace(tmp_fname, self.cassette_path)
+            logger.info(f'Recorded {len(self.interactions)} HTTP interactions into {self.cassette_path}')
+        self.inner_transport.close()
+
+
+class ReplayTransport:
+    ''' answer requests from a cassette without any network access '''
+
+    def __init__(self, cassette_path: str, latency_in_sec: float = 0.0):
+        ''' latency_in_sec: delay added to every response (e.g. to emulate the network in benchmarks) '''
+        self.latency_in_sec = latency_in_sec
+        self.lock = threading.Lock()
+        with open(cassette_path, 'r') as f:
+            cassette = json.load(f)
+
+        # shift of the dates of requests made today to the dates of the recording
+        recorded_on = date.fromisoformat(cassette['recorded_on'])
+        self.date_shift = recorded_on - date.today()
+
+        # request key -> [response, ...] and the next index to answer. exact keys and keys ignoring dates
+        self.responses = {}
+        self.next_index = {}
+        for interaction in cassette['interactions']:
+            response = CassetteResponse(interaction['status_code'],
+                                        interaction['headers'],
+                                        base64.b64decode(interaction['content']),
+                                        interaction['encoding'])
+            keys = {
+                _request_key(interaction['method'], interaction['url'], interaction['params'], interaction['data']),
+                _request_key(interaction['method'], interaction['url'], interaction['params'], interaction['data'],
+                             lambda value: ANY_DATE)
+            }  # the same key twice for requests without dates
+            for key in keys:
+                self.responses.setdefault(key, []).append(response)
+                self.next_index.setdefault(key, 0)
+
+    def _shift_date(self, value: str) -> str:
+        return datetime.strftime(datetime.strptime(value, DATE_FORMAT) + self.date_shift, DATE_FORMAT)
+
+    def request(self, method: str, url: str, timeout=None, **kwargs) -> CassetteResponse:
+        params = _canonical_fields(kwargs.get('params'))
+        data = _canonical_fields(kwargs.get('data'))
+        keys = (
+            _request_key(method, url, params, data),
+            _request_key(method, url, params, data, self._shift_date),
+            _request_key(method, url, params, data, lambda value: ANY_DATE)
+        )
+
+        if self.latency_in_sec > 0.0:
+            time.sleep(self.latency_in_sec)
+
+        with self.lock:
+            for key in keys:
+                if key in self.responses.keys():
+                    responses = self.responses[key]
+                    index = self.next_index[key]
+                    self.next_index[key] = min(index + 1, len(responses) - 1)
+                    return responses[index]
+
+        error_msg = f'No recorded response for {method} {url} (params {params}, data {data}) in the cassette'
+        logger.error(error_msg)
+        raise Exception(error_msg)
+
+    def close(self):
+        pass
@@ -0,0 +1,155 @@
+import array
+import logging
+import os
+import threading
+import time
+import httpclient
+import metrics
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+class CoinIndex:
+    ''' symbol -> id index of the coins listed by CoinGecko, serialized to a compact file
+
+    The coin list has tens of thousands of coins, so the file is laid out to be loaded without parsing: an array of
+    unsigned ints (built time in epoch seconds, number of entries and the end offset of each entry) followed by the
+    entries 'SYMBOL\\tid\\n' in utf-8 sorted by symbol. Lookups binary search the entries as bytes, so the index takes
+    about as much memory as the file. A missing index is built before the first lookup, and a stale one is still used
+    while a new one is built in the background.
+    '''
+    PROVIDER = 'CoinGecko'
+    INDEX_FNAME = 'coingecko_coins.bin'
+    COIN_LIST_URL = 'https://api.coingecko.com/api/v3/coins/list'
+    BASE_HEADER = {'content-type': 'application/json'}
+    HEADER_SIZE = 2
+    REFRESH_INTERVAL_IN_SEC = 24 * 60 * 60  # coins are listed (and delisted) every day
+
+    def __init__(self, index_dir: str):
+        self.index_fname = os.path.join(index_dir, CoinIndex.INDEX_FNAME)
+        self.lock = threading.Lock()
+        self.built_time = None
+        self.offsets = array.array('I')  # end offset of each entry in entries
+        self.entries = b''
+        self.refreshing = None  # thread building a new index in the background
+
+        try:
+            self._load()
+        except (FileNotFoundError, EOFError, ValueError):
+            logger.debug(f'No valid coin index at {self.index_fname}')
+
+    def _load(self):
+        header = array.array('I')
+        offsets = array.array('I')
+        with open(self.index_fname, 'rb') as f:
+            header.fromfile(f, CoinIndex.HEADER_SIZE)
+            offsets.fromfile(f, header[1])
+            entries = f.read()
+        if len(entries) != (offsets[-1] if len(offsets) != 0 else 0):
+            raise ValueError
+
+        self.built_time, self.offsets, self.entries = header[0], offsets, entries
+
+    @metrics.instrumented()
+    def _fetch_coin_list(self) -> list:
+        import stockwrapper  # imports this module
+
+        stockwrapper.GeckoStock.RATE_LIMITER.acquire()  # the coin list counts toward the per-minute quota as well
+        res = httpclient.get(CoinIndex.COIN_LIST_URL, headers=CoinIndex.BASE_HEADER)
+        if res.status_code != 200:
+            error_msg = f'Fetching the CoinGecko coin list failed (HTTP {res.status_code})'
+            logger.error(error_msg)
+            raise Exception(error_msg)
+
+        return res.json()
+
+    def _build(self):
+        logger.info('Building the CoinGecko coin index')
+        coins = self._fetch_coin_list()
+        entries = sorted({
+            (coin['symbol'].upper().encode('utf-8'), coin['id'].encode('utf-8')) for coin in coins
+            if not any(separator in coin['symbol'] + coin['id'] for separator in '\t\n')
+        })
+
+        offsets = array.array('I')
+        entries_bytes = bytearray()
+        for symbol, coin_id in entries:
+            entries_bytes += symbol + b'\t' + coin_id + b'\n'
+            offsets.append(len(entries_bytes))
+        header = array.array('I', [int(time.time()), len(offsets)])
+
+        # write atomically so that concurrent runs never read a partially written index
+        os.makedirs(os.path.dirname(self.index_fname) or '.', exist_ok=True)
+        tmp_fname = f'{self.index_fname}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_fname, 'wb') as f:
+            f.write(header.tobytes() + offsets.tobytes() + entries_bytes)
+        os.replace(tmp_fname, self.index_fname)
+
+        return header[0], offsets, bytes(entries_bytes)
+
+    def _refresh_in_background(self):
+        try:
+            built = self._build()
+        except Exception as e:
+            logger.warning(f'Refreshing the CoinGecko coin index failed ({e!r}). The current index is kept.')
+            return
+
+        with self.lock:
+            self.built_time, self.offsets, self.entries = built
+
+    def _entry(self, index: int) -> tuple:
+        start = self.offsets[index - 1] if index != 0 else 0
+        symbol, coin_id = self.entries[start:self.offsets[index] - 1].split(b'\t')
+
+        return symbol, coin_id
+
+    def coin_ids(self, symbol: str) -> list:
+        ''' ids of the coins listed with the symbol (case-insensitive) '''
+        with self.lock:
+            if self.built_time is None:
+                self.built_time, self.offsets, self.entries = self._build()
+            elif time.time() - self.built_time > CoinIndex.REFRESH_INTERVAL_IN_SEC and \
+                    (self.refreshing is None or not self.refreshing.is_alive()):
+                self.refreshing = threading.Thread(target=self._refresh_in_background, daemon=True)
+                self.refreshing.start()
+
+            # lower bound of the symbol
+            key = symbol.upper().encode('utf-8')
+            left, right = 0, len(self.offsets)
+            while left < right:
+                middle = (left + right) // 2
+                if self._entry(middle)[0] < key:
+                    left = middle + 1
+                else:
+                    right = middle
+
+            coin_ids = []
+            while left < len(self.offsets) and self._entry(left)[0] == key:
+                coin_ids.append(self._entry(left)[1].decode('utf-8'))
+                left += 1
+
+            return coin_ids
+
+
+DEFAULT_INDEX_DIR = '.cache'
+index_dir = DEFAULT_INDEX_DIR
+coin_index = None
+coin_index_lock = threading.Lock()
+
+
+def configure(new_index_dir: str):
+    ''' change the directory of the coin index file '''
+    global index_dir, coin_index
+    with coin_index_lock:
+        index_dir = new_index_dir
+        coin_index = None
+
+
+def get_coin_index() -> CoinIndex:
+    global coin_index
+    with coin_index_lock:
+        if coin_index is None:
+            coin_index = CoinIndex(index_dir)
+
+        return coin_index
@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+import metrics
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+class SessionPool:
+    ''' keep-alive requests.Session per host so that TCP connections and TLS handshakes are reused '''
+    POOL_MAXSIZE = 10  # max number of connections kept alive per host
+    CONNECT_TIMEOUT = 5.0  # in seconds
+    READ_TIMEOUT = 30.0  # in seconds
+
+    def __init__(self,
+                 pool_maxsize: int = POOL_MAXSIZE,
+                 connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT):
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.sessions = {}  # '{scheme}://{host}:{port}' -> requests.Session
+        self.lock = threading.Lock()
+
+    def get_session(self, url: str) -> 'requests.Session':
+        import requests  # imported on first use to keep the start-up of print-only runs fast
+        from requests.adapters import HTTPAdapter
+
+        url_split = urlsplit(url)
+        host_key = f'{url_split.scheme}://{url_split.netloc}'
+
+        with self.lock:
+            if host_key not in self.sessions.keys():
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session = requests.Session()
+                session.mount(f'{url_split.scheme}://', adapter)
+                self.sessions[host_key] = session
+
+            return self.sessions[host_key]
+
+    def request(self, method: str, url: str, timeout=None, **kwargs) -> 'requests.Response':
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+
+        return self.get_session(url).request(method, url, timeout=timeout, **kwargs)
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+
+
+default_pool = SessionPool()
+# every request of this module goes through the transport. a transport is any object with request() and close() like
+# SessionPool, e.g. cassette.RecordingTransport, cassette.ReplayTransport or standin.StandInTransport
+transport = default_pool
+
+
+def set_transport(new_transport):
+    global transport
+    transport = new_transport
+
+
+def close():
+    ''' close the transport (e.g. a cassette being recorded is saved) '''
+    transport.close()
+
+
+def install_transports(record_cassette: str = None, replay_cassette: str = None, stand_in_url: str = None,
+                       replay_latency_in_sec: float = 0.0):
+    ''' set the transport given by the command line options
+
+    replay_cassette: answer every request from a cassette (cannot be combined with the others)
+    stand_in_url: send every request to a stand-in server (see standin.py) instead of the real hosts
+    record_cassette: record the responses of the real hosts (or of the stand-in server) into a cassette
+    '''
+    if replay_cassette is not None:
+        if record_cassette is not None or stand_in_url is not None:
+            logger.error('a replayed cassette cannot be combined with recording or a stand-in server')
+            raise ValueError
+        import cassette
+
+        set_transport(cassette.ReplayTransport(replay_cassette, replay_latency_in_sec))
+        return
+
+    new_transport = default_pool
+    if stand_in_url is not None:
+        import standin
+
+        new_transport = standin.StandInTransport(stand_in_url, new_transport)
+    if record_cassette is not None:
+        import cassette
+
+        new_transport = cassette.RecordingTransport(record_cassette, new_transport)
+    set_transport(new_transport)
+
+
+def configure(pool_maxsize: int = None, connect_timeout: float = None, read_timeout: float = None):
+    ''' change the settings of the default pool. sessions opened with the old settings are closed '''
+    if pool_maxsize is not None:
+        default_pool.pool_maxsize = pool_maxsize
+    if connect_timeout is not None:
+        default_pool.connect_timeout = connect_timeout
+    if read_timeout is not None:
+        default_pool.read_timeout = read_timeout
+    default_pool.close()
+
+
+def request(method: str, url: str, retries: int = 0, **kwargs) -> 'requests.Response':
+    ''' retries: number of earlier attempts of the same call made by a retry loop of the caller (for the metrics) '''
+    if metrics.recorder is None:
+        return transport.request(method, url, **kwargs)
+
+    started = time.perf_counter()
+    try:
+        res = transport.request(method, url, **kwargs)
+    except Exception:
+        metrics.record_http(method, url, started, None, kwargs, retries)
+        raise
+    metrics.record_http(method, url, started, res, kwargs, retries)
+
+    return res
+
+
+def get(url: str, **kwargs) -> 'requests.Response':
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs) -> 'requests.Response':
+    return request('POST', url, **kwargs)
@@ -0,0 +1,188 @@
+''' incremental re-derivation of a derived report after some of its inputs change
+
+IncrementalReport keeps the PortfolioArrays of a report derived by Portfolio.distribute_saving() and a dependency
+graph between the inputs of the derivation and the derived fields:
+
+    inputs       saving_in_krw, saving_in_usd, exchange_rate (scalars) and price, holdings, weight (per stock)
+    derived      saving (scalar), appraisement, need2invest_ca, cum_sum_ca_invested, need2invest_va, need2invest,
+                 need2invest_in_units, cum_inv_deviation (per stock) and total_appraisement (scalar)
+
+update_*() mark the changed inputs (of the changed stocks) invalid. recompute() walks the derived nodes in
+a topological order and re-derives each of them only for the stocks whose dependencies were invalidated: a per-stock
+node depends on the same stock of per-stock nodes and on every stock through scalar nodes. The results are written
+back only to the affected stock dicts of the report. A report recomputed this way is the same as one derived from
+scratch with the same inputs.
+
+    my_portfolio.distribute_saving()
+    incremental_report = IncrementalReport(my_portfolio)
+    incremental_report.update_saving(saving_in_krw=2000000.0)
+    incremental_report.update_prices('KIS', {'005930': 71500.0})
+    report = incremental_report.recompute()
+'''
+import logging
+import numpy as np
+import metrics
+import reportmodel
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+class IncrementalReport:
+    INPUT_NODES = ('saving_in_krw', 'saving_in_usd', 'exchange_rate', 'price', 'holdings', 'weight')
+    SCALAR_NODES = ('saving_in_krw', 'saving_in_usd', 'exchange_rate', 'saving', 'total_appraisement')
+    # derived node -> nodes it depends on, in a topological order
+    DEPENDENCIES = {
+        'saving': ('saving_in_krw', 'saving_in_usd', 'exchange_rate'),
+        'appraisement': ('price', 'holdings', 'exchange_rate'),
+        'need2invest_ca': ('saving', 'weight'),
+        'cum_sum_ca_invested': ('need2invest_ca', 'appraisement', 'exchange_rate'),
+        'need2invest_va': ('cum_sum_ca_invested', 'need2invest_ca', 'appraisement'),
+        'need2invest': ('need2invest_ca', 'need2invest_va'),
+        'need2invest_in_units': ('need2invest', 'price', 'exchange_rate'),
+        'cum_inv_deviation': ('holdings', 'price', 'exchange_rate'),
+        'total_appraisement': ('appraisement',)
+    }
+
+    def __init__(self, derived_portfolio: 'portfolio.Portfolio'):
+        ''' derived_portfolio: a Portfolio after distribute_saving() '''
+        self.portfolio = derived_portfolio
+        self.report = derived_portfolio.this_report
+        self.arrays = derived_portfolio.this_arrays
+        self.element_indices = {stockkey: index for index, stockkey in enumerate(self.arrays.stockkeys)}
+
+        self.dependencies = dict(IncrementalReport.DEPENDENCIES)
+        if self.report['strategy'] == 'CA':
+            del self.dependencies['need2invest_va']
+            self.dependencies['need2invest'] = ('need2invest_ca',)
+        if self.arrays.allocation == 'budget':
+            # units are allocated across every stock within the saving
+            self.dependencies['need2invest_in_units'] += ('saving',)
+            self.whole_nodes = ('need2invest_in_units',)
+        else:
+            self.whole_nodes = ()
+
+        self.invalid = {node: np.zeros(len(self.arrays), dtype=bool) for node in IncrementalReport.INPUT_NODES}
+        self.num_rederived = {node: 0 for node in self.dependencies.keys()}  # re-derivations (of stocks) so far per node
+
+    def _invalidate(self, node: str, stockkeys=None):
+        ''' stockkeys: (stockgroupkey, stockkey) of the changed stocks (every stock if None) '''
+        if stockkeys is None:
+            self.invalid[node][:] = True
+        else:
+            self.invalid[node][[self.element_indices[stockkey] for stockkey in stockkeys]] = True
+
+    def _update_stocks(self, node: str, field: str, stockgroupkey: str, values: dict):
+        unknown_stockkeys = [stockkey for stockkey in values.keys()
+                             if (stockgroupkey, stockkey) not in self.element_indices.keys()]
+        if len(unknown_stockkeys) != 0:
+            logger.error(f'{unknown_stockkeys} are not stocks of stockgroup {stockgroupkey} of the report')
+            raise ValueError
+
+        column = getattr(self.arrays, node)
+        stocks = self.report['stockgroups'][stockgroupkey]['stocks']
+        for stockkey, value in values.items():
+            column[self.element_indices[(stockgroupkey, stockkey)]] = value
+            stocks[stockkey][field] = value  # inputs are written as given
+        self._invalidate(node, [(stockgroupkey, stockkey) for stockkey in values.keys()])
+
+    def update_prices(self, stockgroupkey: str, prices: dict):
+        ''' prices: stockkey -> price in the currency of the stock '''
+        self._update_stocks('price', 'price', stockgroupkey, prices)
+
+    def update_holdings(self, stockgroupkey: str, holdings: dict):
+        ''' holdings: stockkey -> holdings '''
+        self._update_stocks('holdings', 'holdings', stockgroupkey, holdings)
+
+    def update_weights(self, stockgroupkey: str, weights: dict):
+        ''' weights: stockkey -> weight. the sum of all weights is checked in recompute() '''
+        self._update_stocks('weight', 'weight', stockgroupkey, weights)
+
+    def update_saving(self, saving_in_krw: float = None, saving_in_usd: float = None):
+        if saving_in_krw is not None:
+            self.portfolio.savingInKRW = saving_in_krw
+            self.report['savingInKRW'] = saving_in_krw
+            self._invalidate('saving_in_krw')
+        if saving_in_usd is not None:
+            self.portfolio.savingInUSD = saving_in_usd
+            self.report['savingInUSD'] = saving_in_usd
+            self._invalidate('saving_in_usd')
+
+    def update_exchange_rate(self, exchange_rate: float):
+        ''' prices are kept as they are (i.e. prices converted with the old exchange rate are not refetched) '''
+        self.portfolio.exchange_rate = exchange_rate
+        self.report['exchange_rate'] = exchange_rate
+        self.arrays.exchange_rate = exchange_rate
+        self._invalidate('exchange_rate')
+
+    def refresh_stockgroup(self, stockgroupkey: str):
+        ''' refetch the prices and holdings of a stockgroup only '''
+        refreshed_stocks = self.portfolio.refresh_stockgroup(stockgroupkey)['stocks']
+        self.update_prices(stockgroupkey, {stockkey: stock['price'] for stockkey, stock in refreshed_stocks.items()})
+        self.update_holdings(stockgroupkey, {stockkey: stock['holdings'] for stockkey, stock in refreshed_stocks.items()})
+
+    def _rederive(self, node: str, sel):
+        arrays = self.arrays
+        if node == 'saving':
+            self.portfolio.saving = self.portfolio.savingInKRW / self.portfolio.exchange_rate + self.portfolio.savingInUSD
+            self.report['saving'] = self.portfolio.saving
+        elif node == 'appraisement':
+            arrays.appraisement[sel] = arrays.appraisement_of(sel)
+        elif node == 'need2invest_ca':
+            arrays.need2invest_ca[sel] = self.report['saving'] * arrays.weight[sel]
+        elif node == 'cum_sum_ca_invested':
+            arrays.cum_sum_ca_invested[sel] = arrays.cum_sum_ca_invested_of(sel)
+        elif node == 'need2invest_va':
+            arrays.need2invest_va[sel] = arrays.need2invest_va_of(sel)
+        elif node == 'need2invest':
+            pass  # an alias of need2invest_ca (CA) or need2invest_va (VA)
+        elif node == 'need2invest_in_units':
+            if arrays.allocation == 'round':
+                arrays.need2invest_in_units[sel] = arrays.rounded_units_of(sel)
+            else:
+                arrays.derive_units_to_invest(arrays.allocation, self.report['saving'])
+                self.report['leftover_cash'] = arrays.leftover_cash
+        elif node == 'cum_inv_deviation':
+            arrays.cum_inv_deviation[sel] = arrays.cum_inv_deviation_of(sel)
+        elif node == 'total_appraisement':
+            self.report['total_appraisement'] = arrays.total_appraisement()
+
+    @metrics.instrumented(provider='Portfolio')
+    def recompute(self) -> dict:
+        ''' re-derive the invalidated fields and return the report '''
+        sum_of_weights = float(np.sum(self.arrays.weight))
+        if self.invalid['weight'].any() and round(sum_of_weights, reportmodel.WEIGHT_SUM_DIGITS) != 1.0:
+            logger.error(f'sum of all weights should be 1.0, but {sum_of_weights} given')
+            raise ValueError
+
+        invalid = dict(self.invalid)
+        for node, dependencies in self.dependencies.items():
+            node_invalid = np.zeros(len(self.arrays), dtype=bool)
+            for dependency in dependencies:
+                if dependency in IncrementalReport.SCALAR_NODES or dependency in self.whole_nodes:
+                    if invalid[dependency].any():
+                        node_invalid[:] = True
+                else:
+                    node_invalid |= invalid[dependency]
+            if (node in IncrementalReport.SCALAR_NODES or node in self.whole_nodes) and node_invalid.any():
+                node_invalid[:] = True
+            invalid[node] = node_invalid
+
+            indices = node_invalid.nonzero()[0]
+            if len(indices) != 0:
+                self._rederive(node, slice(None) if len(indices) == len(self.arrays) else indices)
+                self.num_rederived[node] += 1 if node in IncrementalReport.SCALAR_NODES else len(indices)
+
+        # per-stock fields of the affected stocks only
+        affected = np.zeros(len(self.arrays), dtype=bool)
+        for node in self.dependencies.keys():
+            if node not in IncrementalReport.SCALAR_NODES:
+                affected |= invalid[node]
+        affected_indices = affected.nonzero()[0]
+        if len(affected_indices) != 0:
+            self.arrays.write_back(None if len(affected_indices) == len(self.arrays) else affected_indices.tolist())
+
+        for node_invalid in self.invalid.values():
+            node_invalid[:] = False
+
+        return self.report
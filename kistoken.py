@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+try:
+    import fcntl
+except ImportError:  # e.g. Windows. tokens are then only coordinated within a process
+    fcntl = None
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+class TokenManager:
+    ''' KIS access token of a tokens file, shared by every KisStock of this process and coordinated across processes
+
+    The token is cached in memory. The tokens file is read and (re)written only while holding an exclusive lock on
+    a sidecar lock file, so that concurrent runs reuse the token issued by whichever run came first instead of each
+    issuing (and overwriting) their own. The file is replaced atomically so it is never read partially written.
+
+    The expiry of a token is taken from expires_in of the OAuth response. A token is refreshed in the background
+    once it gets within REFRESH_AHEAD_IN_SEC of its expiry and synchronously once it gets within
+    EXPIRY_MARGIN_IN_SEC of it.
+    '''
+    TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+    DEFAULT_LIFETIME_IN_SEC = 86400  # tokens files written without ACCESS_TOKEN_EXPIRES_AT (KIS tokens last 24H)
+    REFRESH_AHEAD_IN_SEC = 3600
+    EXPIRY_MARGIN_IN_SEC = 60
+
+    def __init__(self, tokens_fname: str, issue_access_token):
+        ''' issue_access_token: callable returning (access token, expires_in in seconds) of a newly issued token '''
+        self.tokens_fname = tokens_fname
+        self.lock_fname = f'{tokens_fname}.lock'
+        self.issue_access_token = issue_access_token
+        self.lock = threading.Lock()
+        self.access_token = None
+        self.expires_at = None
+        self.refresh_timer = None
+
+    def _read_tokens_file(self) -> dict:
+        try:
+            with open(self.tokens_fname, 'r') as f_token:
+                return json.load(f_token)
+        except FileNotFoundError:
+            return {}
+
+    def _load_from_tokens_file(self) -> bool:
+        ''' load the token of the tokens file into memory. returns False if there is none '''
+        KisTokens = self._read_tokens_file().get('KisTokens', {})
+        if 'ACCESS_TOKEN' not in KisTokens.keys() or 'ACCESS_TOKEN_TIME' not in KisTokens.keys():
+            return False
+
+        if 'ACCESS_TOKEN_EXPIRES_AT' in KisTokens.keys():
+            expires_at = datetime.strptime(KisTokens['ACCESS_TOKEN_EXPIRES_AT'], TokenManager.TIME_FORMAT)
+        else:
+            expires_at = datetime.strptime(KisTokens['ACCESS_TOKEN_TIME'], TokenManager.TIME_FORMAT) \
+                + timedelta(seconds=TokenManager.DEFAULT_LIFETIME_IN_SEC)
+        self.access_token = KisTokens['ACCESS_TOKEN']
+        self.expires_at = expires_at
+
+        return True
+
+    def _write_tokens_file(self, issued_at: datetime):
+        f_token_loaded = self._read_tokens_file()
+        f_token_loaded['KisTokens'] = {
+            'ACCESS_TOKEN': self.access_token,
+            'ACCESS_TOKEN_TIME': datetime.strftime(issued_at, TokenManager.TIME_FORMAT),
+            'ACCESS_TOKEN_EXPIRES_AT': datetime.strftime(self.expires_at, TokenManager.TIME_FORMAT)
+        }
+
+        # write atomically so that concurrent runs never read a partially written tokens file
+        tmp_fname = f'{self.tokens_fname}.{os.getpid()}.tmp'
+        with open(tmp_fname, 'w') as f_token:
+            json.dump(f_token_loaded, f_token, indent=4)
+        os.replace(tmp_fname, self.tokens_fname)
+
+    def _seconds_left(self) -> float:
+        if self.expires_at is None:
+            return 0.0
+        return (self.expires_at - datetime.today()).total_seconds()
+
+    def _refresh(self, min_seconds_left: float):
+        ''' make sure the token in memory is valid for more than min_seconds_left, issuing a new one if needed.
+        called with self.lock held '''
+        with open(self.lock_fname, 'a') as f_lock:
+            if fcntl is not None:
+                fcntl.flock(f_lock, fcntl.LOCK_EX)  # released when f_lock is closed
+            # another process may have issued a new token while this process was waiting for the lock
+            if self._load_from_tokens_file() and self._seconds_left() > min_seconds_left:
+                logger.debug(f'Using the access token of {self.tokens_fname} (expires at {self.expires_at})')
+            else:
+                logger.info(f'Issuing a new KIS access token for {self.tokens_fname}')
+                issued_at = datetime.today()
+                self.access_token, expires_in = self.issue_access_token()
+                self.expires_at = issued_at + timedelta(seconds=expires_in)
+                self._write_tokens_file(issued_at)
+
+        self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        ''' refresh the token in the background REFRESH_AHEAD_IN_SEC before its expiry '''
+        if self.refresh_timer is not None:
+            self.refresh_timer.cancel()
+        delay = max(self._seconds_left() - TokenManager.REFRESH_AHEAD_IN_SEC, 0.0)
+        self.refresh_timer = threading.Timer(delay, self._refresh_in_background)
+        self.refresh_timer.daemon = True  # never keeps the process alive
+        self.refresh_timer.start()
+
+    def _refresh_in_background(self):
+        with self.lock:
+            try:
+                if self._seconds_left() <= TokenManager.REFRESH_AHEAD_IN_SEC:
+                    self._refresh(TokenManager.REFRESH_AHEAD_IN_SEC)
+            except Exception as e:
+                # the current token is still valid. get_token() retries synchronously once it nearly expires
+                logger.warning(f'Refreshing the access token of {self.tokens_fname} in the background failed: {e!r}')
+
+    def get_token(self) -> str:
+        with self.lock:
+            if self._seconds_left() <= TokenManager.EXPIRY_MARGIN_IN_SEC:
+                self._refresh(TokenManager.EXPIRY_MARGIN_IN_SEC)
+            return self.access_token
+
+    def close(self):
+        with self.lock:
+            if self.refresh_timer is not None:
+                self.refresh_timer.cancel()
+                self.refresh_timer = None
+
+
+token_managers = {}  # absolute path of tokens file -> TokenManager
+token_managers_lock = threading.Lock()
+
+
+def get_token_manager(tokens_fname: str, issue_access_token) -> TokenManager:
+    ''' the TokenManager of a tokens file. every KisStock of this process using the same tokens file shares it '''
+    tokens_key = os.path.abspath(tokens_fname)
+    with token_managers_lock:
+        if tokens_key not in token_managers.keys():
+            token_managers[tokens_key] = TokenManager(tokens_key, issue_access_token)
+        return token_managers[tokens_key]
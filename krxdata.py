@@ -0,0 +1,191 @@
+''' prices of KRX general products (gold, emission allowances, ...) from the KRX data portal (data.krx.co.kr)
+
+A query downloads the daily prices of all products of a market for a trading day with one OTP and one CSV download,
+so any number of products of the market costs the same. The euc-kr CSV is decoded incrementally while it is
+streamed and the download stops as soon as every requested product is found. OTPs are cached for
+OTP_VALIDITY_IN_SEC per request (e.g. every KrxStock of a batch run querying the same market and day reuses one).
+
+Products are identified by their standard code (isuCd, e.g. KRD040200002 for 금 99.99_1Kg). The CSV shows the short
+code (종목코드), which is the 8 characters after the first 3 of the standard code.
+Markets are given in MARKETS by the bld (screen) of their all-products daily prices and the code and price columns
+of its CSV. Other markets of the portal can be added there as long as their CSV has a row per product.
+'''
+import codecs
+import csv
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+import httpclient
+import metrics
+import sessionindex
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+class KrxMarketData:
+    PROVIDER = 'KRX'
+    GENERATE_OTP_URL = 'http://data.krx.co.kr/comm/fileDn/GenerateOTP/generate.cmd'
+    DOWNLOAD_CSV_URL = 'http://data.krx.co.kr/comm/fileDn/download_csv/download.cmd'
+    HEADERS = {
+        'User-Agent': ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)'
+                       'AppleWebKit/537.36 (KHTML, like Gecko)'
+                       'Chrome/130.0.0.0 Safari/537.36 Edg/130.0.0.0')
+    }
+    OTP_PAYLOAD_BASE = {
+        'locale': 'en_US',
+        'share': '1',
+        'money': '1',
+        'csvxls_isNo': 'false',
+        'name': 'fileDown'
+    }
+    MARKETS = {
+        'gold': {  # 금시장 전종목 시세
+            'bld': 'dbms/MDC/STAT/standard/MDCSTAT14901',
+            'code_column': '종목코드',
+            'price_column': '종가'
+        },
+        'emission': {  # 배출권시장 전종목 시세
+            'bld': 'dbms/MDC/STAT/standard/MDCSTAT15901',
+            'code_column': '종목코드',
+            'price_column': '종가'
+        }
+    }
+    DEFAULT_MARKET = 'gold'
+    CSV_ENCODING = 'euc-kr'
+    CHUNK_SIZE = 4096  # bytes of the CSV decoded at a time
+    OTP_VALIDITY_IN_SEC = 60.0
+    DOWNLOAD_MAX_TRIES = 2  # a download refused with a cached OTP is retried with a new one
+    TRADING_DAY_LOOKUP_WINDOW_IN_DAYS = 10
+    CALENDAR_NAME = 'XKRX'
+
+    def __init__(self):
+        self.otps = {}  # request payload (sorted items) -> (OTP, time.monotonic() of issuance)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _get_recent_trading_dates() -> list:
+        ''' trading days of the lookup window, the most recent first '''
+        # look up the precomputed session index for KRX (built from exchange_calendars only when stale)
+        xkrx = sessionindex.get_session_index(KrxMarketData.CALENDAR_NAME)
+
+        today = datetime.today().date()
+        window_from_date = today - timedelta(days=KrxMarketData.TRADING_DAY_LOOKUP_WINDOW_IN_DAYS)
+
+        return list(reversed(xkrx.sessions_in_range(window_from_date, today)))
+
+    @metrics.instrumented()
+    def _generate_otp(self, otp_payload: dict) -> str:
+        otp_resp = httpclient.post(KrxMarketData.GENERATE_OTP_URL, headers=KrxMarketData.HEADERS, data=otp_payload)
+        return otp_resp.text.strip()
+
+    def _get_otp(self, otp_payload: dict) -> str:
+        otp_key = tuple(sorted(otp_payload.items()))
+        with self.lock:
+            if otp_key in self.otps.keys():
+                otp, issued = self.otps[otp_key]
+                if time.monotonic() - issued < KrxMarketData.OTP_VALIDITY_IN_SEC:
+                    return otp
+
+        otp = self._generate_otp(otp_payload)
+        with self.lock:
+            self.otps[otp_key] = (otp, time.monotonic())
+        return otp
+
+    def _invalidate_otp(self, otp_payload: dict):
+        with self.lock:
+            self.otps.pop(tuple(sorted(otp_payload.items())), None)
+
+    @staticmethod
+    def _iter_csv_lines(download_resp) -> iter:
+        ''' lines of the streamed CSV decoded chunk by chunk (a multi-byte character may span chunks) '''
+        decoder = codecs.getincrementaldecoder(KrxMarketData.CSV_ENCODING)()
+        pending = ''
+        for chunk in download_resp.iter_content(chunk_size=KrxMarketData.CHUNK_SIZE):
+            pending += decoder.decode(chunk)
+            lines = pending.split('\n')
+            pending = lines.pop()  # not terminated yet
+            for line in lines:
+                yield line + '\n'
+        pending += decoder.decode(b'', final=True)
+        if pending != '':
+            yield pending
+
+    @metrics.instrumented()
+    def _download_prices(self, otp_payload: dict, isu_cds: set, market: str) -> dict:
+        ''' prices of the products given by isuCds found in the CSV of the payload (products without a price, e.g.
+        before the market opens, are left out) '''
+        code_column = KrxMarketData.MARKETS[market]['code_column']
+        price_column = KrxMarketData.MARKETS[market]['price_column']
+        short_codes = {isu_cd[3:11]: isu_cd for isu_cd in isu_cds}
+        download_headers = dict(KrxMarketData.HEADERS, referer=KrxMarketData.GENERATE_OTP_URL)
+
+        for attempt in range(KrxMarketData.DOWNLOAD_MAX_TRIES):
+            otp = self._get_otp(otp_payload)
+            download_resp = httpclient.post(KrxMarketData.DOWNLOAD_CSV_URL,
+                                            headers=download_headers,
+                                            data={'code': otp},
+                                            stream=True,
+                                            retries=attempt)
+            try:
+                price_csv_parsed = csv.reader(KrxMarketData._iter_csv_lines(download_resp))
+                header = next(price_csv_parsed, None) if download_resp.status_code == 200 else None
+                if header is None or code_column not in header or price_column not in header:
+                    # e.g. the OTP has expired
+                    logger.warning(f'KRX refused the download (HTTP {download_resp.status_code}). retrying with a new OTP')
+                    self._invalidate_otp(otp_payload)
+                    continue
+
+                code_idx = header.index(code_column)
+                price_idx = header.index(price_column)
+                prices = {}
+                for row in price_csv_parsed:
+                    code = row[code_idx].strip() if len(row) > code_idx else ''
+                    isu_cd = short_codes.get(code, code if code in isu_cds else None)
+                    if isu_cd is None:
+                        continue
+                    try:
+                        prices[isu_cd] = float(row[price_idx].replace(',', ''))
+                    except ValueError:
+                        continue  # no price (e.g. '-')
+                    if len(prices) == len(isu_cds):
+                        break  # the rest of the CSV is not downloaded
+
+                return prices
+            finally:
+                download_resp.close()
+
+        error_msg = f'Downloading KRX prices of {otp_payload} failed {KrxMarketData.DOWNLOAD_MAX_TRIES} times'
+        logger.error(error_msg)
+        raise Exception(error_msg)
+
+    def get_prices(self, isu_cds, market: str = DEFAULT_MARKET) -> dict:
+        ''' most recent prices (isuCd -> price in KRW) of products of a market '''
+        if market not in KrxMarketData.MARKETS.keys():
+            logger.error(f'KRX market should be one of {list(KrxMarketData.MARKETS.keys())}, but {market} given')
+            raise ValueError
+
+        remaining_isu_cds = set(isu_cds)
+        prices = {}
+        # products without a price of a day (e.g. today before the market opens) take that of the previous trading day
+        for trading_date in KrxMarketData._get_recent_trading_dates():
+            if len(remaining_isu_cds) == 0:
+                break
+            otp_payload = dict(KrxMarketData.OTP_PAYLOAD_BASE,
+                               url=KrxMarketData.MARKETS[market]['bld'],
+                               trdDd=trading_date.strftime('%Y%m%d'))  # Caution not %Y-%m-%d
+            found_prices = self._download_prices(otp_payload, remaining_isu_cds, market)
+            prices.update(found_prices)
+            remaining_isu_cds -= found_prices.keys()
+
+        if len(remaining_isu_cds) != 0:
+            error_msg = f'No KRX price of {sorted(remaining_isu_cds)} within the last ' \
+                        f'{KrxMarketData.TRADING_DAY_LOOKUP_WINDOW_IN_DAYS} days'
+            logger.error(error_msg)
+            raise Exception(error_msg)
+
+        return prices
+
+
+market_data = KrxMarketData()  # shared by every KrxStock of the process (and their OTPs)
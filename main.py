@@ -1,4 +1,6 @@
 import portfolio
+import httpclient
+import metrics
 import click
 from setup_logger import setup_logger
 
@@ -44,6 +46,95 @@ from setup_logger import setup_logger
     show_default=True,
     help='path to the tokens JSON file'
 )
+@click.option(
+    '--refresh-workers',
+    type=click.IntRange(min=1),
+    default=portfolio.Portfolio.REFRESH_MAX_WORKERS,
+    show_default=True,
+    help='number of stockgroups to refresh in parallel'
+)
+@click.option(
+    '--http-pool-size',
+    type=click.IntRange(min=1),
+    default=httpclient.SessionPool.POOL_MAXSIZE,
+    show_default=True,
+    help='max number of keep-alive connections per host'
+)
+@click.option(
+    '--connect-timeout',
+    type=float,
+    default=httpclient.SessionPool.CONNECT_TIMEOUT,
+    show_default=True,
+    help='HTTP connect timeout in seconds'
+)
+@click.option(
+    '--read-timeout',
+    type=float,
+    default=httpclient.SessionPool.READ_TIMEOUT,
+    show_default=True,
+    help='HTTP read timeout in seconds'
+)
+@click.option(
+    '--unit-allocation',
+    type=click.Choice(['round', 'budget']),
+    default='round',
+    show_default=True,
+    help='round: round the units of each stock on its own, '
+         'budget: allocate units minimizing the deviation from need2invest within the saving'
+)
+@click.option(
+    '--cache-dir',
+    type=click.Path(file_okay=False),
+    default='.cache',
+    show_default=True,
+    help='directory of the price cache shared across runs'
+)
+@click.option(
+    '--refresh-prices',
+    is_flag=True,
+    help='ignore cached prices and fetch every price live'
+)
+@click.option(
+    '--cached-prices-only',
+    is_flag=True,
+    help='use cached prices regardless of their age and never fetch prices live'
+)
+@click.option(
+    '--history-db',
+    type=click.Path(dir_okay=False),
+    default=None,
+    help='report history DB to append the derived report to (REF_REPORT_PATH may be the same DB)'
+)
+@click.option(
+    '--record-cassette',
+    type=click.Path(dir_okay=False),
+    default=None,
+    help='record every HTTP response into this cassette (secrets are redacted)'
+)
+@click.option(
+    '--replay-cassette',
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help='answer every HTTP request from this cassette without network access'
+)
+@click.option(
+    '--stand-in-url',
+    type=str,
+    default=None,
+    help='send every HTTP request to this stand-in server (see standin.py) instead of the real APIs'
+)
+@click.option(
+    '--trace-output',
+    type=click.Path(dir_okay=False),
+    default=None,
+    help='write timings of HTTP calls and stages as a JSON trace (Chrome trace event format)'
+)
+@click.option(
+    '--metrics-output',
+    type=click.Path(dir_okay=False),
+    default=None,
+    help='write timings of HTTP calls and stages as a Prometheus textfile'
+)
 @click.argument(
     'ref_report_path',
     type=click.Path(exists=True, dir_okay=False),
@@ -62,15 +153,31 @@ def main(
     print_report,
     secrets_path,
     tokens_path,
+    refresh_workers,
+    unit_allocation,
+    http_pool_size,
+    connect_timeout,
+    read_timeout,
+    cache_dir,
+    refresh_prices,
+    cached_prices_only,
+    history_db,
+    record_cassette,
+    replay_cassette,
+    stand_in_url,
+    trace_output,
+    metrics_output,
     ref_report_path,
     output_report_path
 ):
     logger = setup_logger('autoinvestment_logger', debug_level)
     logger.debug('Program started')
+    if trace_output is not None or metrics_output is not None:
+        metrics.enable()
 
-    if output_report_path is None:
+    if output_report_path is None and history_db is None:
         if not print_report:
-            logger.error('--print-report flag must be given when not giving output_report_path')
+            logger.error('--print-report flag must be given when giving neither output_report_path nor --history-db')
             raise Exception
         else:
             logger.info('no output_report_path given, just printing given reference report.')
@@ -78,13 +185,43 @@ def main(
             my_portfolio.print_ref_report()
 
     else:
+        import marketcache  # only needed when deriving a new report
+        import coinindex
+        import sessionindex
+
+        if refresh_prices and cached_prices_only:
+            logger.error('--refresh-prices and --cached-prices-only cannot be given together')
+            raise Exception
+        elif refresh_prices:
+            price_cache_mode = 'refresh'
+        elif cached_prices_only:
+            price_cache_mode = 'cached-only'
+        else:
+            price_cache_mode = 'normal'
+
+        httpclient.configure(http_pool_size, connect_timeout, read_timeout)
+        httpclient.install_transports(record_cassette, replay_cassette, stand_in_url)
+        sessionindex.configure(cache_dir)
+        coinindex.configure(cache_dir)
         my_portfolio = portfolio.Portfolio(ref_report_path,
                                            secrets_path,
                                            tokens_path,
                                            saving_in_krw,
-                                           saving_in_usd)
+                                           saving_in_usd,
+                                           refresh_max_workers=refresh_workers,
+                                           unit_allocation=unit_allocation,
+                                           price_cache=marketcache.PriceCache(cache_dir, price_cache_mode),
+                                           exchange_rate_cache=marketcache.ExchangeRateCache(cache_dir))
         my_portfolio.distribute_saving()
-        my_portfolio.write_report_to_file(output_report_path)
+        httpclient.close()  # e.g. saves a cassette being recorded
+        if output_report_path is not None:
+            my_portfolio.write_report_to_file(output_report_path)
+        if history_db is not None:
+            import reporthistory
+
+            history = reporthistory.ReportHistory(history_db)
+            my_portfolio.write_report_to_history(history, source=output_report_path)
+            history.close()
 
         if print_report:
             print('Reference Report\n' + '-' * 40)
@@ -92,6 +229,7 @@ def main(
             print('\nDerived Report\n' + '-' * 40)
             my_portfolio.print_this_report()
 
+    metrics.write(trace_output, metrics_output)
     logger.debug('Program ended')
 
 
@@ -0,0 +1,125 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+class PriceCache:
+    ''' on-disk price cache shared across runs. entries are keyed by (provider, symbol, market) '''
+    CACHE_FNAME = 'prices.sqlite3'
+    MODES = ('normal', 'refresh', 'cached-only')
+    # time-to-live of cached prices in seconds for each provider (i.e. stockgroup key)
+    TTL_IN_SEC = {
+        'KIS': 300,
+        'CoinGecko': 60,
+        'KRX': 3600
+    }
+    DEFAULT_TTL_IN_SEC = 300
+    MAX_ENTRIES = 10000  # the oldest entries are evicted beyond this size
+
+    def __init__(self, cache_dir: str, mode: str = 'normal', ttls: dict = None, max_entries: int = MAX_ENTRIES):
+        if mode not in PriceCache.MODES:
+            logger.error(f'PriceCache mode should be one of {PriceCache.MODES}, but {mode} given')
+            raise ValueError
+
+        self.mode = mode
+        self.ttls = dict(PriceCache.TTL_IN_SEC, **(ttls or {}))
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(cache_dir, PriceCache.CACHE_FNAME),
+                                    timeout=10.0,
+                                    isolation_level=None,  # autocommit
+                                    check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS prices ('
+                          'provider TEXT NOT NULL, '
+                          'symbol TEXT NOT NULL, '
+                          'market TEXT NOT NULL, '
+                          'price REAL NOT NULL, '
+                          'fetched_at REAL NOT NULL, '
+                          'PRIMARY KEY (provider, symbol, market))')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS prices_fetched_at ON prices (fetched_at)')
+
+    def get(self, provider: str, symbol: str, market: str):
+        ''' return (price, age in seconds) of a cached price or None if it should be fetched live '''
+        if self.mode == 'refresh':
+            return None
+
+        with self.lock:
+            row = self.conn.execute('SELECT price, fetched_at FROM prices WHERE provider = ? AND symbol = ? AND market = ?',
+                                    (provider, symbol, market)).fetchone()
+
+        if row is None:
+            if self.mode == 'cached-only':
+                error_msg = f'No cached price of {symbol} ({provider}, {market}) while only cached prices are allowed.'
+                logger.error(error_msg)
+                raise Exception(error_msg)
+            return None
+
+        price, fetched_at = row
+        age = time.time() - fetched_at
+        # in cached-only mode a cached price is used regardless of its age
+        if self.mode == 'normal' and age > self.ttls.get(provider, PriceCache.DEFAULT_TTL_IN_SEC):
+            return None
+
+        logger.debug(f'Using cached price of {symbol} ({provider}, {market}): {price} ({age:.0f} seconds old)')
+        return price, age
+
+    def put(self, provider: str, symbol: str, market: str, price: float):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?)',
+                              (provider, symbol, market, price, time.time()))
+
+            # evict the oldest entries
+            num_entries = self.conn.execute('SELECT COUNT(*) FROM prices').fetchone()[0]
+            if num_entries > self.max_entries:
+                self.conn.execute('DELETE FROM prices WHERE rowid IN '
+                                  '(SELECT rowid FROM prices ORDER BY fetched_at LIMIT ?)',
+                                  (num_entries - self.max_entries,))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class ExchangeRateCache:
+    ''' on-disk cache of published exchange rates indexed by the search date (%Y%m%d) '''
+    CACHE_FNAME = PriceCache.CACHE_FNAME
+
+    def __init__(self, cache_dir: str):
+        self.lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(cache_dir, ExchangeRateCache.CACHE_FNAME),
+                                    timeout=10.0,
+                                    isolation_level=None,  # autocommit
+                                    check_same_thread=False)
+        # rate is NULL for dates on which no rate has been published (weekends, holidays)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS exchange_rates ('
+                          'searchdate TEXT PRIMARY KEY, '
+                          'rate REAL, '
+                          'fetched_at REAL NOT NULL)')
+
+    def lookup(self, searchdate: str):
+        ''' return (is_cached, rate). rate is None if no rate has been published on searchdate '''
+        with self.lock:
+            row = self.conn.execute('SELECT rate FROM exchange_rates WHERE searchdate = ?', (searchdate,)).fetchone()
+
+        if row is None:
+            return False, None
+
+        return True, row[0]
+
+    def put(self, searchdate: str, rate):
+        ''' rate should be None if no rate has been published on searchdate. published rates never change '''
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO exchange_rates VALUES (?, ?, ?)', (searchdate, rate, time.time()))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,228 @@
+''' timing instrumentation of HTTP calls, update_all() stages and Portfolio derivation steps
+
+Instrumentation is off unless enable() is called (main.py and batch.py do so with --trace-output or
+--metrics-output). While off, an instrumented method costs one global lookup on top of the call.
+
+Records are tagged with the provider (PROVIDER of the stockgroup handler, or Portfolio/koreaexim) and the symbol
+(the stock of a per-stock query, None for stockgroup-wide stages). HTTP calls made within an instrumented method
+inherit its tags. Records can be written as
+    - a JSON trace in the Chrome trace event format (chrome://tracing or https://ui.perfetto.dev), one event per record
+    - a Prometheus textfile (node_exporter textfile collector) aggregated by provider and stage/host. symbols are left
+      out of the labels to bound their cardinality
+'''
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+METRIC_PREFIX = 'vacacalculator'
+recorder = None  # Recorder while instrumentation is enabled
+tags = threading.local()  # (provider, symbol) of the innermost instrumented method of this thread
+
+
+class Recorder:
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+
+    def record(self, kind: str, name: str, provider: str, symbol, started: float, elapsed_in_sec: float, **fields):
+        record = {
+            'kind': kind,  # 'stage' or 'http'
+            'name': name,
+            'provider': provider,
+            'symbol': symbol,
+            'start_ms': (started - self.started) * 1000,
+            'duration_ms': elapsed_in_sec * 1000,
+            'thread': threading.get_ident()
+        }
+        record.update(fields)
+        with self.lock:
+            self.records.append(record)
+
+    def write_trace(self, fname: str):
+        ''' write the records as complete events ("ph": "X") of the Chrome trace event format '''
+        with self.lock:
+            records = list(self.records)
+
+        trace_events = []
+        for record in records:
+            args = {key: value for key, value in record.items()
+                    if key not in ('kind', 'name', 'start_ms', 'duration_ms', 'thread')}
+            trace_events.append({
+                'name': record['name'] if record['symbol'] is None else f'{record["name"]} {record["symbol"]}',
+                'cat': f'{record["kind"]},{record["provider"]}',
+                'ph': 'X',
+                'ts': record['start_ms'] * 1000,  # in microseconds
+                'dur': record['duration_ms'] * 1000,
+                'pid': os.getpid(),
+                'tid': record['thread'],
+                'args': args
+            })
+        trace = {'traceEvents': trace_events, 'displayTimeUnit': 'ms', 'otherData': {'started_at': self.started_at}}
+
+        _write_atomically(fname, json.dumps(trace))
+
+    def write_prometheus(self, fname: str):
+        with self.lock:
+            records = list(self.records)
+
+        stage_sums = {}  # (provider, stage) -> [count, seconds]
+        http_sums = {}  # (provider, method, host, status) -> [count, seconds, bytes sent, bytes received, retrying calls]
+        for record in records:
+            if record['kind'] == 'stage':
+                sums = stage_sums.setdefault((record['provider'], record['name']), [0, 0.0])
+                sums[0] += 1
+                sums[1] += record['duration_ms'] / 1000
+            else:
+                sums = http_sums.setdefault(
+                    (record['provider'], record['method'], record['host'], str(record['status'])), [0, 0.0, 0, 0, 0])
+                sums[0] += 1
+                sums[1] += record['duration_ms'] / 1000
+                sums[2] += record['bytes_sent']
+                sums[3] += record['bytes_received']
+                sums[4] += int(record['retries'] > 0)
+
+        lines = []
+
+        def add_metric(name: str, metric_type: str, help_text: str, samples: list):
+            lines.append(f'# HELP {METRIC_PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name} {metric_type}')
+            for sample_suffix, labels, value in samples:
+                label_text = ','.join(f'{key}="{_escape_label(label)}"' for key, label in labels.items())
+                if label_text != '':
+                    label_text = f'{{{label_text}}}'
+                lines.append(f'{METRIC_PREFIX}_{name}{sample_suffix}{label_text} {value}')
+
+        stage_labels = [{'provider': provider, 'stage': stage} for provider, stage in stage_sums.keys()]
+        add_metric('stage_duration_seconds', 'summary', 'Wall time of update_all() stages and Portfolio steps.',
+                   [('_count', labels, sums[0]) for labels, sums in zip(stage_labels, stage_sums.values())]
+                   + [('_sum', labels, sums[1]) for labels, sums in zip(stage_labels, stage_sums.values())])
+        http_labels = [{'provider': provider, 'method': method, 'host': host, 'status': status}
+                       for provider, method, host, status in http_sums.keys()]
+        add_metric('http_request_duration_seconds', 'summary', 'Wall time of HTTP calls.',
+                   [('_count', labels, sums[0]) for labels, sums in zip(http_labels, http_sums.values())]
+                   + [('_sum', labels, sums[1]) for labels, sums in zip(http_labels, http_sums.values())])
+        add_metric('http_request_bytes_total', 'counter', 'Bytes of HTTP request bodies.',
+                   [('', labels, sums[2]) for labels, sums in zip(http_labels, http_sums.values())])
+        add_metric('http_response_bytes_total', 'counter', 'Bytes of HTTP response bodies.',
+                   [('', labels, sums[3]) for labels, sums in zip(http_labels, http_sums.values())])
+        add_metric('http_retries_total', 'counter', 'HTTP calls retrying an earlier attempt (rate limits, KIS EXCD fallback, KRX downloads).',
+                   [('', labels, sums[4]) for labels, sums in zip(http_labels, http_sums.values())])
+        add_metric('run_started_timestamp_seconds', 'gauge', 'Start of the run.', [('', {}, self.started_at)])
+
+        _write_atomically(fname, '\n'.join(lines) + '\n')
+
+
+def _escape_label(label) -> str:
+    return str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_atomically(fname: str, text: str):
+    ''' the textfile collector (and anything tailing the trace) must never read a partially written file '''
+    tmp_fname = f'{fname}.{os.getpid()}.tmp'
+    with open(tmp_fname, 'w') as f:
+        f.write(text)
+    os.replace(tmp_fname, fname)
+
+
+def enable() -> Recorder:
+    global recorder
+    recorder = Recorder()
+    return recorder
+
+
+def disable():
+    global recorder
+    recorder = None
+
+
+def write(trace_fname: str = None, prometheus_fname: str = None):
+    ''' write the records so far (no-op while disabled) '''
+    if recorder is None:
+        return
+    if trace_fname is not None:
+        recorder.write_trace(trace_fname)
+        logger.info(f'Wrote {len(recorder.records)} trace events into {trace_fname}')
+    if prometheus_fname is not None:
+        recorder.write_prometheus(prometheus_fname)
+        logger.info(f'Wrote metrics into {prometheus_fname}')
+
+
+def instrumented(stage: str = None, provider: str = None, symbol_arg: str = None):
+    ''' decorator timing a method as a stage
+
+    stage: name of the stage (the method name without leading underscores by default)
+    provider: provider tag (PROVIDER of the instance, or the class name, by default)
+    symbol_arg: name of the argument holding the symbol (a list of symbols is joined with commas)
+    '''
+    def decorator(method):
+        stage_name = stage if stage is not None else method.__name__.lstrip('_')
+        symbol_index = method.__code__.co_varnames.index(symbol_arg) if symbol_arg is not None else None
+
+        @functools.wraps(method)
+        def instrumented_method(obj, *args, **kwargs):
+            if recorder is None:
+                return method(obj, *args, **kwargs)
+
+            method_provider = provider if provider is not None else getattr(obj, 'PROVIDER', type(obj).__name__)
+            symbol = None
+            if symbol_index is not None:
+                symbol = kwargs[symbol_arg] if symbol_arg in kwargs.keys() else args[symbol_index - 1]
+                if isinstance(symbol, (list, tuple)):
+                    symbol = ','.join(symbol)
+            outer_tags = getattr(tags, 'current', None)
+            if symbol_index is None and outer_tags is not None and outer_tags[0] == method_provider:
+                symbol = outer_tags[1]  # e.g. a stage run within a per-stock query
+
+            tags.current = (method_provider, symbol)
+            started = time.perf_counter()
+            try:
+                return method(obj, *args, **kwargs)
+            finally:
+                recorder.record('stage', stage_name, method_provider, symbol, started, time.perf_counter() - started)
+                tags.current = outer_tags
+
+        return instrumented_method
+
+    return decorator
+
+
+def record_http(method: str, url: str, started: float, response, request_kwargs: dict, retries: int = 0):
+    ''' record an HTTP call made by httpclient (tagged with the innermost instrumented method of this thread).
+    response is None if the call raised. retries is the number of earlier attempts of the same call '''
+    provider, symbol = getattr(tags, 'current', None) or (None, None)
+
+    # bytes of the body actually sent if the response tells (requests.Response), else of the given data
+    request = getattr(response, 'request', None)
+    body = request.body if request is not None else request_kwargs.get('data')
+    if body is None:
+        bytes_sent = 0
+    elif isinstance(body, (bytes, str)):
+        bytes_sent = len(body.encode('utf-8') if isinstance(body, str) else body)
+    else:
+        bytes_sent = len(json.dumps(body))  # a dict not encoded yet. approximate
+
+    # the body of a streamed response is read by the caller (maybe partly). use its announced size instead
+    if response is None:
+        bytes_received = 0
+    elif request_kwargs.get('stream', False):
+        bytes_received = int(response.headers.get('Content-Length', 0))
+    else:
+        bytes_received = len(response.content)
+
+    recorder.record('http', f'{method} {urlsplit(url).path}', provider, symbol, started, time.perf_counter() - started,
+                    method=method,
+                    host=urlsplit(url).netloc,
+                    status=response.status_code if response is not None else 'error',
+                    bytes_sent=bytes_sent,
+                    bytes_received=bytes_received,
+                    retries=retries)
@@ -1,9 +1,10 @@
 import json
 import logging
-import requests
-import stockwrapper
-from tabulate import tabulate
 from datetime import datetime, timedelta
+import metrics
+
+# N.B. httpclient, stockwrapper, portfolioarrays, reportmodel, tabulate and concurrent.futures are imported in the methods
+#      using them so that a print-only run does not pay for loading the network stack (and NumPy)
 
 
 logger = logging.getLogger('autoinvestment_logger')
@@ -14,15 +15,27 @@ class Portfolio:
     EXCHANGERATE_LOOKUP_URL = 'https://oapi.koreaexim.go.kr/site/program/financial/exchangeJSON'
     EXCHANGERATE_LOOKUP_DATA = 'AP01'
     EXCHANGERATE_CERT_PATH = 'koreaexim.pem'
+    EXCHANGERATE_PROBE_DAYS = 5  # number of search dates probed at once when the rate is not cached
+    REFRESH_MAX_WORKERS = 4  # default number of stockgroups refreshed in parallel
+
+    def __init__(self,
+                 *args,
+                 refresh_max_workers: int = REFRESH_MAX_WORKERS,
+                 price_cache=None,
+                 exchange_rate_cache=None,
+                 exchange_rate: float = None,
+                 unit_allocation: str = 'round') -> None:
+        self.refresh_max_workers = refresh_max_workers
+        self.unit_allocation = unit_allocation  # 'round' or 'budget'. refer to allocator.py
+        self.price_cache = price_cache  # marketcache.PriceCache shared by the stockgroup handlers
+        self.exchange_rate_cache = exchange_rate_cache  # marketcache.ExchangeRateCache
 
-    def __init__(self, *args) -> None:
         # constructor 1: simple constructor just for printing ref_report
         if (len(args) == 1 and isinstance(args[0], str)):
             logger.debug('Portfolio simple constructor called')
             ref_report_fname = args[0]
 
-            with open(ref_report_fname, 'r') as f:
-                self.ref_report = json.load(f)
+            self.ref_report = Portfolio._load_ref_report(ref_report_fname)
         # constructor 2: regular constructor for deriving new reports
         elif (
                len(args) == 5 and
@@ -33,61 +46,70 @@ class Portfolio:
                isinstance(args[4], float)
         ):
             logger.debug('Portfolio constructor called')
+            import reportmodel
+
             ref_report_fname = args[0]
             self.secrets_fname = args[1]
             self.tokens_fname = args[2]
             savingInKRW = args[3]
             savingInUSD = args[4]
 
-            # open and decrypt secrets
-            with open(self.secrets_fname, 'r') as f_secret:
-                self.EXCHANGERATE_LOOKUP_AUTHKEY = json.load(f_secret)['ExchangerateSecrets']['AUTH_KEY']
-
-            # open and parse reference report file
-            with open(ref_report_fname, 'r') as f:
-                # first get the exchange rate to convert savingKRW to USD
+            # first get the exchange rate to convert savingKRW to USD unless it is given (e.g. shared in batch mode)
+            if exchange_rate is None:
+                # open and decrypt secrets
+                with open(self.secrets_fname, 'r') as f_secret:
+                    self.EXCHANGERATE_LOOKUP_AUTHKEY = json.load(f_secret)['ExchangerateSecrets']['AUTH_KEY']
                 self.exchange_rate = self._get_exchange_rate()
-                self.savingInKRW = savingInKRW
-                self.savingInUSD = savingInUSD
-                self.saving = savingInKRW / self.exchange_rate + savingInUSD
-
-                # refer to root_ref_report.json for report format
-                self.ref_report = json.load(f)
-
-                # start verifying
-                # sum of all weights of all stocks should be equal to 1.0
-                stock_sum_of_weights = 0.0
-                for stockgroup in self.ref_report['stockgroups'].values():
-                    for stock in stockgroup['stocks'].values():
-                        stock_sum_of_weights += stock['weight']
-                assert round(stock_sum_of_weights, 4) == 1.0
-
-                # instantiate this_report
-                self.this_report = {}
+            else:
+                self.exchange_rate = exchange_rate
+            self.savingInKRW = savingInKRW
+            self.savingInUSD = savingInUSD
+            self.saving = savingInKRW / self.exchange_rate + savingInUSD
+
+            # open and parse reference report file (or the latest report of a report history DB)
+            # refer to root_ref_report.json for report format
+            self.ref_report = Portfolio._load_ref_report(ref_report_fname)
+
+            # verify every field the derivation relies on (including the sum of all weights) at once
+            self.ref_model = reportmodel.Report.from_dict(self.ref_report)
+
+            # instantiate this_report
+            self.this_report = {}
         else:
             logger.error('wrong form of Portfolio constructor called')
             raise TypeError
 
-    def _get_exchange_rate(self) -> float:
-        querydate = datetime.today()
-        empty_response = True
-        while empty_response:
-            resp = requests.get(
-                Portfolio.EXCHANGERATE_LOOKUP_URL,
-                params={'authkey': self.EXCHANGERATE_LOOKUP_AUTHKEY,
-                        'searchdate': querydate.strftime('%Y%m%d'),
-                        'data': Portfolio.EXCHANGERATE_LOOKUP_DATA},
-                verify=Portfolio.EXCHANGERATE_CERT_PATH
-            )
-
-            # between 00:00--11:00 each day the API returns an empty list
-            # in that case we should query the rate
-            if len(resp.json()) != 0:
-                empty_response = False
-            else:
-                querydate -= timedelta(days=1)
-
-        for ele in resp.json()[-1:0:-1]:
+    @staticmethod
+    def _load_ref_report(ref_report_fname: str) -> dict:
+        import reporthistory
+
+        if reporthistory.is_history_db(ref_report_fname):
+            logger.debug(f'Using the latest report of the report history {ref_report_fname} as the reference report')
+            history = reporthistory.ReportHistory(ref_report_fname)
+            ref_report = history.latest_report()
+            history.close()
+            return ref_report
+
+        with open(ref_report_fname, 'r') as f:
+            return json.load(f)
+
+    @metrics.instrumented(provider='koreaexim', symbol_arg='searchdate')
+    def _query_exchange_rates(self, searchdate: str) -> list:
+        import httpclient
+
+        resp = httpclient.get(
+            Portfolio.EXCHANGERATE_LOOKUP_URL,
+            params={'authkey': self.EXCHANGERATE_LOOKUP_AUTHKEY,
+                    'searchdate': searchdate,
+                    'data': Portfolio.EXCHANGERATE_LOOKUP_DATA},
+            verify=Portfolio.EXCHANGERATE_CERT_PATH
+        )
+
+        return resp.json()
+
+    @staticmethod
+    def _parse_exchange_rate(exchange_rates: list) -> float:
+        for ele in exchange_rates[-1:0:-1]:
             if ele['cur_unit'] == Portfolio.BASE_CURRENCY:
                 try:
                     return float(ele['deal_bas_r'].replace(',', ''))  # key for trading standard rate
@@ -96,17 +118,72 @@ class Portfolio:
 
         return 0.0
 
+    @metrics.instrumented(provider='koreaexim')
+    def _get_exchange_rate(self) -> float:
+        from concurrent.futures import ThreadPoolExecutor
+
+        today = datetime.today()
+        probe_offset = 0
+        while True:
+            # look up the most recent published rate among EXCHANGERATE_PROBE_DAYS search dates
+            searchdates = [(today - timedelta(days=probe_offset + i)).strftime('%Y%m%d')
+                           for i in range(Portfolio.EXCHANGERATE_PROBE_DAYS)]
+
+            # rates of the search dates from the cache (None: not published, missing key: unknown)
+            rates = {}
+            if self.exchange_rate_cache is not None:
+                for searchdate in searchdates:
+                    is_cached, rate = self.exchange_rate_cache.lookup(searchdate)
+                    if not is_cached:
+                        continue
+                    rates[searchdate] = rate
+                    if rate is not None:
+                        break  # dates older than the most recent cached rate need not be looked up
+
+            # between 00:00--11:00 each day the API returns an empty list for the day.
+            # probe every search date newer than the most recent cached rate at once
+            searchdates_to_probe = []
+            for searchdate in searchdates:
+                if searchdate in rates.keys() and rates[searchdate] is not None:
+                    break
+                if searchdate not in rates.keys():
+                    searchdates_to_probe.append(searchdate)
+
+            if len(searchdates_to_probe) != 0:
+                with ThreadPoolExecutor(max_workers=len(searchdates_to_probe)) as executor:
+                    probed_exchange_rates = list(executor.map(self._query_exchange_rates, searchdates_to_probe))
+
+                for searchdate, exchange_rates in zip(searchdates_to_probe, probed_exchange_rates):
+                    if len(exchange_rates) != 0:
+                        rates[searchdate] = Portfolio._parse_exchange_rate(exchange_rates)
+                    else:
+                        rates[searchdate] = None
+
+                    if self.exchange_rate_cache is None:
+                        continue
+                    # once published a rate never changes. today's empty response may be filled later, though
+                    if rates[searchdate] is not None and rates[searchdate] != 0.0:
+                        self.exchange_rate_cache.put(searchdate, rates[searchdate])
+                    elif rates[searchdate] is None and searchdate != today.strftime('%Y%m%d'):
+                        self.exchange_rate_cache.put(searchdate, None)
+
+            for searchdate in searchdates:
+                if searchdate in rates.keys() and rates[searchdate] is not None:
+                    logger.debug(f'Using the exchange rate of {searchdate}: {rates[searchdate]}')
+                    return rates[searchdate]
+
+            probe_offset += Portfolio.EXCHANGERATE_PROBE_DAYS
+
+    @metrics.instrumented()
     def _derive_total_appraisement(self):
         # do nothing if this_report['total_appraisement'] already exists
         if 'total_appraisement' not in self.this_report.keys():
-            total_appraisement = 0.0
-            for stockgroup in self.this_report['stockgroups'].values():
-                for stock in stockgroup['stocks'].values():
-                    total_appraisement += stock['appraisement']
-
-            self.this_report['total_appraisement'] = total_appraisement
+            self.this_report['total_appraisement'] = self.this_arrays.total_appraisement()
 
+    @metrics.instrumented()
     def _print_report(self, report_to_print: dict):
+        from tabulate import tabulate
+
         logger.debug('_print_report called')
 
         print(f'Strategy: {report_to_print["strategy"]}')
@@ -114,6 +191,9 @@ class Portfolio:
         # print total_appraisement if available
         if 'total_appraisement' in report_to_print.keys():
             print(f'Total Appraisement: {report_to_print["total_appraisement"]:.2f}')
+        # print leftover_cash if units were allocated within the saving
+        if 'leftover_cash' in report_to_print.keys():
+            print(f'Leftover Cash: {report_to_print["leftover_cash"]:.2f}')
 
         table_header = ('stock',
                         'priceUsd',
@@ -174,110 +254,110 @@ class Portfolio:
                        numalign='right'
                        ))
 
+    @metrics.instrumented()
     def _derive_cum_inv_deviation(self):
         # get the deviation between need2invest and actual investment in terms of ref_report
-        for stockgroupkey in self.ref_report['stockgroups'].keys():
-            ref_stockgroup = self.ref_report['stockgroups'][stockgroupkey]
-            this_stockgroup = self.this_report['stockgroups'][stockgroupkey]
-
-            for stockkey in ref_stockgroup['stocks'].keys():
-                ref_stock = ref_stockgroup['stocks'][stockkey]
-                this_stock = this_stockgroup['stocks'][stockkey]
-
-                # for holdings
-                if 'holdings' in ref_stock.keys():
-                    actualInvestedInUnits = this_stock['holdings'] - ref_stock['holdings']
-                else:
-                    actualInvestedInUnits = 0
-
-                # for prices
-                if 'price' in ref_stock.keys():
-                    actual_inv_increment = ref_stock['price'] * actualInvestedInUnits
-                else:  # if ref_stock does not have price info, use that of this_stock instead
-                    actual_inv_increment = this_stock['price'] * actualInvestedInUnits
-                # if currency is KRW divide actual_inv_increment by exchange_rate
-                if this_stock['currency'] == 'KRW':
-                    actual_inv_increment /= self.exchange_rate
-
-                if 'need2invest' in ref_stock.keys():
-                    inv_deviation = ref_stock['need2invest'] - actual_inv_increment
-                else:
-                    inv_deviation = 0.0  # assume inv_deviation == 0 if ref_report has no record of need2invest
-
-                # add up the difference between need2invest and added_investment to cum_inv_deviation
-                if 'cum_inv_deviation' in ref_stock.keys():
-                    this_stock['cum_inv_deviation'] = ref_stock['cum_inv_deviation'] + inv_deviation
-                else:
-                    # assume cum_inv_deviation of ref_report is 0 if not available
-                    this_stock['cum_inv_deviation'] = inv_deviation
+        self.this_arrays.derive_cum_inv_deviation(self.ref_model)
 
+    @metrics.instrumented()
     def _derive_units_to_invest(self):
         # get the number of units to invest for each stock
-        for stockgroupkey, stockgroup in self.this_report['stockgroups'].items():
-            for stockkey, stock in stockgroup['stocks'].items():
-                if stock['currency'] == 'KRW':
-                    if stockgroupkey == 'CoinGecko':  # Cryptocurrencies can be fractionally invested
-                        stock['need2investInUnits'] = \
-                            stock['need2invest'] / (stock['price'] / self.this_report['exchange_rate'])
-                    else:
-                        stock['need2investInUnits'] = \
-                            round(stock['need2invest'] / (stock['price'] / self.this_report['exchange_rate']))
-                elif stock['currency'] == 'USD':
-                    if stockgroupkey == 'CoinGecko':  # Cryptocurrencies can be fractionally invested
-                        stock['need2investInUnits'] = stock['need2invest'] / stock['price']
-                    else:
-                        stock['need2investInUnits'] = round(stock['need2invest'] / stock['price'])
-                else:
-                    logger.error(f'only supports KRW and USD as currency, but {stock["currency"]} given')
-                    raise NotImplementedError
+        self.this_arrays.derive_units_to_invest(self.unit_allocation, self.this_report['saving'])
+        if self.unit_allocation == 'budget':
+            self.this_report['leftover_cash'] = self.this_arrays.leftover_cash
 
+    @metrics.instrumented()
     def _distribute_saving_CA(self):
         # get CA amount for each stock
-        for stockgroupkey, stockgroup in self.this_report['stockgroups'].items():
-            for stockkey, stock in stockgroup['stocks'].items():
-                stock['need2investCA'] = self.this_report['saving'] * stock['weight']
-
-                if 'cumSumCaInvested' in stock.keys():
-                    # in case cumSumCaInvested is given, ignore cumSumCaInvestedInKRW and cumSumCaInvestedInUSD
-                    if 'cumSumCaInvestedInKRW' in stock.keys():
-                        del stock['cumSumCaInvestedInKRW']
-                    if 'cumSumCaInvestedInUSD' in stock.keys():
-                        del stock['cumSumCaInvestedInUSD']
-                else:
-                    # in case of neither cumSumCaInvested, cumSumCaInvestedInKRW, nor cumSumCaInvestedInUSD exists
-                    # use appraisement as previous cumSumCaInvested
-                    # N.B. this route is only for the 1st report because reports afterward all have cumSumCaInvested
-                    if 'cumSumCaInvestedInKRW' not in stock.keys() and 'cumSumCaInvestedInUSD' not in stock.keys():
-                        stock['cumSumCaInvested'] = stock['appraisement'] + stock['need2investCA']
-                    # in case either cumSumCaInvestedInKRW or cumSumCaInvestedInUSD exists, use them instead
-                    else:
-                        stock['cumSumCaInvested'] = stock['need2investCA']
-                        if 'cumSumCaInvestedInKRW' in stock.keys():
-                            stock['cumSumCaInvested'] += stock['cumSumCaInvestedInKRW'] / self.exchange_rate
-                            del stock['cumSumCaInvestedInKRW']
-                        if 'cumSumCaInvestedInUSD' in stock.keys():
-                            stock['cumSumCaInvested'] += stock['cumSumCaInvestedInUSD']
-                            del stock['cumSumCaInvestedInUSD']
-
-                stock['need2invest'] = stock['need2investCA']
+        self.this_arrays.distribute_saving_CA(self.this_report['saving'])
 
+    @metrics.instrumented()
     def _distribute_saving_VA(self):
-        # do CA first
-        self._distribute_saving_CA()
+        # get VA amount for each stock (CA is done first)
+        #   cumSumCaInvested: cumulative sum of CA invested amount.
+        #                     this has nothing to do with actual investment because this is an ideal target to follow
+        #   need2investCA: the CA amount needed to be invested in the corresponding stock
+        #                  this also has nothing to do with actual investment
+        #   need2investVA: difference between ideal target from current actual appraisement
+        self.this_arrays.distribute_saving_VA(self.this_report['saving'])
+
+    def _create_stockgroup_handler(self, stockgroupkey: str, stockgroup: dict) -> 'stockwrapper.BaseStock':
+        import stockwrapper
+
+        if stockgroupkey == 'KIS':
+            return stockwrapper.KisStock(
+                self.this_report['exchange_rate'],
+                self.ref_model.exchange_rate,
+                self.secrets_fname,
+                self.tokens_fname,
+                stockgroup,
+                self.price_cache
+            )
 
-        # get VA amount for each stock
-        for stockgroupkey, stockgroup in self.this_report['stockgroups'].items():
-            for stockkey, stock in stockgroup['stocks'].items():
-                # derive VA amount
-                #   cumSumCaInvested: cumulative sum of CA invested amount.
-                #                     this has nothing to do with actual investment because this is an ideal target to follow
-                #   need2investCA: the CA amount needed to be invested in the corresponding stock
-                #                  this also has nothing to do with actual investment
-                #   need2investVA: difference between ideal target from current actual appraisement
-                stock['need2investVA'] = stock['cumSumCaInvested'] + stock['need2investCA'] - stock['appraisement']
+        elif stockgroupkey == 'CoinGecko':
+            return stockwrapper.GeckoStock(
+                self.this_report['exchange_rate'],
+                self.ref_model.exchange_rate,
+                stockgroup,
+                self.price_cache
+            )
+
+        elif stockgroupkey == 'KRX':
+            return stockwrapper.KrxStock(
+                self.this_report['exchange_rate'],
+                self.ref_model.exchange_rate,
+                stockgroup,
+                self.price_cache
+            )
+
+        else:
+            return stockwrapper.BaseStock(
+                self.this_report['exchange_rate'],
+                self.ref_model.exchange_rate,
+                stockgroup,
+                self.price_cache
+            )
+
+    def _refresh_stockgroup(self, stockgroupkey: str, stockgroup: dict) -> dict:
+        stockgroup_handler = self._create_stockgroup_handler(stockgroupkey, stockgroup)
+        stockgroup_handler.update_all()
+
+        return stockgroup_handler.get_stockgrp()
+
+    @metrics.instrumented()
+    def _refresh_stockgroups(self) -> dict:
+        ''' run update_all() of every stockgroup in parallel and gather the results in the order of ref_report '''
+        from concurrent.futures import ThreadPoolExecutor
+
+        stockgroupkeys = list(self.ref_report['stockgroups'].keys())
+        max_workers = max(1, min(self.refresh_max_workers, len(stockgroupkeys)))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self._refresh_stockgroup, stockgroupkey, self.ref_report['stockgroups'][stockgroupkey])
+                for stockgroupkey in stockgroupkeys
+            ]
+
+        # every group has finished at this point. collect results (in ref_report order) and errors separately
+        # so that one failing group does not hide the result or the error of the others
+        stockgroups = {}
+        errors = {}
+        for stockgroupkey, future in zip(stockgroupkeys, futures):
+            error = future.exception()
+            if error is None:
+                stockgroups[stockgroupkey] = future.result()
+            else:
+                logger.error(f'Refreshing stockgroup {stockgroupkey} failed: {error!r}')
+                errors[stockgroupkey] = error
 
-                # overwrite need2invest as need2investVA
-                stock['need2invest'] = stock['need2investVA']
+        if len(errors) != 0:
+            # keep what has been refreshed so far for inspection before raising
+            self.this_report['stockgroups'] = stockgroups
+            error_msg = f'Refreshing stockgroup(s) {", ".join(errors.keys())} failed.'
+            logger.error(error_msg)
+            raise Exception(error_msg) from next(iter(errors.values()))
+
+        return stockgroups
 
     def print_ref_report(self):
         logger.debug('print_ref_report called')
@@ -287,51 +367,45 @@ class Portfolio:
         logger.debug('print_report called')
         self._print_report(self.this_report)
 
-    def distribute_saving(self):
-        ''' all this distributed saving will be written on this_report '''
+    def refresh_stockgroups(self) -> dict:
+        ''' refresh prices, holdings, cumSumCaInvested and appraisement of every stockgroup of ref_report without
+        deriving anything. the result can be given to distribute_saving() of Portfolios of the same ref report
+        (e.g. what-if savings in service.py) '''
+        self.this_report['exchange_rate'] = self.exchange_rate
+
+        return self._refresh_stockgroups()
+
+    def refresh_stockgroup(self, stockgroupkey: str) -> dict:
+        ''' refresh prices, holdings, cumSumCaInvested and appraisement of one stockgroup of ref_report only
+        (e.g. IncrementalReport.refresh_stockgroup()) '''
+        if stockgroupkey not in self.ref_report['stockgroups'].keys():
+            logger.error(f'{stockgroupkey} is not a stockgroup of the ref report')
+            raise ValueError
+
+        return self._refresh_stockgroup(stockgroupkey, self.ref_report['stockgroups'][stockgroupkey])
+
+    @metrics.instrumented()
+    def distribute_saving(self, refreshed_stockgroups: dict = None):
+        ''' all this distributed saving will be written on this_report
+
+        refreshed_stockgroups: result of refresh_stockgroups() to derive from instead of refreshing stockgroups.
+                               it becomes a part of this_report (give a copy to reuse it)
+        '''
+        import portfolioarrays
 
         # derive common stuffs
-        self.this_report['strategy'] = self.ref_report['strategy']
+        self.this_report['strategy'] = self.ref_model.strategy
         self.this_report['saving'] = self.saving
         self.this_report['savingInKRW'] = self.savingInKRW
         self.this_report['savingInUSD'] = self.savingInUSD
         self.this_report['exchange_rate'] = self.exchange_rate
 
-        # update all values of each stockgroup
-        self.this_report['stockgroups'] = {}
-        for stockgroupkey, stockgroup in self.ref_report['stockgroups'].items():
-            if stockgroupkey == 'KIS':
-                stockgroup_handler = stockwrapper.KisStock(
-                    self.this_report['exchange_rate'],
-                    self.ref_report['exchange_rate'],
-                    self.secrets_fname,
-                    self.tokens_fname,
-                    stockgroup
-                )
-
-            elif stockgroupkey == 'CoinGecko':
-                stockgroup_handler = stockwrapper.GeckoStock(
-                    self.this_report['exchange_rate'],
-                    self.ref_report['exchange_rate'],
-                    stockgroup
-                )
-
-            elif stockgroupkey == 'KRX':
-                stockgroup_handler = stockwrapper.KrxStock(
-                    self.this_report['exchange_rate'],
-                    self.ref_report['exchange_rate'],
-                    stockgroup
-                )
-
-            else:
-                stockgroup_handler = stockwrapper.BaseStock(
-                    self.this_report['exchange_rate'],
-                    self.ref_report['exchange_rate'],
-                    stockgroup
-                )
-
-            stockgroup_handler.update_all()
-            self.this_report['stockgroups'][stockgroupkey] = stockgroup_handler.get_stockgrp()
+        # update all values of each stockgroup unless already refreshed
+        if refreshed_stockgroups is None:
+            refreshed_stockgroups = self._refresh_stockgroups()
+        self.this_report['stockgroups'] = refreshed_stockgroups
+        # the derivations below run on arrays built once from the refreshed stocks
+        self.this_arrays = portfolioarrays.PortfolioArrays(self.this_report['stockgroups'], self.exchange_rate)
 
         # distribute saving according to the strategy
         if self.this_report['strategy'] == 'CA':
@@ -345,10 +419,16 @@ class Portfolio:
 
         # derive cumulative deviation from need2invest
         self._derive_cum_inv_deviation()
+        self.this_arrays.write_back()
 
         # derive total_appraisement
         self._derive_total_appraisement()
 
+    @metrics.instrumented()
     def write_report_to_file(self, fname: str):
         with open(fname, 'w') as ofile:
             json.dump(self.this_report, ofile, indent=4)
+
+    def write_report_to_history(self, history: 'reporthistory.ReportHistory', source: str = None) -> int:
+        ''' append this_report to a report history as the report of today '''
+        return history.append(self.this_report, source=source)
@@ -0,0 +1,208 @@
+''' struct-of-arrays representation of the stocks of a report for the derivation passes of Portfolio
+
+Every stock of every stockgroup becomes one element of flat NumPy arrays (weights, prices, holdings, currency codes,
+fractional flags, ...) built once from the report. CA/VA distribution, units to invest and
+cum_inv_deviation are then derived with vectorized operations in the same operation order as the per-stock
+formulas, and the results are written back to the stock dicts of the report in the existing JSON layout.
+'''
+import logging
+from itertools import repeat
+import numpy as np
+import allocator
+import metrics
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+def _column(stocks: list, field: str) -> np.ndarray:
+    ''' values of a field of the stock dicts as an array (NaN if missing). the dicts are read without a Python loop '''
+    return np.fromiter(map(dict.get, stocks, repeat(field), repeat(np.nan)), dtype=float, count=len(stocks))
+
+
+class PortfolioArrays:
+    CURRENCIES = ('USD', 'KRW')  # index in this tuple is the currency code
+    USD, KRW = range(len(CURRENCIES))
+    FRACTIONAL_STOCKGROUPS = ('CoinGecko',)  # Cryptocurrencies can be fractionally invested
+
+    @metrics.instrumented(stage='build_arrays', provider='Portfolio')
+    def __init__(self, stockgroups: dict, exchange_rate: float):
+        ''' stockgroups: stockgroups of a refreshed report (i.e. every stock has price and appraisement) '''
+        self.exchange_rate = exchange_rate
+        self.stockkeys = []  # (stockgroupkey, stockkey) of each element
+        self.stocks = []  # stock dicts of the report to write the results back to
+
+        fractional = []
+        for stockgroupkey, stockgroup in stockgroups.items():
+            self.stockkeys.extend((stockgroupkey, stockkey) for stockkey in stockgroup['stocks'].keys())
+            self.stocks.extend(stockgroup['stocks'].values())
+            fractional.append(np.full(len(stockgroup['stocks']), stockgroupkey in PortfolioArrays.FRACTIONAL_STOCKGROUPS))
+
+        # currencies are one of CURRENCIES (checked when the reference report is loaded. see reportmodel.py)
+        currencies = np.array(list(map(dict.get, self.stocks, repeat('currency'))))
+        self.weight = _column(self.stocks, 'weight')
+        self.price = _column(self.stocks, 'price')
+        self.holdings = _column(self.stocks, 'holdings')
+        self.appraisement = _column(self.stocks, 'appraisement')
+        self.cum_sum_ca_invested = _column(self.stocks, 'cumSumCaInvested')
+        self.cum_sum_ca_invested_in_krw = _column(self.stocks, 'cumSumCaInvestedInKRW')
+        self.cum_sum_ca_invested_in_usd = _column(self.stocks, 'cumSumCaInvestedInUSD')
+        self.currency = np.where(currencies == 'KRW', PortfolioArrays.KRW, PortfolioArrays.USD).astype(np.int8)
+        self.fractional = np.concatenate(fractional) if len(fractional) != 0 else np.zeros(0, dtype=bool)
+        self.is_krw = self.currency == PortfolioArrays.KRW
+        self.has_cum_sum_ca_invested = ~np.isnan(self.cum_sum_ca_invested)
+
+        # derived arrays. None until derived
+        self.need2invest_ca = None
+        self.need2invest_va = None
+        self.need2invest = None
+        self.need2invest_in_units = None
+        self.leftover_cash = None  # only with the budget allocation
+        self.cum_inv_deviation = None
+
+        # kept from the derivations to re-derive some of the elements (see incremental.py)
+        self.allocation = None
+        self.budget = None
+        self.ref_columns = None  # holdings, price, need2invest and cum_inv_deviation of the aligned ref stocks
+
+    def __len__(self) -> int:
+        return len(self.stocks)
+
+    def _ref_stocks(self, ref_model: 'reportmodel.Report') -> list:
+        ''' reportmodel.Stock of the reference report aligned to the elements '''
+        ref_stocks = ref_model.stocks()
+        if [(stockgroupkey, stockkey) for stockgroupkey, stockkey, _ in ref_stocks] == self.stockkeys:
+            return [stock for _, _, stock in ref_stocks]  # usually the same order as this report, copied from the ref report
+        return [ref_model.stockgroups[stockgroupkey].stocks[stockkey] for stockgroupkey, stockkey in self.stockkeys]
+
+    # the derivations below are given a selection of the elements (sel) to derive, which is slice(None) for
+    # a whole derivation and an index array for re-deriving some of the elements
+    def appraisement_of(self, sel) -> np.ndarray:
+        ''' appraisement in the same operation order as BaseStock._derive_appraisement() '''
+        appraisement = self.holdings[sel] * self.price[sel]
+        return np.where(self.is_krw[sel], appraisement / self.exchange_rate, appraisement)
+
+    def cum_sum_ca_invested_of(self, sel) -> np.ndarray:
+        ''' cumSumCaInvested after need2investCA is derived '''
+        # in case cumSumCaInvested is given, ignore cumSumCaInvestedInKRW and cumSumCaInvestedInUSD.
+        # in case of neither exists, use appraisement as previous cumSumCaInvested
+        # (N.B. this route is only for the 1st report because reports afterward all have cumSumCaInvested).
+        # otherwise use cumSumCaInvestedInKRW and cumSumCaInvestedInUSD instead
+        has_krw = ~np.isnan(self.cum_sum_ca_invested_in_krw[sel])
+        has_usd = ~np.isnan(self.cum_sum_ca_invested_in_usd[sel])
+        from_krw_usd = self.need2invest_ca[sel] \
+            + np.where(has_krw, self.cum_sum_ca_invested_in_krw[sel] / self.exchange_rate, 0.0) \
+            + np.where(has_usd, self.cum_sum_ca_invested_in_usd[sel], 0.0)
+        return np.where(
+            self.has_cum_sum_ca_invested[sel],
+            self.cum_sum_ca_invested[sel],
+            np.where(has_krw | has_usd, from_krw_usd, self.appraisement[sel] + self.need2invest_ca[sel])
+        )
+
+    def need2invest_va_of(self, sel) -> np.ndarray:
+        # need2investVA: difference between the ideal target (cumSumCaInvested + need2investCA)
+        #                and current actual appraisement
+        return self.cum_sum_ca_invested[sel] + self.need2invest_ca[sel] - self.appraisement[sel]
+
+    def price_usd_of(self, sel) -> np.ndarray:
+        return np.where(self.is_krw[sel], self.price[sel] / self.exchange_rate, self.price[sel])
+
+    def rounded_units_of(self, sel) -> np.ndarray:
+        price_usd = self.price_usd_of(sel)
+        if not (price_usd > 0.0).all():
+            indices = np.arange(len(self.stocks))[sel][~(price_usd > 0.0)].tolist()
+            prices = {f'{self.stockkeys[index][1]} of {self.stockkeys[index][0]}': self.stocks[index].get('price')
+                      for index in indices}
+            error_msg = f'every price should be positive to derive units, but {prices} given'
+            logger.error(error_msg)
+            raise ValueError(error_msg)
+
+        units = self.need2invest[sel] / price_usd
+        return np.where(self.fractional[sel], units, np.round(units))  # rounds half to even like round()
+
+    def cum_inv_deviation_of(self, sel) -> np.ndarray:
+        ''' cumulated deviation between need2invest and actual investment after derive_cum_inv_deviation() '''
+        ref_holdings, ref_price, ref_need2invest, ref_cum_inv_deviation = (column[sel] for column in self.ref_columns)
+
+        actual_invested_in_units = np.where(np.isnan(ref_holdings), 0.0, self.holdings[sel] - ref_holdings)
+        # if a ref stock does not have price info, use that of this stock instead
+        actual_inv_increment = np.where(np.isnan(ref_price), self.price[sel], ref_price) * actual_invested_in_units
+        actual_inv_increment = np.where(self.is_krw[sel], actual_inv_increment / self.exchange_rate, actual_inv_increment)
+        # assume inv_deviation == 0 if the ref report has no record of need2invest
+        inv_deviation = np.where(np.isnan(ref_need2invest), 0.0, ref_need2invest - actual_inv_increment)
+        # assume cum_inv_deviation of the ref report is 0 if not available
+        return np.where(np.isnan(ref_cum_inv_deviation), inv_deviation, ref_cum_inv_deviation + inv_deviation)
+
+    def distribute_saving_CA(self, saving: float):
+        self.need2invest_ca = saving * self.weight
+        self.cum_sum_ca_invested = self.cum_sum_ca_invested_of(slice(None))
+        self.need2invest = self.need2invest_ca
+
+    def distribute_saving_VA(self, saving: float):
+        # do CA first
+        self.distribute_saving_CA(saving)
+
+        self.need2invest_va = self.need2invest_va_of(slice(None))
+        self.need2invest = self.need2invest_va
+
+    def derive_units_to_invest(self, allocation: str = 'round', budget: float = None):
+        ''' allocation: 'round' rounds the units of each stock on its own and
+                        'budget' allocates the units within the budget (see allocator.allocate_units()) '''
+        if allocation == 'round':
+            self.need2invest_in_units = self.rounded_units_of(slice(None))
+        elif allocation == 'budget':
+            self.need2invest_in_units, self.leftover_cash = \
+                allocator.allocate_units(self.need2invest, self.price_usd_of(slice(None)), self.fractional, budget)
+        else:
+            logger.error(f'unit allocation should be one of {allocator.ALLOCATIONS}, but {allocation} given')
+            raise ValueError
+        self.allocation = allocation
+        self.budget = budget
+
+    def derive_cum_inv_deviation(self, ref_model: 'reportmodel.Report'):
+        ''' cumulate the deviation between need2invest and actual investment in terms of the reference report '''
+        ref_stocks = self._ref_stocks(ref_model)
+        self.ref_columns = tuple(np.array([getattr(stock, slot) for stock in ref_stocks], dtype=float)  # None is NaN
+                                 for slot in ('holdings', 'price', 'need2invest', 'cum_inv_deviation'))
+        self.cum_inv_deviation = self.cum_inv_deviation_of(slice(None))
+
+    def total_appraisement(self) -> float:
+        # cumsum adds sequentially (np.sum adds pairwise), so the total is the same as summing stock by stock
+        return float(np.cumsum(np.concatenate(([0.0], self.appraisement)))[-1])
+
+    @metrics.instrumented(provider='Portfolio')
+    def write_back(self, indices: list = None):
+        ''' write the derived arrays to the stock dicts of the report (in the order the fields were derived)
+
+        indices: elements to write (every element by default)
+        '''
+        sel = slice(None) if indices is None else np.asarray(indices, dtype=np.intp)
+        stocks = self.stocks if indices is None else [self.stocks[index] for index in sel.tolist()]
+
+        for stock, appraisement, need2invest_ca, has_cum_sum_ca_invested, cum_sum_ca_invested, need2invest in zip(
+            stocks,
+            self.appraisement[sel].tolist(),
+            self.need2invest_ca[sel].tolist(),
+            self.has_cum_sum_ca_invested[sel].tolist(),
+            self.cum_sum_ca_invested[sel].tolist(),
+            self.need2invest[sel].tolist()
+        ):
+            stock['appraisement'] = appraisement  # the same as given unless re-derived
+            stock['need2investCA'] = need2invest_ca
+            if not has_cum_sum_ca_invested:  # a given cumSumCaInvested is kept as is
+                stock['cumSumCaInvested'] = cum_sum_ca_invested
+            stock.pop('cumSumCaInvestedInKRW', None)
+            stock.pop('cumSumCaInvestedInUSD', None)
+            stock['need2invest'] = need2invest
+
+        if self.need2invest_va is not None:
+            for stock, need2invest_va in zip(stocks, self.need2invest_va[sel].tolist()):
+                stock['need2investVA'] = need2invest_va
+
+        # units of stocks that cannot be fractionally invested are integers as round() gives
+        for stock, units, fractional in zip(stocks, self.need2invest_in_units[sel].tolist(), self.fractional[sel].tolist()):
+            stock['need2investInUnits'] = units if fractional else int(units)
+
+        if self.cum_inv_deviation is not None:
+            for stock, cum_inv_deviation in zip(stocks, self.cum_inv_deviation[sel].tolist()):
+                stock['cum_inv_deviation'] = cum_inv_deviation
@@ -0,0 +1,398 @@
+''' real-time prices of KIS stocks streamed into a derived report
+
+After a regular derivation (refresh and distribute_saving()), the KIS stocks are subscribed to the websocket
+real-time quote feed of KIS (H0STCNT0 for DOM and HDFSCNT0 for US stocks). Every tick reprices only its stock:
+appraisement, need2invest, need2investInUnits and cum_inv_deviation of the stock and total_appraisement of the report
+are re-derived (see incremental.py).
+
+Bursts of ticks never pile up:
+    - the websocket client buffers at most MAX_QUEUE frames. beyond that it stops reading the socket and TCP flow
+      control pushes back on the feed
+    - frames are parsed as they arrive and the ticks of a stock coalesce into its latest price (TickBuffer), so
+      pending ticks are bounded by the number of subscribed stocks no matter how slow the report is updated
+    - pending ticks are applied together at most once every apply interval
+'''
+import asyncio
+import json
+import logging
+import threading
+import time
+import click
+import httpclient
+import incremental
+import portfolio
+import reportmodel
+from setup_logger import setup_logger
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+class TickBuffer:
+    ''' latest price of each stock not applied yet. ticks of stocks not given are ignored '''
+
+    def __init__(self, stockkeys):
+        self.stockkeys = set(stockkeys)
+        self.pending = {}  # stockkey -> latest price
+        self.condition = threading.Condition()
+        self.closed = False
+        self.num_ticks = 0
+        self.num_coalesced = 0  # ticks replaced by a later tick of the same stock before being applied
+
+    def put(self, stockkey: str, price: float):
+        if stockkey not in self.stockkeys:
+            return
+
+        with self.condition:
+            self.num_ticks += 1
+            if stockkey in self.pending.keys():
+                self.num_coalesced += 1
+            self.pending[stockkey] = price
+            self.condition.notify()
+
+    def take(self, timeout: float = None) -> dict:
+        ''' wait for ticks and take all pending ones (empty if timed out or closed) '''
+        with self.condition:
+            if len(self.pending) == 0 and not self.closed:
+                self.condition.wait(timeout)
+            pending, self.pending = self.pending, {}
+            return pending
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class KisPriceStream:
+    ''' client of the KIS real-time quote feed putting the price of every tick into a TickBuffer '''
+    WS_URL_REAL = 'ws://ops.koreainvestment.com:21000'
+    WS_URL_TEST = 'ws://ops.koreainvestment.com:31000'  # test domain
+    WS_URL = WS_URL_REAL
+    APPROVAL_PATH = 'oauth2/Approval'
+
+    # - TR_ID (real-time services) and the layout of their records
+    TR_ID_DOM_TRADE = 'H0STCNT0'
+    TR_ID_US_TRADE = 'HDFSCNT0'  # delayed trades of US stocks
+    NUM_FIELDS = {TR_ID_DOM_TRADE: 46, TR_ID_US_TRADE: 26}
+    PRICE_FIELD = {TR_ID_DOM_TRADE: 2, TR_ID_US_TRADE: 11}  # STCK_PRPR and LAST
+    MAX_SUBSCRIPTIONS = 41  # per session
+
+    MAX_QUEUE = 64  # frames received but not parsed yet
+    RECONNECT_MIN_DELAY_IN_SEC = 1.0
+    RECONNECT_MAX_DELAY_IN_SEC = 30.0
+
+    def __init__(self, secrets_fname: str, stocks: dict, tick_buffer: TickBuffer, ws_url: str = WS_URL):
+        ''' stocks: stockkey -> market (DOM, NYS, NAS or AMS) of the stocks to subscribe '''
+        import stockwrapper
+
+        if len(stocks) > KisPriceStream.MAX_SUBSCRIPTIONS:
+            logger.error(f'KIS allows up to {KisPriceStream.MAX_SUBSCRIPTIONS} real-time subscriptions per session, '
+                         f'but {len(stocks)} stocks given')
+            raise ValueError
+
+        with open(secrets_fname, 'r') as f_secret:
+            f_secret_loaded = json.load(f_secret)
+            self.APP_KEY = f_secret_loaded['KisSecrets']['APP_KEY']
+            self.APP_SECRET = f_secret_loaded['KisSecrets']['APP_SECRET']
+        self.url_base = stockwrapper.KisStock.URL_BASE
+        self.ws_url = ws_url
+        self.tick_buffer = tick_buffer
+
+        # tr_key -> (tr_id, stockkey). US keys are D + EXCD + symbol (e.g. DNASAAPL)
+        self.subscriptions = {}
+        for stockkey, market in stocks.items():
+            if market == 'DOM':
+                self.subscriptions[stockkey] = (KisPriceStream.TR_ID_DOM_TRADE, stockkey)
+            else:
+                self.subscriptions[f'D{market}{stockkey}'] = (KisPriceStream.TR_ID_US_TRADE, stockkey)
+
+        self.loop = None
+        self.websocket = None
+        self.stopping = None  # asyncio.Event set by stop()
+        self.thread = None
+
+    def _issue_approval_key(self) -> str:
+        resp = httpclient.post(
+            f'{self.url_base}/{KisPriceStream.APPROVAL_PATH}',
+            headers={'content-type': 'application/json'},
+            data=json.dumps({'grant_type': 'client_credentials', 'appkey': self.APP_KEY, 'secretkey': self.APP_SECRET})
+        )
+        resp_json = resp.json()
+        if 'approval_key' not in resp_json.keys():
+            logger.error(f'Issuing an approval key of the real-time quote feed failed: {resp_json}')
+            raise Exception
+
+        return resp_json['approval_key']
+
+    def start(self) -> 'KisPriceStream':
+        started = threading.Event()
+        self.thread = threading.Thread(target=lambda: asyncio.run(self._run(started)), daemon=True)
+        self.thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        def stop_in_loop():
+            self.stopping.set()
+            if self.websocket is not None:
+                asyncio.ensure_future(self.websocket.close())
+
+        self.loop.call_soon_threadsafe(stop_in_loop)
+        self.thread.join()
+
+    async def _run(self, started: threading.Event):
+        ''' stream until stopped, reconnecting with exponential backoff '''
+        from websockets.asyncio.client import connect  # only needed to stream prices
+
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        started.set()
+        delay = KisPriceStream.RECONNECT_MIN_DELAY_IN_SEC
+        while not self.stopping.is_set():
+            try:
+                approval_key = await asyncio.to_thread(self._issue_approval_key)
+                async with connect(self.ws_url, max_queue=KisPriceStream.MAX_QUEUE) as websocket:
+                    self.websocket = websocket
+                    for tr_key, (tr_id, _) in self.subscriptions.items():
+                        await websocket.send(json.dumps({
+                            'header': {'approval_key': approval_key, 'custtype': 'P', 'tr_type': '1',
+                                       'content-type': 'utf-8'},
+                            'body': {'input': {'tr_id': tr_id, 'tr_key': tr_key}}
+                        }))
+                    logger.info(f'Subscribed {len(self.subscriptions)} stocks to {self.ws_url}')
+                    delay = KisPriceStream.RECONNECT_MIN_DELAY_IN_SEC
+
+                    async for message in websocket:
+                        if message[0] in ('0', '1'):
+                            self._parse_ticks(message)
+                        else:
+                            await self._handle_control(websocket, message)
+            except Exception as e:
+                if self.stopping.is_set():
+                    break
+                logger.warning(f'The real-time quote feed is disconnected ({e!r}). reconnecting in {delay:.0f} seconds')
+            finally:
+                self.websocket = None
+
+            try:
+                await asyncio.wait_for(self.stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                delay = min(delay * 2, KisPriceStream.RECONNECT_MAX_DELAY_IN_SEC)
+
+    def _parse_ticks(self, message: str):
+        ''' e.g. 0|H0STCNT0|002|{fields of record 1}^{fields of record 2}. malformed records are skipped so that
+        they never tear down the connection '''
+        frame = message.split('|', 3)
+        if len(frame) != 4 or not frame[2].isdigit():
+            logger.warning(f'Ignoring a malformed frame: {message[:80]}')
+            return
+        encrypted, tr_id, num_records, data = frame
+        if encrypted == '1' or tr_id not in KisPriceStream.NUM_FIELDS.keys():
+            logger.debug(f'Ignoring a frame of {tr_id}')
+            return
+
+        fields = data.split('^')
+        num_fields = KisPriceStream.NUM_FIELDS[tr_id]
+        price_field = KisPriceStream.PRICE_FIELD[tr_id]
+        for record_idx in range(int(num_records)):
+            record = fields[record_idx * num_fields:(record_idx + 1) * num_fields]
+            if len(record) != num_fields:
+                logger.warning(f'Skipping record {record_idx} of a frame of {tr_id} with {len(record)} fields '
+                               f'instead of {num_fields}')
+                continue
+            if record[0] not in self.subscriptions.keys():
+                continue
+            try:
+                price = float(record[price_field])
+            except ValueError:
+                logger.warning(f'Skipping a tick of {record[0]} with price {record[price_field]!r}')
+                continue
+            self.tick_buffer.put(self.subscriptions[record[0]][1], price)
+
+    async def _handle_control(self, websocket, message: str):
+        control = json.loads(message)
+        if control['header']['tr_id'] == 'PINGPONG':
+            await websocket.send(message)  # the feed disconnects sessions not answering
+        elif control.get('body', {}).get('rt_cd', '0') != '0':
+            logger.warning(f'Subscribing {control["header"].get("tr_key")} failed: {control["body"].get("msg1")}')
+
+
+class LivePortfolio:
+    ''' a derived report of a Portfolio kept up to date with streamed prices of a stockgroup '''
+
+    def __init__(self, derived_portfolio: 'portfolio.Portfolio', stockgroupkey: str = 'KIS'):
+        self.incremental_report = incremental.IncrementalReport(derived_portfolio)
+        self.report = derived_portfolio.this_report
+        self.arrays = derived_portfolio.this_arrays
+        self.stockgroupkey = stockgroupkey
+        self.stocks = self.report['stockgroups'][stockgroupkey]['stocks']
+        self.lock = threading.Lock()
+        self.num_applied = 0
+
+    def apply(self, ticks: dict) -> list:
+        ''' reprice the stocks of the ticks (stockkey -> price) and return (stockgroupkey, stockkey, units before)
+        of the stocks whose need2investInUnits changed '''
+        ticks = {stockkey: price for stockkey, price in ticks.items() if price != self.stocks[stockkey]['price']}
+        if len(ticks) == 0:
+            return []
+
+        with self.lock:
+            units_before = self.arrays.need2invest_in_units.copy()
+            self.incremental_report.update_prices(self.stockgroupkey, ticks)
+            self.incremental_report.recompute()
+            self.num_applied += len(ticks)
+
+        return [(*self.arrays.stockkeys[index], units_before[index])
+                for index in (units_before != self.arrays.need2invest_in_units).nonzero()[0].tolist()]
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return reportmodel.copy_report(self.report)
+
+
+def apply_ticks(live_portfolio: LivePortfolio, tick_buffer: TickBuffer, stop: threading.Event,
+                apply_interval_in_sec: float, on_update=None):
+    ''' apply pending ticks at most once every apply interval until stopped.
+    on_update(changes) is called with the result of LivePortfolio.apply() if any units changed '''
+    while not stop.is_set():
+        ticks = tick_buffer.take(timeout=1.0)
+        if len(ticks) == 0:
+            continue
+
+        started = time.monotonic()
+        changes = live_portfolio.apply(ticks)
+        if len(changes) != 0 and on_update is not None:
+            on_update(changes)
+        stop.wait(max(apply_interval_in_sec - (time.monotonic() - started), 0.0))  # ticks coalesce meanwhile
+
+
+@click.command()
+@click.option(
+    '--debug-level',
+    type=click.Choice(['DEBUG', 'INFO', 'WARNING'], case_sensitive=False),
+    default='INFO',
+    show_default=True,
+    help='debug level for logger'
+)
+@click.option('--saving-in-krw', type=float, default=0, show_default=True, help='amount of money to save in KRW')
+@click.option('--saving-in-usd', type=float, default=0.0, show_default=True, help='amount of money to save in USD')
+@click.option(
+    '--secrets-path',
+    type=click.Path(exists=True, dir_okay=False),
+    default='secrets.json',
+    show_default=True,
+    help='path to the secrets JSON file'
+)
+@click.option(
+    '--tokens-path',
+    type=click.Path(exists=False, dir_okay=False),
+    default='tokens.json',
+    show_default=True,
+    help='path to the tokens JSON file'
+)
+@click.option(
+    '--unit-allocation',
+    type=click.Choice(['round', 'budget']),
+    default='round',
+    show_default=True,
+    help='unit allocation (refer to main.py)'
+)
+@click.option(
+    '--cache-dir',
+    type=click.Path(file_okay=False),
+    default='.cache',
+    show_default=True,
+    help='directory of the price cache shared across runs'
+)
+@click.option(
+    '--apply-interval-ms',
+    type=click.FloatRange(min=0.0),
+    default=200.0,
+    show_default=True,
+    help='minimum interval between updates of the report. ticks of a stock within an interval coalesce'
+)
+@click.option(
+    '--ws-url',
+    type=str,
+    default=KisPriceStream.WS_URL,
+    show_default=True,
+    help='URL of the real-time quote feed (e.g. of the stand-in of standin.py --quote-port)'
+)
+@click.option(
+    '--stand-in-url',
+    type=str,
+    default=None,
+    help='send every HTTP request to this stand-in server (see standin.py) instead of the real APIs'
+)
+@click.argument(
+    'ref_report_path',
+    type=click.Path(exists=True, dir_okay=False),
+    nargs=1
+)
+@click.argument(
+    'output_report_path',
+    type=click.Path(exists=False, dir_okay=False),
+    nargs=1,
+    required=False
+)
+def main(debug_level, saving_in_krw, saving_in_usd, secrets_path, tokens_path, unit_allocation, cache_dir,
+         apply_interval_ms, ws_url, stand_in_url, ref_report_path, output_report_path):
+    ''' derive a report from REF_REPORT_PATH and keep it up to date with real-time prices of its KIS stocks.
+    the latest report is written into OUTPUT_REPORT_PATH (if given) on exit '''
+    import coinindex
+    import marketcache
+    import sessionindex
+
+    setup_logger('autoinvestment_logger', debug_level)
+
+    httpclient.install_transports(stand_in_url=stand_in_url)
+    sessionindex.configure(cache_dir)
+    coinindex.configure(cache_dir)
+    my_portfolio = portfolio.Portfolio(ref_report_path,
+                                       secrets_path,
+                                       tokens_path,
+                                       saving_in_krw,
+                                       saving_in_usd,
+                                       unit_allocation=unit_allocation,
+                                       price_cache=marketcache.PriceCache(cache_dir, 'refresh'),
+                                       exchange_rate_cache=marketcache.ExchangeRateCache(cache_dir))
+    my_portfolio.distribute_saving()
+
+    if 'KIS' not in my_portfolio.this_report['stockgroups'].keys():
+        logger.error('no KIS stockgroup to stream prices of')
+        raise ValueError
+    kis_stocks = my_portfolio.this_report['stockgroups']['KIS']['stocks']
+    live_portfolio = LivePortfolio(my_portfolio)
+    tick_buffer = TickBuffer(kis_stocks.keys())
+    stream = KisPriceStream(secrets_path,
+                            {stockkey: stock['market'] for stockkey, stock in kis_stocks.items()},
+                            tick_buffer,
+                            ws_url).start()
+
+    def log_changes(changes: list):
+        for stockgroupkey, stockkey, units_before in changes:
+            stock = live_portfolio.report['stockgroups'][stockgroupkey]['stocks'][stockkey]
+            logger.info(f'{stockkey}: price {stock["price"]}, need2invest {stock["need2invest"]:.2f}, '
+                        f'need2investInUnits {units_before:g} -> {stock["need2investInUnits"]:g}')
+        logger.info(f'Total appraisement: {live_portfolio.report["total_appraisement"]:.2f}')
+
+    stop = threading.Event()
+    try:
+        apply_ticks(live_portfolio, tick_buffer, stop, apply_interval_ms / 1000.0, log_changes)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        stream.stop()
+        tick_buffer.close()
+        httpclient.close()
+        logger.info(f'{tick_buffer.num_ticks} ticks received, {tick_buffer.num_coalesced} coalesced, '
+                    f'{live_portfolio.num_applied} applied')
+
+    if output_report_path is not None:
+        my_portfolio.write_report_to_file(output_report_path)
+
+
+if __name__ == '__main__':
+    main()
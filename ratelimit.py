@@ -0,0 +1,30 @@
+import threading
+import time
+
+
+class TokenBucket:
+    ''' thread-safe token bucket limiting how many requests can be sent per second '''
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate  # tokens refilled per second
+        self.capacity = capacity  # maximum number of tokens (i.e. burst size)
+        self.tokens = float(capacity)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self):
+        ''' block until a token is available and consume it '''
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait_in_sec = (1.0 - self.tokens) / self.rate
+
+            time.sleep(wait_in_sec)
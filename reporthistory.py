@@ -0,0 +1,311 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+import click
+from setup_logger import setup_logger
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+def is_history_db(path: str) -> bool:
+    ''' whether path is a report history DB (an SQLite file) rather than a JSON report '''
+    with open(path, 'rb') as f:
+        return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+
+class ReportHistory:
+    ''' append-only store of every generated report
+
+    a report is stored as a whole (so it can be restored exactly as a reference report) in the reports table and,
+    for queries over time, each of its stocks is stored as a row of the stock_entries table keyed by
+    (report_date, stockgroup, stock).
+    '''
+    # per-stock report fields kept in their own columns of stock_entries. priceUsd is not a field of the stocks but
+    # derived from price, currency and exchange_rate of the report when stored
+    TEXT_FIELDS = ('currency', 'market')
+    NUMERIC_FIELDS = (
+        'weight',
+        'holdings',
+        'price',
+        'priceUsd',
+        'appraisement',
+        'cumSumCaInvested',
+        'need2investCA',
+        'need2investVA',
+        'need2invest',
+        'need2investInUnits',
+        'actualInvestedInUnits',
+        'cum_inv_deviation'
+    )
+    DATE_FORMAT = '%Y-%m-%d'
+
+    def __init__(self, db_path: str):
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path,
+                                    timeout=10.0,
+                                    isolation_level=None,  # autocommit unless a transaction is begun explicitly
+                                    check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS reports ('
+                          'report_id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                          'report_date TEXT NOT NULL, '
+                          'recorded_at REAL NOT NULL, '
+                          'source TEXT, '
+                          'strategy TEXT, '
+                          'saving REAL, '
+                          'exchange_rate REAL, '
+                          'total_appraisement REAL, '
+                          'body TEXT NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS stock_entries ('
+                          'report_id INTEGER NOT NULL REFERENCES reports (report_id), '
+                          'report_date TEXT NOT NULL, '
+                          'stockgroup TEXT NOT NULL, '
+                          'stock TEXT NOT NULL, '
+                          + ''.join(f'{field} TEXT, ' for field in ReportHistory.TEXT_FIELDS)
+                          + ', '.join(f'{field} REAL' for field in ReportHistory.NUMERIC_FIELDS) + ', '
+                          'PRIMARY KEY (report_id, stockgroup, stock))')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS reports_report_date ON reports (report_date)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS stock_entries_stock ON stock_entries (stock, report_date)')
+        # stored reports are never modified
+        for table in ('reports', 'stock_entries'):
+            for operation in ('UPDATE', 'DELETE'):
+                self.conn.execute(f'CREATE TRIGGER IF NOT EXISTS {table}_no_{operation.lower()} '
+                                  f'BEFORE {operation} ON {table} '
+                                  f"BEGIN SELECT RAISE(ABORT, '{table} is append-only'); END")
+
+    @staticmethod
+    def _price_usd(stock: dict, exchange_rate: float):
+        ''' price of a stock in USD (None if the price or the exchange rate it needs is not given) '''
+        if stock.get('price') is None:
+            return None
+        if stock.get('currency') == 'KRW':
+            return stock['price'] / exchange_rate if exchange_rate is not None else None
+        return stock['price']
+
+    def append(self, report: dict, report_date: date = None, source: str = None) -> int:
+        ''' store a report and return its report_id. report_date defaults to today '''
+        report_date = (report_date or date.today()).strftime(ReportHistory.DATE_FORMAT)
+        stock_rows = []
+        for stockgroupkey, stockgroup in report['stockgroups'].items():
+            for stockkey, stock in stockgroup['stocks'].items():
+                stock = dict(stock, priceUsd=ReportHistory._price_usd(stock, report.get('exchange_rate')))
+                stock_rows.append(
+                    (report_date, stockgroupkey, stockkey)
+                    + tuple(stock.get(field) for field in ReportHistory.TEXT_FIELDS)
+                    + tuple(stock.get(field) for field in ReportHistory.NUMERIC_FIELDS)
+                )
+
+        placeholders = ', '.join('?' * (4 + len(ReportHistory.TEXT_FIELDS) + len(ReportHistory.NUMERIC_FIELDS)))
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                report_id = self.conn.execute(
+                    'INSERT INTO reports (report_date, recorded_at, source, strategy, saving, exchange_rate, '
+                    'total_appraisement, body) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (report_date,
+                     time.time(),
+                     source,
+                     report.get('strategy'),
+                     report.get('saving'),
+                     report.get('exchange_rate'),
+                     report.get('total_appraisement'),
+                     json.dumps(report))
+                ).lastrowid
+                self.conn.executemany(f'INSERT INTO stock_entries VALUES ({placeholders})',
+                                      [(report_id,) + row for row in stock_rows])
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+
+        logger.debug(f'Report of {report_date} stored in the history as report_id {report_id}')
+        return report_id
+
+    def get_report(self, report_id: int) -> dict:
+        with self.lock:
+            row = self.conn.execute('SELECT body FROM reports WHERE report_id = ?', (report_id,)).fetchone()
+        if row is None:
+            error_msg = f'No report of report_id {report_id} in the history'
+            logger.error(error_msg)
+            raise Exception(error_msg)
+        return json.loads(row[0])
+
+    def latest_report(self) -> dict:
+        ''' the most recently appended report of the latest date '''
+        with self.lock:
+            row = self.conn.execute('SELECT body FROM reports ORDER BY report_date DESC, report_id DESC LIMIT 1').fetchone()
+        if row is None:
+            error_msg = 'The report history is empty'
+            logger.error(error_msg)
+            raise Exception(error_msg)
+        return json.loads(row[0])
+
+    @staticmethod
+    def _date_range_clause(from_date: date, to_date: date) -> tuple:
+        clauses, params = [], []
+        if from_date is not None:
+            clauses.append('report_date >= ?')
+            params.append(from_date.strftime(ReportHistory.DATE_FORMAT))
+        if to_date is not None:
+            clauses.append('report_date <= ?')
+            params.append(to_date.strftime(ReportHistory.DATE_FORMAT))
+        return clauses, params
+
+    def list_reports(self, from_date: date = None, to_date: date = None) -> list:
+        ''' summaries (without the report bodies) of the reports within the date range, oldest first '''
+        clauses, params = ReportHistory._date_range_clause(from_date, to_date)
+        where = f'WHERE {" AND ".join(clauses)} ' if len(clauses) != 0 else ''
+        with self.lock:
+            cursor = self.conn.execute('SELECT report_id, report_date, source, strategy, saving, exchange_rate, '
+                                       f'total_appraisement FROM reports {where}ORDER BY report_date, report_id',
+                                       params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def stock_series(self,
+                     stockkey: str,
+                     fields: tuple = ('holdings', 'price', 'appraisement', 'cum_inv_deviation'),
+                     stockgroupkey: str = None,
+                     from_date: date = None,
+                     to_date: date = None) -> list:
+        ''' values of the given fields of a stock in every report within the date range, oldest first '''
+        unknown_fields = [field for field in fields if field not in ReportHistory.TEXT_FIELDS + ReportHistory.NUMERIC_FIELDS]
+        if len(unknown_fields) != 0:
+            logger.error(f'Unknown fields {unknown_fields}. Choose among '
+                         f'{ReportHistory.TEXT_FIELDS + ReportHistory.NUMERIC_FIELDS}')
+            raise ValueError
+
+        clauses, params = ReportHistory._date_range_clause(from_date, to_date)
+        clauses.insert(0, 'stock = ?')
+        params.insert(0, stockkey)
+        if stockgroupkey is not None:
+            clauses.append('stockgroup = ?')
+            params.append(stockgroupkey)
+        with self.lock:
+            cursor = self.conn.execute(f'SELECT report_id, report_date, stockgroup, {", ".join(fields)} '
+                                       f'FROM stock_entries WHERE {" AND ".join(clauses)} '
+                                       'ORDER BY report_date, report_id',
+                                       params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def import_json_reports(self, report_paths: list, date_format: str = None) -> list:
+        ''' append a chain of JSON reports in the given order and return their report_ids
+
+        the date of each report is parsed from its file name (without extension) with date_format if given,
+        otherwise the modification date of the file is used.
+        '''
+        report_ids = []
+        for report_path in report_paths:
+            if date_format is not None:
+                report_date = datetime.strptime(os.path.splitext(os.path.basename(report_path))[0], date_format).date()
+            else:
+                report_date = date.fromtimestamp(os.path.getmtime(report_path))
+            with open(report_path, 'r') as f:
+                report = json.load(f)
+            report_ids.append(self.append(report, report_date, source=os.path.abspath(report_path)))
+            logger.info(f'Imported {report_path} as the report of {report_date}')
+
+        return report_ids
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def _print_rows(rows: list):
+    from tabulate import tabulate
+
+    print(tabulate(rows, headers='keys', tablefmt='pretty'))
+
+
+@click.group()
+@click.option(
+    '--debug-level',
+    type=click.Choice(['DEBUG', 'INFO', 'WARNING'], case_sensitive=False),
+    default='INFO',
+    show_default=True,
+    help='debug level for logger'
+)
+def cli(debug_level):
+    ''' import, query and export the report history DB '''
+    setup_logger('autoinvestment_logger', debug_level)
+
+
+@cli.command(name='import')
+@click.option(
+    '--date-format',
+    type=str,
+    default=None,
+    help='strptime format of the file names (without extension) giving the report dates, e.g. result_%Y%m%d. '
+         'modification dates of the files are used if not given'
+)
+@click.argument('db_path', type=click.Path(dir_okay=False), nargs=1)
+@click.argument('report_paths', type=click.Path(exists=True, dir_okay=False), nargs=-1, required=True)
+def import_command(date_format, db_path, report_paths):
+    ''' append existing JSON reports (in the given order) to the history DB '''
+    history = ReportHistory(db_path)
+    history.import_json_reports(list(report_paths), date_format)
+    history.close()
+
+
+@cli.command(name='reports')
+@click.option('--from-date', type=click.DateTime(formats=[ReportHistory.DATE_FORMAT]), default=None)
+@click.option('--to-date', type=click.DateTime(formats=[ReportHistory.DATE_FORMAT]), default=None)
+@click.argument('db_path', type=click.Path(exists=True, dir_okay=False), nargs=1)
+def reports_command(from_date, to_date, db_path):
+    ''' list the reports stored in the history DB '''
+    history = ReportHistory(db_path)
+    _print_rows(history.list_reports(from_date and from_date.date(), to_date and to_date.date()))
+    history.close()
+
+
+@cli.command(name='series')
+@click.option(
+    '--field',
+    'fields',
+    type=click.Choice(ReportHistory.TEXT_FIELDS + ReportHistory.NUMERIC_FIELDS),
+    multiple=True,
+    help='report field to show (repeatable). holdings, price, appraisement and cum_inv_deviation if not given'
+)
+@click.option('--stockgroup', type=str, default=None, help='stockgroup key of the stock if the key is ambiguous')
+@click.option('--from-date', type=click.DateTime(formats=[ReportHistory.DATE_FORMAT]), default=None)
+@click.option('--to-date', type=click.DateTime(formats=[ReportHistory.DATE_FORMAT]), default=None)
+@click.argument('db_path', type=click.Path(exists=True, dir_okay=False), nargs=1)
+@click.argument('stock', type=str, nargs=1)
+def series_command(fields, stockgroup, from_date, to_date, db_path, stock):
+    ''' show how the fields of a stock evolved over the stored reports '''
+    history = ReportHistory(db_path)
+    kwargs = {'fields': fields} if len(fields) != 0 else {}
+    _print_rows(history.stock_series(stock,
+                                     stockgroupkey=stockgroup,
+                                     from_date=from_date and from_date.date(),
+                                     to_date=to_date and to_date.date(),
+                                     **kwargs))
+    history.close()
+
+
+@cli.command(name='export')
+@click.option('--report-id', type=int, default=None, help='report to export. the latest report if not given')
+@click.argument('db_path', type=click.Path(exists=True, dir_okay=False), nargs=1)
+@click.argument('output_report_path', type=click.Path(dir_okay=False, writable=True), nargs=1)
+def export_command(report_id, db_path, output_report_path):
+    ''' write a stored report as a JSON report (e.g. to add actualInvestedInUnits by hand) '''
+    history = ReportHistory(db_path)
+    report = history.latest_report() if report_id is None else history.get_report(report_id)
+    with open(output_report_path, 'w') as f:
+        json.dump(report, f, indent=4)
+    history.close()
+
+
+if __name__ == '__main__':
+    cli()
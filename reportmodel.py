@@ -0,0 +1,214 @@
+''' typed model of a reference report, validated in a single pass when it is loaded
+
+Report, StockGroup and Stock are slotted classes holding the fields the derivation reads from the reference report,
+converted once. Report.from_dict() checks every stock with the field checks compiled for its kind of stockgroup
+(the checks of a stockgroup key are compiled on first use and reused) and reports every problem of the report at once,
+so the stockgroup handlers and the derivation do not probe the stock dicts for required fields.
+
+Derived reports are built from the reference report without deep copies: copy_stockgroup() copies a stockgroup and
+its stock dicts one level deep and the derivation replaces fields of the copies. Field values are scalars, or lists and
+dicts which are only ever replaced as a whole, so the reference report is never changed through a copy.
+'''
+import logging
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+STRATEGIES = ('CA', 'VA')
+CURRENCIES = ('KRW', 'USD')
+WEIGHT_SUM_DIGITS = 4  # the sum of all weights is compared with 1.0 after rounding
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_one_of(choices) -> tuple:
+    return (lambda value: isinstance(value, str) and value in choices), f'one of {", ".join(choices)}'
+
+
+def _required(stockkey: str) -> bool:
+    return True
+
+
+def _optional(stockkey: str) -> bool:
+    return False
+
+
+NUMBER = (_is_number, 'a number')
+
+
+def _compile_stock_checks(stockgroupkey: str) -> tuple:
+    ''' (field, is_required(stockkey), check(value), expected) of the stocks of a stockgroup '''
+    import krxdata
+    import stockwrapper
+
+    checks = {
+        'weight': (_required, *NUMBER),
+        'currency': (_required, *_is_one_of(CURRENCIES)),
+        'holdings': (_required, *NUMBER),
+        'price': (_required, *NUMBER),
+        'cumSumCaInvested': (_required, *NUMBER),
+        'need2investCA': (_required, *NUMBER),
+        'cumSumCaInvestedInKRW': (_optional, *NUMBER),
+        'cumSumCaInvestedInUSD': (_optional, *NUMBER),
+        'actualInvestedInUnits': (_optional, *NUMBER),
+        'need2invest': (_optional, *NUMBER),
+        'cum_inv_deviation': (_optional, *NUMBER)
+    }
+    # prices (and holdings of KIS accounts) are fetched
+    if stockgroupkey == 'KIS':
+        checks['holdings'] = (_optional, *NUMBER)
+        checks['price'] = (_optional, *NUMBER)
+        checks['market'] = (_required, *_is_one_of(('DOM',) + tuple(stockwrapper.KisStock.EXCD_NIGHT2DAY_DICT.keys())))
+    elif stockgroupkey == 'CoinGecko':
+        checks['price'] = (_optional, *NUMBER)
+    elif stockgroupkey == 'KRX':
+        checks['price'] = (_optional, *NUMBER)
+        checks['isuCd'] = (lambda stockkey: stockkey not in stockwrapper.KrxStock.DEFAULT_ISU_CDS.keys(),
+                           lambda value: isinstance(value, str) and len(value) == 12,
+                           'a standard code of 12 characters')
+        checks['krxMarket'] = (_optional, *_is_one_of(tuple(krxdata.KrxMarketData.MARKETS.keys())))
+
+    return tuple((field, *check) for field, check in checks.items())
+
+
+compiled_stock_checks = {}  # stockgroup key -> result of _compile_stock_checks()
+
+
+def _check_stockgroup(stockgroupkey: str, stockgroup) -> list:
+    ''' problems of a stockgroup (stock fields are checked separately) '''
+    if not isinstance(stockgroup, dict) or not isinstance(stockgroup.get('stocks'), dict):
+        return [f'stockgroup {stockgroupkey} should be a dict with a stocks dict']
+
+    problems = []
+    if stockgroupkey == 'KIS':
+        account_no = stockgroup.get('accountNo')
+        if not isinstance(account_no, str) or account_no.count('-') != 1:
+            problems.append(f'accountNo of stockgroup KIS should be like 12345678-01, but {account_no!r} given')
+    elif stockgroupkey == 'CoinGecko':
+        coin_ids = stockgroup.get('coinIds', {})
+        if not isinstance(coin_ids, dict) or \
+                not all(isinstance(coin_id, str) for coin_id in coin_ids.values()):
+            problems.append(f'coinIds of stockgroup CoinGecko should map tickers to CoinGecko ids, but {coin_ids!r} given')
+
+    return problems
+
+
+class Stock:
+    ''' fields of a stock read by the derivation (None if not given) '''
+    __slots__ = ('weight', 'currency', 'market', 'holdings', 'price', 'cum_sum_ca_invested', 'need2invest_ca',
+                 'need2invest', 'cum_inv_deviation')
+    NUMBER_FIELDS = {
+        'weight': 'weight',
+        'holdings': 'holdings',
+        'price': 'price',
+        'cum_sum_ca_invested': 'cumSumCaInvested',
+        'need2invest_ca': 'need2investCA',
+        'need2invest': 'need2invest',
+        'cum_inv_deviation': 'cum_inv_deviation'
+    }
+
+    def __init__(self, stock: dict):
+        for slot, field in Stock.NUMBER_FIELDS.items():
+            setattr(self, slot, float(stock[field]) if field in stock.keys() else None)
+        self.currency = stock.get('currency')
+        self.market = stock.get('market')
+
+
+class StockGroup:
+    __slots__ = ('stocks', 'account_no', 'coin_ids')
+
+    def __init__(self, stockgroup: dict):
+        self.stocks = {stockkey: Stock(stock) for stockkey, stock in stockgroup['stocks'].items()}
+        self.account_no = stockgroup.get('accountNo')
+        self.coin_ids = stockgroup.get('coinIds', {})
+
+
+class Report:
+    __slots__ = ('strategy', 'exchange_rate', 'stockgroups')
+
+    def __init__(self, report: dict):
+        ''' report: a report validated by from_dict() '''
+        self.strategy = report['strategy']
+        self.exchange_rate = float(report['exchange_rate']) if 'exchange_rate' in report.keys() else None
+        self.stockgroups = {stockgroupkey: StockGroup(stockgroup) for stockgroupkey, stockgroup in report['stockgroups'].items()}
+
+    def stocks(self) -> list:
+        ''' (stockgroupkey, stockkey, Stock) of every stock in the order of the report '''
+        return [(stockgroupkey, stockkey, stock)
+                for stockgroupkey, stockgroup in self.stockgroups.items() for stockkey, stock in stockgroup.stocks.items()]
+
+    @staticmethod
+    def from_dict(report: dict) -> 'Report':
+        ''' validate a reference report to derive a new report from and build its model. every problem is logged
+        before a ValueError is raised '''
+        problems = []
+        if report.get('strategy') not in STRATEGIES:
+            problems.append(f'strategy should be one of {", ".join(STRATEGIES)}, but {report.get("strategy")!r} given')
+        if 'exchange_rate' in report.keys() and not _is_number(report['exchange_rate']):
+            problems.append(f'exchange_rate should be a number, but {report["exchange_rate"]!r} given')
+
+        stockgroups = report.get('stockgroups')
+        if not isinstance(stockgroups, dict) or len(stockgroups) == 0:
+            problems.append('stockgroups should be a dict of at least one stockgroup')
+            stockgroups = {}
+
+        sum_of_weights = 0.0
+        weights_given = True  # the sum is checked only when every weight is a number
+        for stockgroupkey, stockgroup in stockgroups.items():
+            problems.extend(_check_stockgroup(stockgroupkey, stockgroup))
+            if not isinstance(stockgroup, dict) or not isinstance(stockgroup.get('stocks'), dict):
+                weights_given = False
+                continue
+
+            if stockgroupkey not in compiled_stock_checks.keys():
+                compiled_stock_checks[stockgroupkey] = _compile_stock_checks(stockgroupkey)
+            stock_checks = compiled_stock_checks[stockgroupkey]
+
+            for stockkey, stock in stockgroup['stocks'].items():
+                if not isinstance(stock, dict):
+                    problems.append(f'{stockkey} of stockgroup {stockgroupkey} should be a dict')
+                    weights_given = False
+                    continue
+                for field, is_required, check, expected in stock_checks:
+                    if field not in stock.keys():
+                        if is_required(stockkey):
+                            problems.append(f'{stockkey} of stockgroup {stockgroupkey} does not have {field}')
+                    elif not check(stock[field]):
+                        problems.append(f'{field} of {stockkey} of stockgroup {stockgroupkey} should be {expected}, '
+                                        f'but {stock[field]!r} given')
+                if _is_number(stock.get('weight')):
+                    sum_of_weights += stock['weight']
+                else:
+                    weights_given = False
+
+        if weights_given and round(sum_of_weights, WEIGHT_SUM_DIGITS) != 1.0:
+            problems.append(f'sum of all weights should be 1.0, but {sum_of_weights} given')
+
+        if len(problems) != 0:
+            for problem in problems:
+                logger.error(problem)
+            raise ValueError(f'The reference report has {len(problems)} problem(s). The first one: {problems[0]}')
+
+        return Report(report)
+
+
+def copy_stockgroup(stockgroup: dict) -> dict:
+    ''' copy of a stockgroup whose fields (and fields of whose stocks) can be replaced without changing the original '''
+    stockgroup_copy = dict(stockgroup)
+    stockgroup_copy['stocks'] = {stockkey: dict(stock) for stockkey, stock in stockgroup['stocks'].items()}
+
+    return stockgroup_copy
+
+
+def copy_stockgroups(stockgroups: dict) -> dict:
+    return {stockgroupkey: copy_stockgroup(stockgroup) for stockgroupkey, stockgroup in stockgroups.items()}
+
+
+def copy_report(report: dict) -> dict:
+    report_copy = dict(report)
+    report_copy['stockgroups'] = copy_stockgroups(report['stockgroups'])
+
+    return report_copy
@@ -0,0 +1,399 @@
+''' service mode: a resident Portfolio engine serving derived reports over a local HTTP API
+
+The engine keeps what main.py rebuilds on every run: the imported modules, the keep-alive HTTP sessions, the KIS
+access token, the price/exchange rate caches and, for every ref report it has seen, the refreshed stockgroups
+(prices, holdings, cumSumCaInvested and appraisement). Market data is refreshed on a schedule, so a what-if query
+only runs the derivations (CA/VA, units, cum_inv_deviation) on a copy of the refreshed stockgroups.
+
+API (JSON in and out):
+    GET  /health                           status and refresh time of every ref report
+    GET  /report[?ref_report_path=PATH]    latest report derived with the savings given on the command line
+    POST /distribute                       {"saving_in_krw": ..., "saving_in_usd": ..., "ref_report_path": ...,
+                                            "unit_allocation": ...} -> derived report (every key optional)
+    POST /refresh                          {"ref_report_path": ...} -> refresh market data now
+A ref report seen for the first time (or modified since its last refresh) is refreshed before answering.
+Since ref reports are refreshed with the secrets of the operator, a query can only name the ref report given on the
+command line or one under --ref-report-dir (relative paths are resolved against it). Other paths are answered with 400.
+'''
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+import click
+import httpclient
+import portfolio
+import reportmodel
+from setup_logger import setup_logger
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+class RefReportState:
+    ''' market data refreshed for a ref report '''
+
+    def __init__(self, ref_report_path: str):
+        self.ref_report_path = ref_report_path
+        self.mtime = None  # of the ref report when refreshed
+        self.exchange_rate = None
+        self.refreshed_stockgroups = None
+        self.refreshed_at = None
+        self.report = None  # derived with the default savings
+        self.error = None  # of the last refresh
+        self.lock = threading.Lock()  # serializes refreshes of this ref report
+
+
+class Engine:
+    TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+    def __init__(self, ref_report_path: str, secrets_path: str, tokens_path: str, saving_in_krw: float,
+                 saving_in_usd: float, refresh_workers: int, unit_allocation: str, cache_dir: str,
+                 ref_report_dir: str = None):
+        ''' ref_report_dir: directory of the ref reports queries may name besides ref_report_path (None: no others) '''
+        import coinindex
+        import marketcache
+        import sessionindex
+
+        self.default_ref_report_path = os.path.realpath(ref_report_path)
+        self.ref_report_dir = None if ref_report_dir is None else os.path.realpath(ref_report_dir)
+        self.secrets_path = secrets_path
+        self.tokens_path = tokens_path
+        self.saving_in_krw = saving_in_krw
+        self.saving_in_usd = saving_in_usd
+        self.refresh_workers = refresh_workers
+        self.unit_allocation = unit_allocation
+
+        sessionindex.configure(cache_dir)
+        coinindex.configure(cache_dir)
+        # scheduled refreshes always fetch live prices. the caches are still written for main.py runs
+        self.price_cache = marketcache.PriceCache(cache_dir, 'refresh')
+        self.exchange_rate_cache = marketcache.ExchangeRateCache(cache_dir)
+        self.states = {}  # real path of ref report -> RefReportState
+        self.states_lock = threading.Lock()
+
+    def _resolve(self, ref_report_path: str = None) -> str:
+        ''' real path of a ref report a query may name (ValueError otherwise) '''
+        if ref_report_path is None or os.path.realpath(ref_report_path) == self.default_ref_report_path:
+            return self.default_ref_report_path
+
+        if self.ref_report_dir is not None:
+            ref_report_path = os.path.realpath(os.path.join(self.ref_report_dir, ref_report_path))
+            if os.path.commonpath([self.ref_report_dir, ref_report_path]) == self.ref_report_dir:
+                return ref_report_path
+
+        logger.error(f'ref report {ref_report_path} is neither the default one nor under --ref-report-dir')
+        raise ValueError(f'ref report {ref_report_path} is not served')
+
+    def _state(self, ref_report_path: str = None) -> RefReportState:
+        ref_report_path = self._resolve(ref_report_path)
+        if not os.path.isfile(ref_report_path):
+            logger.error(f'ref report {ref_report_path} does not exist')
+            raise ValueError(f'ref report {ref_report_path} does not exist')
+
+        with self.states_lock:
+            if ref_report_path not in self.states.keys():
+                self.states[ref_report_path] = RefReportState(ref_report_path)
+            return self.states[ref_report_path]
+
+    def _new_portfolio(self, state: RefReportState, saving_in_krw: float, saving_in_usd: float, exchange_rate: float,
+                       unit_allocation: str) -> 'portfolio.Portfolio':
+        return portfolio.Portfolio(state.ref_report_path,
+                                   self.secrets_path,
+                                   self.tokens_path,
+                                   float(saving_in_krw),
+                                   float(saving_in_usd),
+                                   refresh_max_workers=self.refresh_workers,
+                                   unit_allocation=unit_allocation,
+                                   price_cache=self.price_cache,
+                                   exchange_rate_cache=self.exchange_rate_cache,
+                                   exchange_rate=exchange_rate)
+
+    def refresh(self, ref_report_path: str = None) -> RefReportState:
+        ''' refresh market data of a ref report and derive its report with the default savings '''
+        state = self._state(ref_report_path)
+        with state.lock:
+            started = time.perf_counter()
+            mtime = os.path.getmtime(state.ref_report_path)
+            try:
+                my_portfolio = self._new_portfolio(state, self.saving_in_krw, self.saving_in_usd, None,
+                                                   self.unit_allocation)
+                refreshed_stockgroups = my_portfolio.refresh_stockgroups()
+                # derived like a what-if query so that both give reports of the same layout
+                default_portfolio = self._new_portfolio(state, self.saving_in_krw, self.saving_in_usd,
+                                                        my_portfolio.exchange_rate, self.unit_allocation)
+                default_portfolio.distribute_saving(reportmodel.copy_stockgroups(refreshed_stockgroups))
+            except Exception as e:
+                logger.error(f'Refreshing {state.ref_report_path} failed: {e!r}')
+                state.error = e
+                raise
+
+            state.mtime = mtime
+            state.exchange_rate = my_portfolio.exchange_rate
+            state.refreshed_stockgroups = refreshed_stockgroups
+            state.report = default_portfolio.this_report
+            state.refreshed_at = datetime.today()
+            state.error = None
+            logger.info(f'Refreshed {state.ref_report_path} in {time.perf_counter() - started:.2f} seconds')
+
+        return state
+
+    def _fresh_state(self, ref_report_path: str = None) -> RefReportState:
+        ''' state of a ref report, refreshed first if never refreshed or modified since '''
+        state = self._state(ref_report_path)
+        if state.refreshed_stockgroups is None or os.path.getmtime(state.ref_report_path) != state.mtime:
+            state = self.refresh(state.ref_report_path)
+        return state
+
+    def refresh_all(self):
+        with self.states_lock:
+            ref_report_paths = list(self.states.keys())
+        if self.default_ref_report_path not in ref_report_paths:
+            ref_report_paths.insert(0, self.default_ref_report_path)
+
+        for ref_report_path in ref_report_paths:
+            try:
+                self.refresh(ref_report_path)
+            except Exception:
+                pass  # logged. the last refreshed data keeps being served
+
+    def latest_report(self, ref_report_path: str = None) -> dict:
+        return self._fresh_state(ref_report_path).report
+
+    def distribute(self, saving_in_krw: float = None, saving_in_usd: float = None, ref_report_path: str = None,
+                   unit_allocation: str = None) -> dict:
+        ''' derive a report from the refreshed market data without any network access '''
+        state = self._fresh_state(ref_report_path)
+        with state.lock:  # a refresh in progress replaces the market data as a whole
+            exchange_rate = state.exchange_rate
+            refreshed_stockgroups = state.refreshed_stockgroups
+
+        my_portfolio = self._new_portfolio(state,
+                                           self.saving_in_krw if saving_in_krw is None else saving_in_krw,
+                                           self.saving_in_usd if saving_in_usd is None else saving_in_usd,
+                                           exchange_rate,
+                                           self.unit_allocation if unit_allocation is None else unit_allocation)
+        my_portfolio.distribute_saving(reportmodel.copy_stockgroups(refreshed_stockgroups))
+
+        return my_portfolio.this_report
+
+    def health(self) -> dict:
+        with self.states_lock:
+            states = list(self.states.values())
+
+        return {
+            'status': 'ok' if all(state.error is None for state in states) else 'degraded',
+            'ref_reports': {
+                state.ref_report_path: {
+                    'refreshed_at': datetime.strftime(state.refreshed_at, Engine.TIME_FORMAT)
+                    if state.refreshed_at is not None else None,
+                    'exchange_rate': state.exchange_rate,
+                    'error': repr(state.error) if state.error is not None else None
+                }
+                for state in states
+            }
+        }
+
+    def close(self):
+        import kistoken
+
+        self.price_cache.close()
+        self.exchange_rate_cache.close()
+        with kistoken.token_managers_lock:
+            for token_manager in kistoken.token_managers.values():
+                token_manager.close()  # stops refreshing tokens ahead of expiry
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive for repeated queries
+
+    def log_message(self, format, *args):
+        logger.debug(f'service: {format % args}')
+
+    def _send_json(self, status: int, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, route):
+        started = time.perf_counter()
+        try:
+            self._send_json(200, route())
+        except (ValueError, TypeError, KeyError) as e:  # malformed queries
+            self._send_json(400, {'error': repr(e)})
+        except Exception as e:
+            self._send_json(500, {'error': repr(e)})
+        logger.debug(f'{self.command} {self.path} answered in {(time.perf_counter() - started) * 1000:.1f} ms')
+
+    def _read_json(self) -> dict:
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if len(body) == 0:
+            return {}
+        query = json.loads(body)
+        if not isinstance(query, dict):
+            raise ValueError('the body should be a JSON object')
+        return query
+
+    def do_GET(self):
+        engine = self.server.engine
+        url_split = urlsplit(self.path)
+        params = dict(parse_qsl(url_split.query))
+        if url_split.path == '/health':
+            self._handle(engine.health)
+        elif url_split.path == '/report':
+            self._handle(lambda: engine.latest_report(params.get('ref_report_path')))
+        else:
+            self._send_json(404, {'error': f'unknown path {url_split.path}'})
+
+    def do_POST(self):
+        engine = self.server.engine
+        url_split = urlsplit(self.path)
+        if url_split.path == '/distribute':
+            def route():
+                query = self._read_json()
+                unknown_keys = set(query.keys()) - {'saving_in_krw', 'saving_in_usd', 'ref_report_path', 'unit_allocation'}
+                if len(unknown_keys) != 0:
+                    raise ValueError(f'unknown keys {sorted(unknown_keys)}')
+                return engine.distribute(**query)
+            self._handle(route)
+        elif url_split.path == '/refresh':
+            def route():
+                state = engine.refresh(self._read_json().get('ref_report_path'))
+                return {'ref_report_path': state.ref_report_path,
+                        'refreshed_at': datetime.strftime(state.refreshed_at, Engine.TIME_FORMAT)}
+            self._handle(route)
+        else:
+            self._send_json(404, {'error': f'unknown path {url_split.path}'})
+
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple, engine: Engine):
+        super().__init__(address, ServiceHandler)
+        self.engine = engine
+
+
+def refresh_periodically(engine: Engine, interval_in_sec: float, stop: threading.Event):
+    while not stop.wait(interval_in_sec):
+        engine.refresh_all()
+
+
+@click.command()
+@click.option(
+    '--debug-level',
+    type=click.Choice(['DEBUG', 'INFO', 'WARNING'], case_sensitive=False),
+    default='INFO',
+    show_default=True,
+    help='debug level for logger'
+)
+@click.option('--host', type=str, default='127.0.0.1', show_default=True, help='address to listen on')
+@click.option('--port', type=click.IntRange(min=0), default=8780, show_default=True, help='port to listen on')
+@click.option(
+    '--refresh-interval',
+    type=click.FloatRange(min=1.0),
+    default=300.0,
+    show_default=True,
+    help='seconds between market data refreshes'
+)
+@click.option(
+    '--saving-in-krw',
+    type=float,
+    default=0,
+    show_default=True,
+    help='default amount of money to save in KRW'
+)
+@click.option(
+    '--saving-in-usd',
+    type=float,
+    default=0.0,
+    show_default=True,
+    help='default amount of money to save in USD'
+)
+@click.option(
+    '--secrets-path',
+    type=click.Path(exists=True, dir_okay=False),
+    default='secrets.json',
+    show_default=True,
+    help='path to the secrets JSON file'
+)
+@click.option(
+    '--tokens-path',
+    type=click.Path(exists=False, dir_okay=False),
+    default='tokens.json',
+    show_default=True,
+    help='path to the tokens JSON file'
+)
+@click.option(
+    '--refresh-workers',
+    type=click.IntRange(min=1),
+    default=portfolio.Portfolio.REFRESH_MAX_WORKERS,
+    show_default=True,
+    help='number of stockgroups to refresh in parallel'
+)
+@click.option(
+    '--unit-allocation',
+    type=click.Choice(['round', 'budget']),
+    default='round',
+    show_default=True,
+    help='default unit allocation (refer to main.py)'
+)
+@click.option(
+    '--cache-dir',
+    type=click.Path(file_okay=False),
+    default='.cache',
+    show_default=True,
+    help='directory of the price cache shared across runs'
+)
+@click.option(
+    '--stand-in-url',
+    type=str,
+    default=None,
+    help='send every HTTP request to this stand-in server (see standin.py) instead of the real APIs'
+)
+@click.option(
+    '--ref-report-dir',
+    type=click.Path(exists=True, file_okay=False),
+    default=None,
+    help='directory of other ref reports queries may name (only REF_REPORT_PATH is served if not given)'
+)
+@click.argument(
+    'ref_report_path',
+    type=click.Path(exists=True, dir_okay=False),
+    nargs=1
+)
+def main(debug_level, host, port, refresh_interval, saving_in_krw, saving_in_usd, secrets_path, tokens_path,
+         refresh_workers, unit_allocation, cache_dir, stand_in_url, ref_report_dir, ref_report_path):
+    ''' keep a Portfolio engine resident and serve reports derived from REF_REPORT_PATH (or others) over HTTP '''
+    setup_logger('autoinvestment_logger', debug_level)
+
+    httpclient.install_transports(stand_in_url=stand_in_url)
+    engine = Engine(ref_report_path, secrets_path, tokens_path, saving_in_krw, saving_in_usd, refresh_workers,
+                    unit_allocation, cache_dir, ref_report_dir)
+    engine.refresh()  # fail early if the default ref report cannot be refreshed
+
+    stop = threading.Event()
+    refresher = threading.Thread(target=refresh_periodically, args=(engine, refresh_interval, stop), daemon=True)
+    refresher.start()
+
+    server = ServiceServer((host, port), engine)
+    logger.info(f'Serving on http://{host}:{server.server_address[1]} (refresh every {refresh_interval:.0f} seconds)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        engine.close()
+        httpclient.close()
+
+
+if __name__ == '__main__':
+    main()
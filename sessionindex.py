@@ -0,0 +1,115 @@
+import array
+import bisect
+import logging
+import os
+import threading
+from datetime import date, timedelta
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+class SessionIndex:
+    ''' sorted trading session dates of an exchange calendar, serialized to a small file
+
+    The file is an array of unsigned ints: built date, first and last covered dates and then the sessions,
+    all in the form of YYYYMMDD. exchange_calendars is only imported when the index has to be (re)built.
+    '''
+    INDEX_FNAME_FORMAT = '{calendar_name}_sessions.bin'
+    HEADER_SIZE = 3
+    LOOKBACK_DAYS = 366  # how far into the past the index covers
+    REFRESH_INTERVAL_IN_DAYS = 30  # rebuild periodically so that newly announced holidays are reflected
+
+    def __init__(self, calendar_name: str, index_dir: str):
+        self.calendar_name = calendar_name
+        self.index_fname = os.path.join(index_dir, SessionIndex.INDEX_FNAME_FORMAT.format(calendar_name=calendar_name))
+        self.lock = threading.Lock()
+        self.built_date = None
+        self.first_date = None
+        self.last_date = None
+        self.sessions = array.array('I')
+
+        try:
+            self._load()
+        except (FileNotFoundError, EOFError, ValueError):
+            logger.debug(f'No valid session index at {self.index_fname}')
+
+    @staticmethod
+    def _to_int(day: date) -> int:
+        return day.year * 10000 + day.month * 100 + day.day
+
+    @staticmethod
+    def _to_date(day: int) -> date:
+        return date(day // 10000, day // 100 % 100, day % 100)
+
+    def _load(self):
+        index = array.array('I')
+        with open(self.index_fname, 'rb') as f:
+            index.frombytes(f.read())
+        if len(index) < SessionIndex.HEADER_SIZE:
+            raise ValueError
+
+        self.built_date, self.first_date, self.last_date = [SessionIndex._to_date(day) for day in index[:SessionIndex.HEADER_SIZE]]
+        self.sessions = index[SessionIndex.HEADER_SIZE:]
+
+    def _build(self, today: date):
+        import exchange_calendars as xcals  # heavy import, only when the index is stale
+
+        logger.info(f'Building the session index of {self.calendar_name}')
+        calendar = xcals.get_calendar(self.calendar_name)
+        first_date = max(today - timedelta(days=SessionIndex.LOOKBACK_DAYS), calendar.first_session.date())
+        last_date = calendar.last_session.date()
+        sessions = calendar.sessions_in_range(first_date.strftime('%Y-%m-%d'), last_date.strftime('%Y-%m-%d'))
+
+        index = array.array('I', [SessionIndex._to_int(today), SessionIndex._to_int(first_date), SessionIndex._to_int(last_date)])
+        index.extend(SessionIndex._to_int(session.date()) for session in sessions)
+
+        # write atomically so that concurrent runs never read a partially written index
+        os.makedirs(os.path.dirname(self.index_fname) or '.', exist_ok=True)
+        tmp_fname = f'{self.index_fname}.{os.getpid()}.tmp'
+        with open(tmp_fname, 'wb') as f:
+            f.write(index.tobytes())
+        os.replace(tmp_fname, self.index_fname)
+
+        self._load()
+
+    def _is_stale(self, today: date, from_date: date, to_date: date) -> bool:
+        return (
+            self.built_date is None or
+            (today - self.built_date).days > SessionIndex.REFRESH_INTERVAL_IN_DAYS or
+            from_date < self.first_date or
+            to_date > self.last_date
+        )
+
+    def sessions_in_range(self, from_date: date, to_date: date) -> list:
+        ''' sessions between from_date and to_date (both inclusive) found by binary search '''
+        with self.lock:
+            if self._is_stale(date.today(), from_date, to_date):
+                self._build(date.today())
+
+            left = bisect.bisect_left(self.sessions, SessionIndex._to_int(from_date))
+            right = bisect.bisect_right(self.sessions, SessionIndex._to_int(to_date))
+
+            return [SessionIndex._to_date(day) for day in self.sessions[left:right]]
+
+
+DEFAULT_INDEX_DIR = '.cache'
+index_dir = DEFAULT_INDEX_DIR
+session_indices = {}  # calendar name -> SessionIndex
+session_indices_lock = threading.Lock()
+
+
+def configure(new_index_dir: str):
+    ''' change the directory of the session index files '''
+    global index_dir
+    with session_indices_lock:
+        index_dir = new_index_dir
+        session_indices.clear()
+
+
+def get_session_index(calendar_name: str) -> SessionIndex:
+    with session_indices_lock:
+        if calendar_name not in session_indices.keys():
+            session_indices[calendar_name] = SessionIndex(calendar_name, index_dir)
+
+        return session_indices[calendar_name]
@@ -0,0 +1,497 @@
+''' local stand-in HTTP server emulating the external APIs used by this program
+
+Emulated endpoints (routed by the host of the original URL, which StandInTransport puts as the first path segment):
+    KIS        access token issuance, DOM/US price inquiries and DOM/DOM pension/US balance inquiries with tr_cont
+               pagination and CTX_AREA continuation keys
+    CoinGecko  coin list, simple prices and paginated tickers of exchanges
+    KRX        OTP generation (optionally expiring) and the euc-kr price CSV download of a product or of all products
+               of the gold or emission allowance market of a day
+    koreaexim  exchange rates (no rates on weekends, just like the real API)
+
+Prices and holdings are taken from a fixture JSON (see DEFAULT_FIXTURE) and any other symbol gets a deterministic
+synthetic price. Every response can be delayed (latency) and failed with HTTP 500 at random (error injection).
+
+StandInQuoteFeed emulates the websocket real-time quote feed of KIS (see pricestream.py): every subscribed stock
+ticks as a random walk from its fixture price, optionally in bursts of several ticks per frame.
+'''
+import asyncio
+import csv
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from urllib.parse import parse_qsl, urlsplit
+import click
+from setup_logger import setup_logger
+
+
+logger = logging.getLogger('autoinvestment_logger')
+
+
+DEFAULT_FIXTURE = {
+    'exchange_rate': 1350.0,
+    'prices': {},  # symbol -> price in its own currency. synthetic prices are used for missing symbols
+    'holdings': {
+        'DOM': {},  # pdno -> quantity
+        'US': {}  # ovrs_pdno -> quantity
+    },
+    'holdings_filler_rows': 0,  # untracked holdings added before the tracked ones to exercise pagination
+    'holdings_page_size': 20,
+    'coin_ids': {'bitcoin': 'BTC', 'ethereum': 'ETH', 'binancecoin': 'BNB'},  # listed coins (id -> symbol)
+    'coin_list_filler_coins': 0,  # synthetic coins added to the coin list to exercise the coin index
+    'kimchi_premiums': {'bithumb': 1.01, 'upbit': 1.012, 'korbit': 1.008, 'coinone': 1.011},
+    'gecko_filler_tickers': 0,  # non-KRW tickers put before the KRW ones to push them to later pages
+    'gecko_tickers_per_page': 100,
+    'gecko_page_headers': True,  # whether the total and per-page headers are sent with the tickers
+    'krx_products': {'KRD040200002': 'GLD', 'KRD040201000': 'MINIGLD'},  # isuCd -> symbol of its price
+    'krx_emission_products': {'KRD050032402': 'KAU24'},  # same as krx_products for the emission allowance market
+    'krx_otp_validity_in_sec': None  # OTPs never expire unless given
+}
+KIS_HOSTS = ('openapi.koreainvestment.com', 'openapivts.koreainvestment.com')
+GECKO_HOST = 'api.coingecko.com'
+KRX_HOST = 'data.krx.co.kr'
+KOREAEXIM_HOST = 'oapi.koreaexim.go.kr'
+KRX_CSV_ENCODING = 'euc-kr'
+KRX_TREND_BLD = 'dbms/MDC/STAT/standard/MDCSTAT15001'  # daily prices of a product
+KRX_ALL_PRODUCTS_BLDS = {  # bld of the prices of all products of a market of a day -> fixture key of the products
+    'dbms/MDC/STAT/standard/MDCSTAT14901': 'krx_products',
+    'dbms/MDC/STAT/standard/MDCSTAT15901': 'krx_emission_products'
+}
+
+
+def synthetic_price(symbol: str) -> float:
+    ''' deterministic price in [10, 1000) for a symbol without a fixture price '''
+    return 10.0 + (zlib.crc32(symbol.encode('utf-8')) % 99000) / 100.0
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple, fixture: dict = None, latency_in_sec: float = 0.0, error_rate: float = 0.0,
+                 seed: int = 0):
+        super().__init__(address, StandInHandler)
+        self.fixture = dict(DEFAULT_FIXTURE, **(fixture or {}))
+        self.latency_in_sec = latency_in_sec
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.otps = {}  # OTP -> (payload of the OTP request, time.monotonic() of issuance)
+        self.num_requests = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], ConnectionError):  # e.g. a client stopped reading a download on purpose
+            logger.debug(f'stand-in: connection of {client_address} closed by the client')
+        else:
+            super().handle_error(request, client_address)
+
+    def price(self, symbol: str) -> float:
+        return float(self.fixture['prices'].get(symbol, synthetic_price(symbol)))
+
+    def inject_error(self) -> bool:
+        with self.lock:
+            self.num_requests += 1
+            return self.error_rate > 0.0 and self.random.random() < self.error_rate
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive like the real APIs
+
+    def log_message(self, format, *args):
+        logger.debug(f'stand-in: {format % args}')
+
+    def _send(self, status: int, body: bytes, content_type: str = 'application/json; charset=utf-8',
+              headers: dict = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, obj, headers: dict = None):
+        self._send(200, json.dumps(obj).encode('utf-8'), headers=headers)
+
+    def _handle(self, method: str):
+        url_split = urlsplit(self.path)
+        _, host, path = url_split.path.split('/', 2)
+        host = host.split(':')[0]
+        path = f'/{path}'
+        params = dict(parse_qsl(url_split.query, keep_blank_values=True))
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if self.server.latency_in_sec > 0.0:
+            time.sleep(self.server.latency_in_sec)
+        if self.server.inject_error():
+            self._send(500, b'injected error', 'text/plain')
+            return
+
+        if host in KIS_HOSTS:
+            self._handle_kis(method, path, params, body)
+        elif host == GECKO_HOST:
+            self._handle_gecko(path, params)
+        elif host == KRX_HOST:
+            self._handle_krx(path, dict(parse_qsl(body.decode('utf-8'))))
+        elif host == KOREAEXIM_HOST:
+            self._handle_koreaexim(params)
+        else:
+            self._send(404, f'unknown host {host}'.encode('utf-8'), 'text/plain')
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    # KIS
+    def _handle_kis(self, method: str, path: str, params: dict, body: bytes):
+        fixture = self.server.fixture
+        if method == 'POST' and path == '/oauth2/tokenP':
+            self._send_json({'access_token': 'stand-in-access-token', 'token_type': 'Bearer', 'expires_in': 86400})
+            return
+        if method == 'POST' and path == '/oauth2/Approval':  # approval key of the real-time quote feed
+            self._send_json({'approval_key': StandInQuoteFeed.APPROVAL_KEY})
+            return
+
+        # N.B. services are told apart by tr_id since DOM price inquiries are sent to the balance path
+        tr_id = self.headers.get('tr_id', '')
+        if tr_id == 'FHKST01010100':  # DOM price
+            self._send_json({'rt_cd': '0', 'output': {'stck_prpr': str(round(self.server.price(params['fid_input_iscd'])))}})
+        elif tr_id == 'HHDFS00000300':  # US price
+            self._send_json({'rt_cd': '0', 'output': {'last': f'{self.server.price(params["SYMB"]):.4f}'}})
+        elif tr_id in ('TTTC8434R', 'VTTC8434R', 'TTTC2208R'):  # DOM (pension) balance
+            rows = [{'pdno': pdno, 'hldg_qty': str(qty)} for pdno, qty in self._holdings('DOM')]
+            self._send_page(rows, params, ('CTX_AREA_FK100', 'CTX_AREA_NK100'), fixture['holdings_page_size'])
+        elif tr_id in ('TTTS3012R', 'VTTS3012R'):  # US balance
+            rows = [{'ovrs_pdno': pdno, 'ovrs_cblc_qty': str(qty)} for pdno, qty in self._holdings('US')]
+            self._send_page(rows, params, ('CTX_AREA_FK200', 'CTX_AREA_NK200'), fixture['holdings_page_size'])
+        else:
+            self._send_json({'rt_cd': '1', 'msg1': f'unknown tr_id {tr_id}'})
+
+    def _holdings(self, market: str) -> list:
+        filler = [(f'FILLER{market}{i:05d}', 1) for i in range(self.server.fixture['holdings_filler_rows'])]
+        return filler + list(self.server.fixture['holdings'][market].items())
+
+    def _send_page(self, rows: list, params: dict, ctx_area_keys: tuple, page_size: int):
+        # the continuation key holds the offset of the page. the first page is requested with empty keys
+        if self.headers.get('tr_cont', '') == 'N':
+            offset = int(params[ctx_area_keys[0]])
+        else:
+            offset = 0
+        next_offset = offset + page_size
+        if next_offset < len(rows):
+            tr_cont = 'F' if offset == 0 else 'M'
+        else:
+            tr_cont = 'D'
+        self._send_json({'rt_cd': '0',
+                         'output1': rows[offset:next_offset],
+                         ctx_area_keys[0].lower(): str(next_offset),
+                         ctx_area_keys[1].lower(): str(next_offset)},
+                        headers={'tr_cont': tr_cont})
+
+    # CoinGecko
+    def _handle_gecko(self, path: str, params: dict):
+        fixture = self.server.fixture
+        coin_ids = params.get('ids', params.get('coin_ids', '')).split(',')
+        if path == '/api/v3/coins/list':
+            coins = [{'id': coin_id, 'symbol': symbol.lower(), 'name': coin_id} for coin_id, symbol in fixture['coin_ids'].items()]
+            coins += [{'id': f'filler-coin-{i}', 'symbol': f'fc{i}', 'name': f'Filler Coin {i}'}
+                      for i in range(fixture['coin_list_filler_coins'])]
+            self._send_json(coins)
+        elif path == '/api/v3/simple/price':
+            self._send_json({coin_id: {'usd': self._coin_price_usd(coin_id)} for coin_id in coin_ids if coin_id != ''})
+        elif path.startswith('/api/v3/exchanges/') and path.endswith('/tickers'):
+            exchange_id = path.split('/')[4]
+            premium = fixture['kimchi_premiums'].get(exchange_id, 1.0)
+            coin_ids = [coin_id for coin_id in coin_ids if coin_id != '']
+            tickers = []
+            for i in range(fixture['gecko_filler_tickers']):
+                coin_id = coin_ids[i % len(coin_ids)]
+                tickers.append({'base': fixture['coin_ids'].get(coin_id, coin_id.upper()), 'target': f'FILLER{i}',
+                                'last': 1.0, 'coin_id': coin_id})
+            for coin_id in coin_ids:
+                symbol = fixture['coin_ids'].get(coin_id, coin_id.upper())
+                price_krw = self._coin_price_usd(coin_id) * fixture['exchange_rate'] * premium
+                tickers.append({'base': symbol, 'target': 'KRW', 'last': price_krw, 'coin_id': coin_id})
+                tickers.append({'base': symbol, 'target': 'USDT', 'last': self._coin_price_usd(coin_id), 'coin_id': coin_id})
+
+            per_page = fixture['gecko_tickers_per_page']
+            offset = (int(params.get('page', '1')) - 1) * per_page
+            headers = {'total': str(len(tickers)), 'per-page': str(per_page)} if fixture['gecko_page_headers'] else None
+            self._send_json({'name': exchange_id, 'tickers': tickers[offset:offset + per_page]}, headers=headers)
+        else:
+            self._send(404, b'unknown CoinGecko path', 'text/plain')
+
+    def _coin_price_usd(self, coin_id: str) -> float:
+        symbol = self.server.fixture['coin_ids'].get(coin_id, coin_id.upper())
+        return self.server.price(symbol)
+
+    # KRX
+    def _handle_krx(self, path: str, form: dict):
+        if path == '/comm/fileDn/GenerateOTP/generate.cmd':
+            with self.server.lock:
+                otp = f'OTP{self.server.random.getrandbits(64):016x}'
+                self.server.otps[otp] = (form, time.monotonic())
+            self._send(200, otp.encode('utf-8'), 'text/html; charset=utf-8')
+        elif path == '/comm/fileDn/download_csv/download.cmd':
+            with self.server.lock:
+                otp_payload, issued = self.server.otps.get(form.get('code'), (None, None))
+            otp_validity_in_sec = self.server.fixture['krx_otp_validity_in_sec']
+            if otp_payload is None or (otp_validity_in_sec is not None and time.monotonic() - issued > otp_validity_in_sec):
+                self._send(400, b'invalid OTP', 'text/plain')
+                return
+            if otp_payload.get('url') in KRX_ALL_PRODUCTS_BLDS.keys():
+                price_csv = self._krx_all_products_csv(otp_payload)
+            else:
+                price_csv = self._krx_csv(otp_payload)
+            self._send(200, price_csv.encode(KRX_CSV_ENCODING), 'text/csv')
+        else:
+            self._send(404, b'unknown KRX path', 'text/plain')
+
+    def _krx_all_products_csv(self, otp_payload: dict) -> str:
+        ''' a row per product of the market of the requested day (no rows on weekends) '''
+        price_csv = StringIO()
+        writer = csv.writer(price_csv)
+        writer.writerow(['종목코드', '종목명', '종가', '대비', '등락률', '시가', '고가', '저가', '거래량', '거래대금'])
+        if datetime.strptime(otp_payload['trdDd'], '%Y%m%d').weekday() < 5:
+            for isu_cd, symbol in self.server.fixture[KRX_ALL_PRODUCTS_BLDS[otp_payload['url']]].items():
+                price = self.server.price(symbol)
+                writer.writerow([isu_cd[3:11], symbol, f'{price:,.0f}', '0', '0.00', f'{price:.0f}',
+                                 f'{price:.0f}', f'{price:.0f}', '1000', f'{price * 1000:.0f}'])
+        return price_csv.getvalue()
+
+    def _krx_csv(self, otp_payload: dict) -> str:
+        ''' daily rows of the requested period, the most recent first. the gold spot (isuCd) is priced as GLD '''
+        price = self.server.price('GLD')
+        from_date = datetime.strptime(otp_payload['strtDd'], '%Y%m%d')
+        to_date = datetime.strptime(otp_payload['endDd'], '%Y%m%d')
+        price_csv = StringIO()
+        writer = csv.writer(price_csv)
+        writer.writerow(['일자', '종가', '대비', '등락률', '시가', '고가', '저가', '거래량', '거래대금'])
+        day = to_date
+        while day >= from_date:
+            if day.weekday() < 5:
+                writer.writerow([day.strftime('%Y/%m/%d'), f'{price:.0f}', '0', '0.00', f'{price:.0f}', f'{price:.0f}',
+                                 f'{price:.0f}', '1000', f'{price * 1000:.0f}'])
+            day -= timedelta(days=1)
+        return price_csv.getvalue()
+
+    # koreaexim
+    def _handle_koreaexim(self, params: dict):
+        searchdate = datetime.strptime(params['searchdate'], '%Y%m%d')
+        if searchdate.weekday() >= 5:
+            self._send_json([])  # no rates are published on weekends
+            return
+        rate = self.server.fixture['exchange_rate']
+        self._send_json([
+            {'result': 1, 'cur_unit': 'AED', 'deal_bas_r': f'{rate / 3.6725:,.2f}'},
+            {'result': 1, 'cur_unit': 'EUR', 'deal_bas_r': f'{rate * 1.08:,.2f}'},
+            {'result': 1, 'cur_unit': 'USD', 'deal_bas_r': f'{rate:,.2f}'}
+        ])
+
+
+class StandInTransport:
+    ''' transport sending every request to a stand-in server instead of the original host
+
+    https://host:port/path becomes {stand-in URL}/host:port/path so that the server can route by the original host
+    '''
+
+    def __init__(self, stand_in_url: str, inner_transport):
+        self.stand_in_url = stand_in_url.rstrip('/')
+        self.inner_transport = inner_transport
+
+    def request(self, method: str, url: str, timeout=None, **kwargs):
+        url_split = urlsplit(url)
+        stand_in_url = f'{self.stand_in_url}/{url_split.netloc}{url_split.path}'
+        if url_split.query != '':
+            stand_in_url += f'?{url_split.query}'
+        kwargs.pop('verify', None)  # certificates of the original hosts do not apply
+
+        return self.inner_transport.request(method, stand_in_url, timeout=timeout, **kwargs)
+
+    def close(self):
+        self.inner_transport.close()
+
+
+class StandInQuoteFeed:
+    ''' websocket stand-in of the KIS real-time quote feed (H0STCNT0 for DOM and HDFSCNT0 for US stocks) '''
+    APPROVAL_KEY = 'stand-in-approval-key'
+    NUM_FIELDS = {'H0STCNT0': 46, 'HDFSCNT0': 26}  # fields of a record
+    PRICE_FIELD = {'H0STCNT0': 2, 'HDFSCNT0': 11}  # STCK_PRPR and LAST
+    PINGPONG_INTERVAL_IN_SEC = 10.0
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, fixture: dict = None, tick_interval_in_sec: float = 0.1,
+                 ticks_per_frame: int = 1, volatility: float = 0.001, seed: int = 0):
+        self.host = host
+        self.port = port
+        self.fixture = dict(DEFAULT_FIXTURE, **(fixture or {}))
+        self.tick_interval_in_sec = tick_interval_in_sec
+        self.ticks_per_frame = ticks_per_frame  # > 1 sends bursts of ticks of a stock in a frame
+        self.volatility = volatility  # standard deviation of the relative change of a tick
+        self.random = random.Random(seed)
+        self.prices = {}  # tr_key -> last price
+        self.loop = None
+        self.stopping = None
+        self.num_ticks = 0
+        self.num_pongs = 0
+
+    @property
+    def url(self) -> str:
+        return f'ws://{self.host}:{self.port}'
+
+    def start(self) -> 'StandInQuoteFeed':
+        ''' serve in a background thread. port 0 picks a free port (refer to url) '''
+        started = threading.Event()
+        threading.Thread(target=lambda: asyncio.run(self._serve(started)), daemon=True).start()
+        started.wait()
+        logger.info(f'Stand-in quote feed listening on {self.url}')
+        return self
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def _serve(self, started: threading.Event):
+        from websockets.asyncio.server import serve  # only needed by the quote feed
+
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        async with serve(self._handle, self.host, self.port) as server:
+            self.port = server.sockets[0].getsockname()[1]
+            started.set()
+            await self.stopping.wait()
+
+    async def _handle(self, websocket):
+        subscriptions = {}  # tr_key -> tr_id
+        sender = asyncio.create_task(self._send_ticks(websocket, subscriptions))
+        try:
+            async for message in websocket:
+                request = json.loads(message)
+                header = request['header']
+                if header.get('tr_id') == 'PINGPONG':  # echoed by the client
+                    self.num_pongs += 1
+                    continue
+
+                tr_id = request['body']['input']['tr_id']
+                tr_key = request['body']['input']['tr_key']
+                if header.get('approval_key') != StandInQuoteFeed.APPROVAL_KEY or tr_id not in self.NUM_FIELDS.keys():
+                    rt_cd, msg1 = '1', 'invalid approval key or tr_id'
+                elif header['tr_type'] == '1':
+                    subscriptions[tr_key] = tr_id
+                    rt_cd, msg1 = '0', 'SUBSCRIBE SUCCESS'
+                else:
+                    subscriptions.pop(tr_key, None)
+                    rt_cd, msg1 = '0', 'UNSUBSCRIBE SUCCESS'
+                await websocket.send(json.dumps({
+                    'header': {'tr_id': tr_id, 'tr_key': tr_key, 'encrypt': 'N'},
+                    'body': {'rt_cd': rt_cd, 'msg_cd': 'OPSP0000' if rt_cd == '0' else 'OPSP8996', 'msg1': msg1}
+                }))
+        except Exception:
+            pass  # the connection is closed
+        finally:
+            sender.cancel()
+
+    def _tick(self, tr_id: str, tr_key: str) -> str:
+        ''' fields of a record of the next price of a stock '''
+        symbol = tr_key if tr_id == 'H0STCNT0' else tr_key[4:]  # US keys are D + EXCD + symbol (e.g. DNASAAPL)
+        price = self.prices.get(tr_key, float(self.fixture['prices'].get(symbol, synthetic_price(symbol))))
+        price = max(price * (1.0 + self.random.gauss(0.0, self.volatility)), 0.01)
+        self.prices[tr_key] = price
+
+        fields = ['0'] * self.NUM_FIELDS[tr_id]
+        fields[0] = tr_key
+        fields[1] = datetime.today().strftime('%H%M%S')
+        fields[self.PRICE_FIELD[tr_id]] = str(round(price)) if tr_id == 'H0STCNT0' else f'{price:.4f}'
+        return '^'.join(fields)
+
+    async def _send_ticks(self, websocket, subscriptions: dict):
+        last_pingpong = time.monotonic()
+        while True:
+            await asyncio.sleep(self.tick_interval_in_sec)
+            for tr_key, tr_id in list(subscriptions.items()):
+                records = [self._tick(tr_id, tr_key) for _ in range(self.ticks_per_frame)]
+                await websocket.send(f'0|{tr_id}|{len(records):03d}|{"^".join(records)}')
+                self.num_ticks += len(records)
+            if time.monotonic() - last_pingpong >= self.PINGPONG_INTERVAL_IN_SEC:
+                last_pingpong = time.monotonic()
+                await websocket.send(json.dumps({'header': {'tr_id': 'PINGPONG',
+                                                            'datetime': datetime.today().strftime('%Y%m%d%H%M%S')}}))
+
+
+def start_server(host: str = '127.0.0.1', port: int = 0, **kwargs) -> StandInServer:
+    ''' start a stand-in server in a background thread. port 0 picks a free port (refer to server.url) '''
+    server = StandInServer((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f'Stand-in server listening on {server.url}')
+    return server
+
+
+@click.command()
+@click.option(
+    '--debug-level',
+    type=click.Choice(['DEBUG', 'INFO', 'WARNING'], case_sensitive=False),
+    default='INFO',
+    show_default=True,
+    help='debug level for logger'
+)
+@click.option('--host', type=str, default='127.0.0.1', show_default=True, help='address to listen on')
+@click.option('--port', type=click.IntRange(min=0), default=8765, show_default=True, help='port to listen on')
+@click.option(
+    '--fixture',
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help='JSON overriding the keys of the default fixture (prices, holdings, exchange_rate, ...)'
+)
+@click.option('--latency-ms', type=float, default=0.0, show_default=True, help='delay of every response')
+@click.option(
+    '--error-rate',
+    type=click.FloatRange(min=0.0, max=1.0),
+    default=0.0,
+    show_default=True,
+    help='probability of answering a request with HTTP 500'
+)
+@click.option('--seed', type=int, default=0, show_default=True, help='seed of the error injection and OTPs')
+@click.option(
+    '--quote-port',
+    type=click.IntRange(min=0),
+    default=None,
+    help='also run the stand-in of the KIS real-time quote feed on this port (use with --ws-url of pricestream.py)'
+)
+@click.option('--tick-interval-ms', type=float, default=100.0, show_default=True, help='interval of quote feed frames')
+@click.option(
+    '--ticks-per-frame',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help='ticks of a stock sent in a frame (bursts)'
+)
+def main(debug_level, host, port, fixture, latency_ms, error_rate, seed, quote_port, tick_interval_ms, ticks_per_frame):
+    ''' run a stand-in server of KIS, CoinGecko, KRX and koreaexim (use with --stand-in-url of main.py) '''
+    setup_logger('autoinvestment_logger', debug_level)
+
+    fixture_loaded = None
+    if fixture is not None:
+        with open(fixture, 'r') as f:
+            fixture_loaded = json.load(f)
+    if quote_port is not None:
+        StandInQuoteFeed(host, quote_port, fixture_loaded, tick_interval_ms / 1000.0, ticks_per_frame, seed=seed).start()
+    server = StandInServer((host, port), fixture_loaded, latency_ms / 1000.0, error_rate, seed)
+    logger.info(f'Stand-in server listening on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
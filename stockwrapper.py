@@ -1,84 +1,105 @@
 import logging
-import requests
-import copy
+import httpclient
+import metrics
 import json
-import csv
-import exchange_calendars as xcals
-import pandas
+import ratelimit
+import kistoken
+import krxdata
+import coinindex
+import reportmodel
+import time
 from statistics import median
-from datetime import datetime, timedelta
-from io import StringIO
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 
 
 logger = logging.getLogger('autoinvestment_logger')
 
 
 class BaseStock:
-    def __init__(self, exchange_rate: float, ref_exchange_rate: float, ref_stockgrp_info: dict):
+    PROVIDER = 'OTHER'  # provider name used as a key of the price cache
+
+    def __init__(self, exchange_rate: float, ref_exchange_rate: float, ref_stockgrp_info: dict, price_cache=None):
         self.exchange_rate = exchange_rate
         self.ref_exchange_rate = ref_exchange_rate
         self.ref_stockgrp_info = ref_stockgrp_info
-        self.stockgrp_info = copy.deepcopy(ref_stockgrp_info)  # where new values will be stored
+        self.stockgrp_info = reportmodel.copy_stockgroup(ref_stockgrp_info)  # where new values will be stored
+        self.price_cache = price_cache  # marketcache.PriceCache or None when prices are always fetched live
 
-    def _postWrapper(self, URL, headers=None, data=None, verify=True):
+    def _postWrapper(self, URL, headers=None, data=None, verify=True, timeout=None, retries=0):
         logger.debug(f'POSTing headers {headers} and data {data} to {URL}.')
-        res = requests.post(URL, headers=headers, data=data, verify=verify)
+        res = httpclient.post(URL, headers=headers, data=data, verify=verify, timeout=timeout, retries=retries)
         logger.debug(f'Got POST response: {res.text}')
 
         return res
 
-    def _getWrapper(self, URL, headers=None, params=None, verify=True):
+    def _getWrapper(self, URL, headers=None, params=None, verify=True, timeout=None, retries=0):
+        ''' retries: number of earlier attempts of the same query (recorded in the metrics) '''
         logger.debug(f'GETing headers {headers} and params {params} to {URL}.')
-        res = requests.get(URL, headers=headers, params=params, verify=verify)
+        res = httpclient.get(URL, headers=headers, params=params, verify=verify, timeout=timeout, retries=retries)
         logger.debug(f'Got GET response: {res.text}')
 
         return res
 
+    def _load_cached_price(self, stockkey: str, market: str, field: str = 'price', scale: float = 1.0) -> bool:
+        ''' set stock[field] from the price cache. returns False when the price has to be fetched live '''
+        if self.price_cache is None:
+            return False
+
+        cached = self.price_cache.get(self.PROVIDER, stockkey, market)
+        if cached is None:
+            return False
+
+        price, age = cached
+        stock = self.stockgrp_info['stocks'][stockkey]
+        stock[field] = price * scale
+        stock[f'{field}Source'] = 'cached'
+        stock[f'{field}AgeInSec'] = round(age)
+
+        return True
+
+    def _store_live_price(self, stockkey: str, market: str, price: float, field: str = 'price', scale: float = 1.0):
+        ''' set stock[field] from a live price and put the price into the price cache '''
+        stock = self.stockgrp_info['stocks'][stockkey]
+        stock[field] = price * scale
+        stock[f'{field}Source'] = 'live'
+        stock[f'{field}AgeInSec'] = 0
+
+        if self.price_cache is not None:
+            self.price_cache.put(self.PROVIDER, stockkey, market, price)
+
+    @metrics.instrumented()
     def _update_ca_invested(self):
+        # N.B. fields of the reference report required here (cumSumCaInvested, need2investCA, holdings, price of
+        #      OTHER stocks, ...) are checked when it is loaded. refer to reportmodel.py
         for stockkey, stock in self.stockgrp_info['stocks'].items():
-            if 'cumSumCaInvested' not in stock.keys():
-                logger.error(f'{stockkey} does not have cumSumCaInvested item. this must be given to update')
-                raise ValueError
-
             # utilize ref_stockgrp_info to derive cumSumCaInvested for this report
             # N.B. need2investCA has nothing to do with actual invested amount of each stock it's just an ideal guideline for deriving VA amount
             #       Even if we didn't followed the guideline its trajectory remains unaltered (so that we can eventually persue the ideal goal)
             ref_stock = self.ref_stockgrp_info['stocks'][stockkey]
             stock['cumSumCaInvested'] = ref_stock['cumSumCaInvested'] + ref_stock['need2investCA']
 
+    @metrics.instrumented()
     def _update_holdings(self):
         for stockkey, stock in self.stockgrp_info['stocks'].items():
-            if 'holdings' not in stock.keys():
-                logger.error(f'{stockkey} does not have holdings item. this must be given to update holdings')
-                raise ValueError
-
             # take account of actually invested units. add them up into holdings
             if 'actualInvestedInUnits' in stock.keys():
                 stock['holdings'] += stock['actualInvestedInUnits']
                 del stock['actualInvestedInUnits']  # remove actualInvestedInUnits from this_report
 
+    @metrics.instrumented()
     def _derive_appraisement(self):
         for stockkey, stock in self.stockgrp_info['stocks'].items():
-            if 'price' not in stock.keys():
-                logger.error(f'{stockkey} does not have price item. this must be given to derive appraisement')
-                raise Exception
-
-            if 'holdings' not in stock.keys():
-                logger.error(f'{stockkey} does not have holdings item. this must be given to derive appraisement.')
-                raise Exception
-
             # for domestic: prices are in KRW
             if stock['currency'] == 'KRW':
                 appraisementKRW = float(stock['holdings']) * float(stock['price'])
                 stock['appraisement'] = appraisementKRW / self.exchange_rate
 
             # for US: prices are in USD
-            elif stock['currency'] == 'USD':
-                stock['appraisement'] = float(stock['holdings']) * float(stock['price'])
-
             else:
-                logger.error(f'Currently only KRW or USD are supported as currencies, but {stock["currency"]} given.')
+                stock['appraisement'] = float(stock['holdings']) * float(stock['price'])
 
+    @metrics.instrumented()
     def update_all(self):  # call order is crucial
         self._update_holdings()
         self._update_ca_invested()  # after _update_holdings
@@ -89,6 +110,8 @@ class BaseStock:
 
 
 class KisStock(BaseStock):
+    PROVIDER = 'KIS'
+
     # KIS constants
     # - General
     URL_BASE_REAL = 'https://openapi.koreainvestment.com:9443'
@@ -96,6 +119,12 @@ class KisStock(BaseStock):
     URL_BASE = URL_BASE_REAL
     BASE_HEADER = {'content-type': 'application/json'}
 
+    # - Request quota (KIS allows 20 requests/sec for real accounts; keep a margin)
+    REQUESTS_PER_SEC = 18
+    REQUEST_BURST = 4
+    RATE_LIMITER = ratelimit.TokenBucket(REQUESTS_PER_SEC, REQUEST_BURST)  # shared by every KisStock in the process
+    PRICE_QUERY_MAX_INFLIGHT = 8  # max number of concurrent price queries
+
     # - Service paths
     DOM_PRICE_INQUIRY_PATH = 'uapi/domestic-stock/v1/quotations/inquire-price'
     US_PRICE_INQUIRY_PATH = 'uapi/overseas-price/v1/quotations/price'
@@ -136,52 +165,45 @@ class KisStock(BaseStock):
     # = US
     OVRS_EXCG_CD = 'NASD'  # NYS + NAS
     TR_CRCY_CD = 'USD'  # Currency for the trading
-
-    def __init__(self, exchange_rate: float, ref_exchange_rate: float, secrets_fname: str, tokens_fname: str, stockgrp_info: dict):
-        super().__init__(exchange_rate, ref_exchange_rate, stockgrp_info)
+    # = Pagination
+    DOM_CTX_AREA_KEYS = ('CTX_AREA_FK100', 'CTX_AREA_NK100')  # continuation context of DOM (and DOM PENSION) inquiries
+    US_CTX_AREA_KEYS = ('CTX_AREA_FK200', 'CTX_AREA_NK200')  # continuation context of US inquiries
+    HOLDINGS_MAX_PAGES = 20  # a holdings inquiry not finished within this number of pages is regarded as failed
+
+    def __init__(self,
+                 exchange_rate: float,
+                 ref_exchange_rate: float,
+                 secrets_fname: str,
+                 tokens_fname: str,
+                 stockgrp_info: dict,
+                 price_cache=None):
+        super().__init__(exchange_rate, ref_exchange_rate, stockgrp_info, price_cache)
 
         with open(secrets_fname, 'r') as f_secret:
             f_secret_loaded = json.load(f_secret)
             self.APP_KEY = f_secret_loaded['KisSecrets']['APP_KEY']
             self.APP_SECRET = f_secret_loaded['KisSecrets']['APP_SECRET']
 
-        try:
-            with open(tokens_fname, 'r') as f_token:
-                f_token_loaded = json.load(f_token)
-                # check if access_token is already in f_token
-                KisTokens = f_token_loaded['KisTokens']
-                if 'ACCESS_TOKEN' in KisTokens.keys() and 'ACCESS_TOKEN_TIME' in KisTokens.keys():
-                    timediff = datetime.today() - datetime.strptime(KisTokens['ACCESS_TOKEN_TIME'], '%Y-%m-%d %H:%M:%S')
-                    # access token expires after 24H
-                    if timediff.days > 0:
-                        self.access_token = None
-                    else:
-                        self.access_token = KisTokens['ACCESS_TOKEN']
-                else:
-                    self.access_token = None
-        except FileNotFoundError:
-            self.access_token = None
-
-        # if there's no valid token, re-issue it
-        if self.access_token is None:
-            f_token_loaded = {}
-            f_token_loaded['KisTokens'] = {}
-            self._issue_access_token()
-            # dump newly issued token to secrets.json
-            f_token_loaded['KisTokens']['ACCESS_TOKEN'] = self.access_token
-            f_token_loaded['KisTokens']['ACCESS_TOKEN_TIME'] = self.access_token_time
-            with open(tokens_fname, 'w') as f_token:
-                json.dump(f_token_loaded, f_token, indent=4)
-
-    def _issue_access_token(self):
+        # access tokens are shared by every KisStock of this process using the same tokens file (e.g. batch mode)
+        # and coordinated with other processes through the tokens file. refer to kistoken.py
+        self.token_manager = kistoken.get_token_manager(tokens_fname, self._issue_access_token)
+        self.token_manager.get_token()  # fail early if no token can be issued
+
+    @property
+    def access_token(self) -> str:
+        return self.token_manager.get_token()
+
+    @metrics.instrumented()
+    def _issue_access_token(self) -> tuple:
+        ''' issue a new access token and return (access token, expires_in in seconds) '''
         self.BASE_BODY = {
             'grant_type': 'client_credentials',
             'appkey': self.APP_KEY,
             'appsecret': self.APP_SECRET
         }
 
-        access_token_issue_headers = copy.deepcopy(KisStock.BASE_HEADER)
-        access_token_issue_body = json.dumps(copy.deepcopy(self.BASE_BODY))
+        access_token_issue_headers = dict(KisStock.BASE_HEADER)
+        access_token_issue_body = json.dumps(self.BASE_BODY)
         access_token_issue_path = 'oauth2/tokenP'
         access_token_issue_url = f'{KisStock.URL_BASE}/{access_token_issue_path}'
         access_token_issue_res = self._postWrapper(
@@ -189,13 +211,70 @@ class KisStock(BaseStock):
             access_token_issue_headers,
             access_token_issue_body
         )
-        self.access_token = access_token_issue_res.json()['access_token']
-        self.access_token_time = datetime.strftime(datetime.today(), '%Y-%m-%d %H:%M:%S')
+        if 'access_token' not in access_token_issue_res.json().keys():
+            error_msg = f'KIS access token issuance failed: {access_token_issue_res.text}'
+            logger.error(error_msg)
+            raise Exception(error_msg)
+
+        return access_token_issue_res.json()['access_token'], int(access_token_issue_res.json()['expires_in'])
+
+    def _getWrapper(self, URL, headers=None, params=None, verify=True, timeout=None, retries=0):
+        KisStock.RATE_LIMITER.acquire()  # every KIS GET request counts toward the per-second quota
+
+        return super()._getWrapper(URL, headers, params, verify, timeout, retries)
+
+    @metrics.instrumented(symbol_arg='stockkey')
+    def _query_dom_price(self, stockkey: str, dom_price_inquiry_url: str, dom_price_inquiry_headers: dict) -> float:
+        price_inquiry_params = {
+            'fid_cond_mrkt_div_code': 'J',
+            'fid_input_iscd': stockkey
+        }
+        res = self._getWrapper(dom_price_inquiry_url, dom_price_inquiry_headers, price_inquiry_params)
+
+        # check success
+        if res.json()['rt_cd'] != '0':
+            error_msg = f'dom price query for stock {stockkey} failed.'
+            logger.error(error_msg)
+            raise Exception(error_msg)
+
+        return float(res.json()['output']['stck_prpr'])
+
+    @metrics.instrumented(symbol_arg='stockkey')
+    def _query_us_price(self, stockkey: str, market: str, us_price_inquiry_url: str, us_price_inquiry_headers: dict) -> float:
+        price_inquiry_params = {
+            'AUTH': '',
+            'EXCD': market,
+            'SYMB': stockkey
+        }
+        daytime_tried = False
+        while True:
+            res = self._getWrapper(us_price_inquiry_url, us_price_inquiry_headers, price_inquiry_params,
+                                   retries=int(daytime_tried))  # the daytime EXCD query retries the night one
+
+            stockprice = res.json()['output']['last']
+
+            # check success
+            if res.json()['rt_cd'] != '0':
+                error_msg = f'US price query for stock {stockkey} failed.'
+                logger.error(error_msg)
+                raise Exception(error_msg)
 
+            if stockprice == '':  # this happens when there's no such a stock within the given market
+                # when night EXCD fails try once more this daytime EXCD
+                if daytime_tried:
+                    error_msg = f'price query for {stockkey} failed'
+                    logger.error(error_msg)
+                    raise Exception(error_msg)
+                daytime_tried = True
+                price_inquiry_params['EXCD'] = KisStock.EXCD_NIGHT2DAY_DICT[price_inquiry_params['EXCD']]
+            else:  # query successful
+                return float(stockprice)
+
+    @metrics.instrumented()
     def _collect_prices(self):
         # domestic
         dom_price_inquiry_url = f'{KisStock.URL_BASE}/{KisStock.DOM_HOLDINGS_INQUIRY_PATH}'
-        dom_price_inquiry_headers = copy.deepcopy(KisStock.BASE_HEADER)
+        dom_price_inquiry_headers = dict(KisStock.BASE_HEADER)
         dom_price_inquiry_headers['authorization'] = f'Bearer {self.access_token}'
         dom_price_inquiry_headers['appkey'] = self.APP_KEY
         dom_price_inquiry_headers['appsecret'] = self.APP_SECRET
@@ -203,63 +282,69 @@ class KisStock(BaseStock):
 
         # US
         us_price_inquiry_url = f'{KisStock.URL_BASE}/{KisStock.US_PRICE_INQUIRY_PATH}'
-        us_price_inquiry_headers = copy.deepcopy(KisStock.BASE_HEADER)
+        us_price_inquiry_headers = dict(KisStock.BASE_HEADER)
         us_price_inquiry_headers['authorization'] = f'Bearer {self.access_token}'
         us_price_inquiry_headers['appkey'] = self.APP_KEY
         us_price_inquiry_headers['appsecret'] = self.APP_SECRET
         us_price_inquiry_headers['tr_id'] = KisStock.TR_ID_CURR_US_PRICE
 
-        for stockkey, stock in self.stockgrp_info['stocks'].items():
+        def query_price(stockkey: str, stock: dict) -> float:
             if stock['market'] == 'DOM':
-                price_inquiry_params = {
-                    'fid_cond_mrkt_div_code': 'J',
-                    'fid_input_iscd': stockkey
-                }
-                res = self._getWrapper(dom_price_inquiry_url, dom_price_inquiry_headers, price_inquiry_params)
-
-                # check success
-                if res.json()['rt_cd'] != '0':
-                    error_msg = f'dom price query for stock {stockkey} failed.'
-                    logger.error(error_msg)
-                    raise Exception(error_msg)
+                return self._query_dom_price(stockkey, dom_price_inquiry_url, dom_price_inquiry_headers)
+            else:
+                return self._query_us_price(stockkey, stock['market'], us_price_inquiry_url, us_price_inquiry_headers)
+
+        # only query prices which are not available from the price cache
+        stockkeys = [stockkey for stockkey, stock in self.stockgrp_info['stocks'].items()
+                     if not self._load_cached_price(stockkey, stock['market'])]
+        stocks = [self.stockgrp_info['stocks'][stockkey] for stockkey in stockkeys]
+
+        # query prices concurrently. the number of in-flight queries is bounded by the pool size
+        # while RATE_LIMITER keeps the request rate within the KIS quota
+        with ThreadPoolExecutor(max_workers=KisStock.PRICE_QUERY_MAX_INFLIGHT) as executor:
+            # results are yielded in the order of stockkeys. the first failed query raises its exception here
+            prices = executor.map(query_price, stockkeys, stocks)
+            for stockkey, stock, price in zip(stockkeys, stocks, prices):
+                self._store_live_price(stockkey, stock['market'], price)  # update price as this month's value
+
+        for stockkey, stock in self.stockgrp_info['stocks'].items():
+            logger.info(f'Current price of stock {stockkey} is {stock["price"]} {stock["currency"]} ({stock["priceSource"]})')
+
+    def _paginate_holdings(self, url: str, headers: dict, params: dict, ctx_area_keys: tuple, query_name: str):
+        ''' yield the holdings (output1) of an inquiry row by row, reading the next page only when the rows of the
+        current page are consumed. every next page is requested with tr_cont N and the continuation context
+        (ctx_area_keys) of the previous page '''
+        headers = dict(headers)
+        params = dict(params)
+        for page in range(KisStock.HOLDINGS_MAX_PAGES):
+            res = self._getWrapper(url, headers, params)
+            res_json = res.json()
 
-                stock['price'] = float(res.json()['output']['stck_prpr'])  # update price as this month's value
-
-            elif stock['market'] == 'NYS' or stock['market'] == 'NAS' or stock['market'] == 'AMS':
-                price_inquiry_params = {
-                    'AUTH': '',
-                    'EXCD': stock['market'],
-                    'SYMB': stockkey
-                }
-                daytime_tried = False
-                while True:
-                    res = self._getWrapper(us_price_inquiry_url, us_price_inquiry_headers, price_inquiry_params)
-
-                    stockprice = res.json()['output']['last']
-
-                    # check success
-                    if res.json()['rt_cd'] != '0':
-                        error_msg = f'US price query for stock {stockkey} failed.'
-                        logger.error(error_msg)
-                        raise Exception(error_msg)
-
-                    if stockprice == '':  # this happens when there's no such a stock within the given market
-                        # when night EXCD fails try once more this daytime EXCD
-                        if daytime_tried:
-                            error_msg = f'price query for {stockkey} failed'
-                            logger.error(error_msg)
-                            raise Exception(error_msg)
-                        daytime_tried = True
-                        price_inquiry_params['EXCD'] = KisStock.EXCD_NIGHT2DAY_DICT[price_inquiry_params['EXCD']]
-                    else:  # query successful
-                        stock['price'] = float(stockprice)  # update price as this month's price
-                        break
+            # check success
+            if res_json['rt_cd'] != '0':
+                error_msg = f'{query_name} failed.'
+                logger.error(error_msg)
+                raise Exception(error_msg)
+
+            yield from res_json['output1']
+
+            # determine whether to continue querying
+            tr_cont = res.headers['tr_cont']
+            if tr_cont == 'F' or tr_cont == 'M':  # query not finished
+                headers['tr_cont'] = 'N'
+                for ctx_area_key in ctx_area_keys:
+                    params[ctx_area_key] = res_json[ctx_area_key.lower()]
+            elif tr_cont == 'D' or tr_cont == 'E':  # query finished
+                return
             else:
-                logger.error(f'stock[\'market\'] only supports one of DOM, NYS, and NAS, but {stock["market"]} given')
+                logger.error(f'Invalid tr_cont value ({tr_cont}) in querying holdings')
                 raise ValueError
 
-            logger.info(f'Current price of stock {stockkey} is {stock["price"]} {stock["currency"]}')
+        error_msg = f'{query_name} did not finish within {KisStock.HOLDINGS_MAX_PAGES} pages.'
+        logger.error(error_msg)
+        raise Exception(error_msg)
 
+    @metrics.instrumented()
     def _collect_holdings(self):
         # extract CANO and ACNT_PRDT_CD from accountNo
         self.CANO, self.ACNT_PRDT_CD = self.stockgrp_info['accountNo'].split('-')
@@ -271,7 +356,7 @@ class KisStock(BaseStock):
         if self.ACNT_PRDT_CD == '29':
             # pension (domestic only)
             dom_holdings_inquiry_url = f'{KisStock.URL_BASE}/{KisStock.DOM_PENSION_HOLDINGS_INQUIRY_PATH}'
-            dom_holdings_inquiry_headers = copy.deepcopy(KisStock.BASE_HEADER)
+            dom_holdings_inquiry_headers = dict(KisStock.BASE_HEADER)
             dom_holdings_inquiry_headers['authorization'] = f'Bearer {self.access_token}'
             dom_holdings_inquiry_headers['appkey'] = self.APP_KEY
             dom_holdings_inquiry_headers['appsecret'] = self.APP_SECRET
@@ -288,7 +373,7 @@ class KisStock(BaseStock):
         else:
             # domestic
             dom_holdings_inquiry_url = f'{KisStock.URL_BASE}/{KisStock.DOM_HOLDINGS_INQUIRY_PATH}'
-            dom_holdings_inquiry_headers = copy.deepcopy(KisStock.BASE_HEADER)
+            dom_holdings_inquiry_headers = dict(KisStock.BASE_HEADER)
             dom_holdings_inquiry_headers['authorization'] = f'Bearer {self.access_token}'
             dom_holdings_inquiry_headers['appkey'] = self.APP_KEY
             dom_holdings_inquiry_headers['appsecret'] = self.APP_SECRET
@@ -307,20 +392,16 @@ class KisStock(BaseStock):
                 'CTX_AREA_NK100': ''
             }
 
-        # query the holdings
-        is_all = False
-        while not is_all:
-            res = self._getWrapper(dom_holdings_inquiry_url, dom_holdings_inquiry_headers, dom_holdings_inquiry_params)
-
-            # check success
-            if res.json()['rt_cd'] != '0':
-                error_msg = 'dom holdings query failed.'
-                logger.error(error_msg)
-                raise Exception(error_msg)
-
-            # get holdings amount to corresponding stock and derive the increment from ref_report
-            stocks = res.json()['output1']
-            for stock in stocks:
+        # query the holdings page by page until every DOM stock of stockgrp_info is resolved
+        unresolved_stockkeys = {stockkey for stockkey, stock in self.stockgrp_info['stocks'].items()
+                                if stock['market'] == 'DOM'}
+        if len(unresolved_stockkeys) != 0:
+            rows = self._paginate_holdings(dom_holdings_inquiry_url,
+                                           dom_holdings_inquiry_headers,
+                                           dom_holdings_inquiry_params,
+                                           KisStock.DOM_CTX_AREA_KEYS,
+                                           'dom holdings query')
+            for stock in rows:
                 stockkey = stock['pdno']
 
                 # if the stockkey is not enlisted in stockgrp_info, pass that stock because it's not the target of autoinv
@@ -336,19 +417,15 @@ class KisStock(BaseStock):
 
                 self.stockgrp_info['stocks'][stockkey]['holdings'] = int(stock['hldg_qty'])
 
-            # determine whether to continue querying
-            tr_cont = res.headers['tr_cont']
-            if tr_cont == 'F' or tr_cont == 'M':
-                continue  # query not finished
-            elif tr_cont == 'D' or tr_cont == 'E':
-                is_all = True  # query finished
-            else:
-                logger.error(f'Invalid tr_cont value ({tr_cont}) in querying holdings')
-                raise ValueError
+                # stop reading further pages once every stock is resolved
+                unresolved_stockkeys.discard(stockkey)
+                if len(unresolved_stockkeys) == 0:
+                    rows.close()
+                    break
 
         # US
         us_holdings_inquiry_url = f'{KisStock.URL_BASE}/{KisStock.US_HOLDINGS_INQUIRY_PATH}'
-        us_holdings_inquiry_headers = copy.deepcopy(KisStock.BASE_HEADER)
+        us_holdings_inquiry_headers = dict(KisStock.BASE_HEADER)
         us_holdings_inquiry_headers['authorization'] = f'Bearer {self.access_token}'
         us_holdings_inquiry_headers['appkey'] = self.APP_KEY
         us_holdings_inquiry_headers['appsecret'] = self.APP_SECRET
@@ -363,19 +440,16 @@ class KisStock(BaseStock):
             'CTX_AREA_NK200': ''
         }
 
-        # query the holdings
-        is_all = False
-        while not is_all:
-            res = self._getWrapper(us_holdings_inquiry_url, us_holdings_inquiry_headers, us_holdings_inquiry_params)
-
-            if res.json()['rt_cd'] != '0':
-                error_msg = 'us holdings query failed.'
-                logger.error(error_msg)
-                raise Exception(error_msg)
-
-            # add holdings amount to corresponding stock
-            stocks = res.json()['output1']
-            for stock in stocks:
+        # query the holdings page by page until every US stock of stockgrp_info is resolved
+        unresolved_stockkeys = {stockkey for stockkey, stock in self.stockgrp_info['stocks'].items()
+                                if stock['market'] != 'DOM'}
+        if len(unresolved_stockkeys) != 0:
+            rows = self._paginate_holdings(us_holdings_inquiry_url,
+                                           us_holdings_inquiry_headers,
+                                           us_holdings_inquiry_params,
+                                           KisStock.US_CTX_AREA_KEYS,
+                                           'us holdings query')
+            for stock in rows:
                 stockkey = stock['ovrs_pdno']
 
                 # if the stockkey is not enlisted in stockgrp_info, pass that stock because it's not the target of autoinv
@@ -384,16 +458,21 @@ class KisStock(BaseStock):
 
                 self.stockgrp_info['stocks'][stockkey]['holdings'] = int(stock['ovrs_cblc_qty'])
 
-            # determine whether to continue querying
-            tr_cont = res.headers['tr_cont']
-            if tr_cont == 'F' or tr_cont == 'M':
-                continue
-            elif tr_cont == 'D' or tr_cont == 'E':
-                is_all = True
-            else:
-                logger.error(f'Invalid tr_cont value ({tr_cont}) in querying holdings')
-                raise ValueError
-
+                # stop reading further pages once every stock is resolved
+                unresolved_stockkeys.discard(stockkey)
+                if len(unresolved_stockkeys) == 0:
+                    rows.close()
+                    break
+
+        # holdings of a stock not held by the account are only known from the reference report
+        missing_stockkeys = [stockkey for stockkey, stock in self.stockgrp_info['stocks'].items()
+                             if 'holdings' not in stock.keys()]
+        if len(missing_stockkeys) != 0:
+            error_msg = f'{missing_stockkeys} are not held by the account, so their holdings should be given'
+            logger.error(error_msg)
+            raise ValueError(error_msg)
+
+    @metrics.instrumented()
     def update_all(self):  # call order is crucial
         self._collect_prices()
         self._collect_holdings()
@@ -402,30 +481,93 @@ class KisStock(BaseStock):
 
 
 class GeckoStock(BaseStock):
+    PROVIDER = 'CoinGecko'
     BASE_CURRENCY = 'usd'
-    SYMB2ID_DICT = {
+    ROK_CURRENCY = 'KRW'
+    DEFAULT_COIN_IDS = {  # ids of well-known symbols shared by other (e.g. bridged) coins
         'BTC': 'bitcoin',
         'ETH': 'ethereum',
         'BNB': 'binancecoin'
     }
-    ID2SYMB_DICT = {
-        'bitcoin': 'BTC',
-        'ethereum': 'ETH',
-        'binancecoin': 'BNB'
-    }
     ROK_EXCHANGE_IDS = ('bithumb', 'upbit', 'korbit', 'coinone')
+    ROK_EXCHANGE_DEADLINE_IN_SEC = 10.0  # exchanges not answering within this deadline are dropped from the median
+    TICKERS_PER_PAGE = 100  # tickers of an exchange are paginated by 100
+    TICKER_PAGES_MAX_INFLIGHT = 2  # max number of concurrent page queries per exchange (within the connection pool)
+    TICKER_MAX_PAGES = 20
+
+    # - Request quota (the free tier of CoinGecko allows about 30 requests/min; keep a margin)
+    REQUESTS_PER_SEC = 0.4
+    REQUEST_BURST = 10  # a run of a few coins (simple price and the first ticker page of every exchange) is not delayed
+    RATE_LIMITER = ratelimit.TokenBucket(REQUESTS_PER_SEC, REQUEST_BURST)  # shared by every GeckoStock in the process
+    RATE_LIMITED_MAX_TRIES = 3
+    RATE_LIMITED_MAX_WAIT_IN_SEC = 10.0  # cap of Retry-After of a rate limited (HTTP 429) request
 
     URL_BASE = 'https://api.coingecko.com/api/v3'
     BASE_HEADER = {'content-type': 'application/json'}
     SIMPLE_PRICE_INQUIRY_PATH = '/simple/price'
     EXCHANGEWISE_PRICE_INQUIRY_PATH_HEADER = '/exchanges/'
 
+    def __init__(self, exchange_rate: float, ref_exchange_rate: float, ref_stockgrp_info: dict, price_cache=None):
+        super().__init__(exchange_rate, ref_exchange_rate, ref_stockgrp_info, price_cache)
+        self.coin_ids = None  # coin_symb -> CoinGecko id, resolved before the first query
+
+    def _getWrapper(self, URL, headers=None, params=None, verify=True, timeout=None, retries=0):
+        for attempt in range(GeckoStock.RATE_LIMITED_MAX_TRIES):
+            GeckoStock.RATE_LIMITER.acquire()  # every CoinGecko GET request counts toward the per-minute quota
+            res = super()._getWrapper(URL, headers, params, verify, timeout, retries + attempt)
+            if res.status_code != 429:
+                break
+
+            retry_after = res.headers.get('retry-after', '')  # in seconds or an HTTP date
+            retry_after_in_sec = min(float(retry_after) if retry_after.isdigit() else 1.0 / GeckoStock.REQUESTS_PER_SEC,
+                                     GeckoStock.RATE_LIMITED_MAX_WAIT_IN_SEC)
+            logger.warning(f'CoinGecko rate limit exceeded. Retrying {URL} after {retry_after_in_sec} seconds')
+            time.sleep(retry_after_in_sec)
+
+        return res
+
+    def _get_coin_ids(self) -> dict:
+        ''' CoinGecko ids of every coin, taken from coinIds of the stockgroup, DEFAULT_COIN_IDS or the coin index '''
+        if self.coin_ids is not None:
+            return self.coin_ids
+
+        coin_id_overrides = self.stockgrp_info.get('coinIds', {})
+        coin_ids = {}
+        for coin_symb in self.stockgrp_info['stocks'].keys():
+            if coin_symb in coin_id_overrides.keys():
+                coin_ids[coin_symb] = coin_id_overrides[coin_symb]
+                continue
+            if coin_symb in GeckoStock.DEFAULT_COIN_IDS.keys():
+                coin_ids[coin_symb] = GeckoStock.DEFAULT_COIN_IDS[coin_symb]
+                continue
+
+            candidate_ids = coinindex.get_coin_index().coin_ids(coin_symb)
+            if len(candidate_ids) == 0:
+                error_msg = f'{coin_symb} is not listed by CoinGecko. Give its id in coinIds of the stockgroup'
+                logger.error(error_msg)
+                raise Exception(error_msg)
+            if len(candidate_ids) > 1:
+                error_msg = f'{coin_symb} is ambiguous among CoinGecko ids {candidate_ids}. ' \
+                            'Give its id in coinIds of the stockgroup'
+                logger.error(error_msg)
+                raise Exception(error_msg)
+            coin_ids[coin_symb] = candidate_ids[0]
+
+        self.coin_ids = coin_ids
+        return self.coin_ids
+
+    @metrics.instrumented()
     def _collect_international_prices(self):
-        coin_symbs = self.stockgrp_info['stocks'].keys()
+        # only query prices which are not available from the price cache
+        coin_ids = self._get_coin_ids()  # check every coin before sending any query
+        coin_symbs = [coin_symb for coin_symb in self.stockgrp_info['stocks'].keys()
+                      if not self._load_cached_price(coin_symb, GeckoStock.BASE_CURRENCY)]
+        if len(coin_symbs) == 0:
+            return
 
         international_price_inquiry_url = f'{GeckoStock.URL_BASE}{GeckoStock.SIMPLE_PRICE_INQUIRY_PATH}'
         international_price_inquiry_params = {
-            'ids': ','.join([GeckoStock.SYMB2ID_DICT[coin_symb] for coin_symb in coin_symbs]),
+            'ids': ','.join([coin_ids[coin_symb] for coin_symb in coin_symbs]),
             'vs_currencies': GeckoStock.BASE_CURRENCY
         }
         res = self._getWrapper(
@@ -436,33 +578,60 @@ class GeckoStock(BaseStock):
 
         # extract prices from the queries
         price_results = res.json()
-        for coin_id in price_results.keys():
-            self.stockgrp_info['stocks'][GeckoStock.ID2SYMB_DICT[coin_id]]['price'] = \
-                float(price_results[coin_id][GeckoStock.BASE_CURRENCY])
+        missing_coin_symbs = [coin_symb for coin_symb in coin_symbs if coin_ids[coin_symb] not in price_results.keys()]
+        if len(missing_coin_symbs) != 0:
+            error_msg = f'CoinGecko returned no price of {missing_coin_symbs}'
+            logger.error(error_msg)
+            raise Exception(error_msg)
+        for coin_symb in coin_symbs:
+            self._store_live_price(coin_symb,
+                                   GeckoStock.BASE_CURRENCY,
+                                   float(price_results[coin_ids[coin_symb]][GeckoStock.BASE_CURRENCY]))
+
+    def _query_ticker_page(self, ROK_exchange_id: str, coin_ids: list, page: int) -> tuple:
+        ''' tickers of a page of a ROK exchange and the number of pages (None when the response does not tell) '''
+        ticker_inquiry_url = \
+            f'{GeckoStock.URL_BASE}{GeckoStock.EXCHANGEWISE_PRICE_INQUIRY_PATH_HEADER}{ROK_exchange_id}/tickers'
+        ticker_inquiry_params = {
+            'id': ROK_exchange_id,
+            'coin_ids': ','.join(coin_ids),
+        }
+        if page != 1:
+            ticker_inquiry_params['page'] = page  # the first page is the default
+        res = self._getWrapper(
+            ticker_inquiry_url,
+            GeckoStock.BASE_HEADER,
+            ticker_inquiry_params,
+            timeout=GeckoStock.ROK_EXCHANGE_DEADLINE_IN_SEC
+        )
+        if res.status_code != 200:
+            error_msg = f'Querying page {page} of the tickers of {ROK_exchange_id} failed (HTTP {res.status_code})'
+            logger.error(error_msg)
+            raise Exception(error_msg)
 
-    def _collect_domestic_prices(self):
-        # prepare exchange-wise price queries
-        domestic_price_inquiry_url_head = f'{GeckoStock.URL_BASE}{GeckoStock.EXCHANGEWISE_PRICE_INQUIRY_PATH_HEADER}'
+        num_pages = None
+        if 'total' in res.headers.keys() and 'per-page' in res.headers.keys():
+            num_pages = -(-int(res.headers['total']) // int(res.headers['per-page']))
 
-        # query ROK prices for Kimchi premium
-        ROK_prices = {}  # dict for getting the median of the prices
+        return res.json()['tickers'], num_pages
 
-        # for each target ROK exchanges
-        for ROK_exchange_id in GeckoStock.ROK_EXCHANGE_IDS:
-            coin_symbs = self.stockgrp_info['stocks'].keys()
-            domestic_price_inquiry_url = domestic_price_inquiry_url_head + f'{ROK_exchange_id}/tickers'
-            domestic_price_inquiry_params = {
-                'id': ROK_exchange_id,
-                'coin_ids': ','.join([GeckoStock.SYMB2ID_DICT[coin_symb] for coin_symb in coin_symbs]),
-            }
-            res = self._getWrapper(
-                domestic_price_inquiry_url,
-                GeckoStock.BASE_HEADER,
-                domestic_price_inquiry_params
-            )
-            ROK_tickers = res.json()['tickers']
+    @metrics.instrumented(symbol_arg='coin_symbs')
+    def _query_ROK_exchange_prices(self, ROK_exchange_id: str, coin_symbs: list) -> dict:
+        ''' query the tickers of a ROK exchange and return KRW prices of the target coins ({coin_symb: [price, ...]})
+
+        The pages after the first are queried concurrently (at most TICKER_PAGES_MAX_INFLIGHT at a time) until every
+        target coin has a KRW price, the last page is read or the deadline of the exchange is over '''
+        deadline = time.monotonic() + GeckoStock.ROK_EXCHANGE_DEADLINE_IN_SEC
+        coin_ids = self._get_coin_ids()
+        coin_symbs_by_id = {coin_ids[coin_symb]: coin_symb for coin_symb in coin_symbs}
+        exchange_prices = {}
+
+        def collect_KRW_prices(ROK_tickers: list):
             for ROK_ticker in ROK_tickers:
-                if ROK_ticker['base'] not in coin_symbs:
+                # match by the id of the coin if given since coins may share a ticker symbol
+                coin_symb = coin_symbs_by_id.get(ROK_ticker['coin_id']) if 'coin_id' in ROK_ticker.keys() else \
+                    (ROK_ticker['base'] if ROK_ticker['base'] in coin_symbs else None)
+                if coin_symb is None:
                     # ignore coins not in coin_symbs
                     continue
 
@@ -470,13 +639,110 @@ class GeckoStock(BaseStock):
                     # ignore exchange pairs that does not have KRW as the target currency
                     continue
 
-                ROK_price = float(ROK_ticker['last'])
-                if ROK_ticker['base'] in ROK_prices.keys():
-                    # if there's already values for the given key
-                    ROK_prices[ROK_ticker['base']].append(ROK_price)
+                if coin_symb in exchange_prices.keys():
+                    exchange_prices[coin_symb].append(float(ROK_ticker['last']))
                 else:
-                    # when there is no such a key, add a list as a value
-                    ROK_prices[ROK_ticker['base']] = [ROK_price]
+                    exchange_prices[coin_symb] = [float(ROK_ticker['last'])]
+
+        ROK_tickers, num_pages = self._query_ticker_page(ROK_exchange_id, list(coin_symbs_by_id.keys()), 1)
+        collect_KRW_prices(ROK_tickers)
+        if num_pages is not None:
+            last_page = min(num_pages, GeckoStock.TICKER_MAX_PAGES)
+        else:
+            # without the number of pages, the first page which is not full is the last one
+            last_page = 1 if len(ROK_tickers) < GeckoStock.TICKERS_PER_PAGE else GeckoStock.TICKER_MAX_PAGES
+
+        # pages are requested in order and no more pages once every target coin is found
+        executor = ThreadPoolExecutor(max_workers=GeckoStock.TICKER_PAGES_MAX_INFLIGHT)
+        futures = {}  # in-flight queries -> page
+        next_page = 2
+        try:
+            while True:
+                while len(futures) < GeckoStock.TICKER_PAGES_MAX_INFLIGHT and next_page <= last_page and \
+                        len(exchange_prices) < len(coin_symbs) and time.monotonic() < deadline:
+                    futures[executor.submit(self._query_ticker_page,
+                                            ROK_exchange_id, list(coin_symbs_by_id.keys()), next_page)] = next_page
+                    next_page += 1
+                if len(futures) == 0 or len(exchange_prices) == len(coin_symbs):
+                    break
+
+                done_futures, _ = wait(futures.keys(), timeout=max(deadline - time.monotonic(), 0.0),
+                                       return_when=FIRST_COMPLETED)
+                if len(done_futures) == 0:
+                    break  # the deadline is over
+                for future in done_futures:
+                    page = futures.pop(future)
+                    ROK_tickers, _ = future.result()
+                    collect_KRW_prices(ROK_tickers)
+                    if num_pages is None and len(ROK_tickers) < GeckoStock.TICKERS_PER_PAGE:
+                        last_page = min(last_page, page)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)  # do not wait for pages no longer needed
+
+        if len(exchange_prices) < len(coin_symbs):
+            if next_page <= last_page:
+                logger.warning(f'Stopped querying the tickers of {ROK_exchange_id} at page {next_page - 1} '
+                               f'(deadline of {GeckoStock.ROK_EXCHANGE_DEADLINE_IN_SEC} seconds)')
+            elif last_page == GeckoStock.TICKER_MAX_PAGES:
+                logger.warning(f'Stopped querying the tickers of {ROK_exchange_id} at page {GeckoStock.TICKER_MAX_PAGES} '
+                               '(TICKER_MAX_PAGES)')
+
+        return exchange_prices
+
+    @metrics.instrumented()
+    def _collect_domestic_prices(self):
+        # only query prices which are not available from the price cache. cached ROK prices are in KRW
+        coin_symbs = []
+        for coin_symb, coin_value in self.stockgrp_info['stocks'].items():
+            if self._load_cached_price(coin_symb, GeckoStock.ROK_CURRENCY, 'priceROK', 1.0 / self.exchange_rate):
+                coin_value.pop('priceROKSources', None)  # contributing exchanges are not cached
+            else:
+                coin_symbs.append(coin_symb)
+        if len(coin_symbs) == 0:
+            return
+
+        # query ROK prices for Kimchi premium
+        ROK_prices = {}  # dict for getting the median of the prices
+        ROK_price_sources = {}  # exchanges which contributed to the median of each coin
+
+        # query every target ROK exchange concurrently and take the results as they arrive
+        executor = ThreadPoolExecutor(max_workers=len(GeckoStock.ROK_EXCHANGE_IDS))
+        futures = {
+            executor.submit(self._query_ROK_exchange_prices, ROK_exchange_id, coin_symbs): ROK_exchange_id
+            for ROK_exchange_id in GeckoStock.ROK_EXCHANGE_IDS
+        }
+        try:
+            for future in as_completed(futures, timeout=GeckoStock.ROK_EXCHANGE_DEADLINE_IN_SEC):
+                ROK_exchange_id = futures[future]
+                try:
+                    exchange_prices = future.result()
+                except Exception as e:
+                    logger.warning(f'Querying tickers of {ROK_exchange_id} failed ({e!r}). {ROK_exchange_id} is dropped.')
+                    continue
+
+                for coin_symb, exchange_prices_list in exchange_prices.items():
+                    if coin_symb in ROK_prices.keys():
+                        # if there's already values for the given key
+                        ROK_prices[coin_symb] += exchange_prices_list
+                        ROK_price_sources[coin_symb].append(ROK_exchange_id)
+                    else:
+                        # when there is no such a key, add a list as a value
+                        ROK_prices[coin_symb] = exchange_prices_list
+                        ROK_price_sources[coin_symb] = [ROK_exchange_id]
+
+                    # for each cryptocurrency, take the median of the prices collected so far as the price
+                    # and apply exchange rate so that the ROK price is in GeckoStock.BASE_CURRENCY
+                    self._store_live_price(coin_symb,
+                                           GeckoStock.ROK_CURRENCY,
+                                           median(ROK_prices[coin_symb]),
+                                           'priceROK',
+                                           1.0 / self.exchange_rate)
+        except FuturesTimeoutError:  # not the builtin TimeoutError before Python 3.11
+            late_exchange_ids = [ROK_exchange_id for future, ROK_exchange_id in futures.items() if not future.done()]
+            logger.warning(f'Dropped exchange(s) not responding within {GeckoStock.ROK_EXCHANGE_DEADLINE_IN_SEC} seconds: '
+                           f'{", ".join(late_exchange_ids)}')
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)  # do not wait for dropped exchanges
 
         # check if at least one price is collected for each target coin
         if len(ROK_prices) != len(coin_symbs):
@@ -484,23 +750,23 @@ class GeckoStock(BaseStock):
                          f'Collected coins list: {ROK_prices.keys()}\n'
                          f'Target coins list: {coin_symbs}\n')
 
-        # for each cryptocurrency, take the median as the price to be registered to stockgrp_info
-        # and apply exchange rate so that the ROK price is in GeckoStock.BASE_CURRENCY
-        for coin_symb, ROK_prices_list in ROK_prices.items():
-            self.stockgrp_info['stocks'][coin_symb]['priceROK'] = median(ROK_prices_list) / self.exchange_rate
+        # record which exchanges contributed to each priceROK (in the order of ROK_EXCHANGE_IDS)
+        for coin_symb, ROK_exchange_ids in ROK_price_sources.items():
+            self.stockgrp_info['stocks'][coin_symb]['priceROKSources'] = \
+                [ROK_exchange_id for ROK_exchange_id in GeckoStock.ROK_EXCHANGE_IDS if ROK_exchange_id in ROK_exchange_ids]
 
+    @metrics.instrumented()
     def _derive_kimchi_premium(self):
         for coin_symb, coin_value in self.stockgrp_info['stocks'].items():
             if 'price' not in coin_value.keys():
-                error_msg = f'price of a coin should be given in advance to derive Kimchi preimum, but got {coin_value["price"]}'
+                error_msg = f'price of {coin_symb} should be given in advance to derive Kimchi preimum'
                 logger.error(error_msg)
-                raise Exception
+                raise Exception(error_msg)
 
             if 'priceROK' not in coin_value.keys():
-                error_msg = \
-                    f'priceROK of a coin should be given in advance to derive Kimchi preimum, but got {coin_value["priceROK"]}'
+                error_msg = f'priceROK of {coin_symb} should be given in advance to derive Kimchi preimum'
                 logger.error(error_msg)
-                raise Exception
+                raise Exception(error_msg)
 
             coin_value['kimchi'] = float(coin_value['priceROK']) / float(coin_value['price'])
             if coin_value['kimchi'] > 1.05:
@@ -509,6 +775,7 @@ class GeckoStock(BaseStock):
                     'Consider using foreign exchanges'
                 )
 
+    @metrics.instrumented()
     def update_all(self):  # call order is crucial
         self._update_holdings()  # before _derive_appraisement and prices collection
         self._collect_international_prices()
@@ -519,81 +786,37 @@ class GeckoStock(BaseStock):
 
 
 class KrxStock(BaseStock):
-    OTP_GENERATE_URL = 'http://data.krx.co.kr/comm/fileDn/GenerateOTP/generate.cmd'
-    OTP_GENERATE_HEADERS = {
-        'User-Agent': ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)'
-                       'AppleWebKit/537.36 (KHTML, like Gecko)'
-                       'Chrome/130.0.0.0 Safari/537.36 Edg/130.0.0.0')
-    }
-    OTP_GENERATE_PAYLOAD_BASE = {
-        'locale': 'en_US',
-        'isuCd': 'KRD040200002',
-        'share': '1',
-        'money': '1',
-        'csvxls_isNo': 'false',
-        'name': 'fileDown',
-        'url': 'dbms/MDC/STAT/standard/MDCSTAT15001'
-    }
-    PRICE_CSV_DOWNLOAD_URL = 'http://data.krx.co.kr/comm/fileDn/download_csv/download.cmd'
-    PRICE_CSV_DOWNLOAD_HEADERS = OTP_GENERATE_HEADERS
-    PRICE_CSV_ENCODING = 'euc-kr'
-    TRADING_DAY_LOOKUP_WINDOW_IN_DAYS = 10
-
-    def _get_recent_trading_dates(self) -> pandas.DatetimeIndex:
-        # instantiate xcals for KRX
-        xkrx = xcals.get_calendar('XKRX')
-
-        # query window-days of time for trading days and get the last trading day from the result
-        today = datetime.today()
-        window_from_date = (today - timedelta(days=KrxStock.TRADING_DAY_LOOKUP_WINDOW_IN_DAYS)).strftime('%Y-%m-%d')
-        window_to_date = today.strftime('%Y-%m-%d')
-
-        return xkrx.sessions_in_range(window_from_date, window_to_date)  # Caution not %Y-%m-%d!
-
-    def _collect_otp(self):
-        # complete OTP request payload
-        otp_requeust_payload = copy.deepcopy(KrxStock.OTP_GENERATE_PAYLOAD_BASE)
-        recent_trading_days = self._get_recent_trading_dates()
-        otp_requeust_payload['strtDd'] = recent_trading_days[0].strftime('%Y%m%d')  # Caution not %Y-%m-%d
-        otp_requeust_payload['endDd'] = recent_trading_days[-1].strftime('%Y%m%d')
-
-        # get OTP from the response
-        otp_resp = self._postWrapper(KrxStock.OTP_GENERATE_URL,
-                                     headers=KrxStock.OTP_GENERATE_HEADERS,
-                                     data=otp_requeust_payload)
-        self.otp = otp_resp.text.strip()
+    PROVIDER = 'KRX'
+    DEFAULT_ISU_CDS = {'GLD': 'KRD040200002'}  # isuCd of stocks given without one (GLD: 금 99.99_1Kg)
+
+    @staticmethod
+    def _get_isu_cd(stockkey: str, stock: dict) -> str:
+        # stocks without isuCd are checked to be in DEFAULT_ISU_CDS when the reference report is loaded
+        return stock['isuCd'] if 'isuCd' in stock.keys() else KrxStock.DEFAULT_ISU_CDS[stockkey]
 
+    @metrics.instrumented()
     def _collect_prices(self):
-        # complete request for download.cmd
-        download_request_headers = copy.deepcopy(KrxStock.PRICE_CSV_DOWNLOAD_HEADERS)
-        download_request_headers['referer'] = KrxStock.OTP_GENERATE_URL
-        download_request_payload = {'code': self.otp}
-
-        # get a CSV containing the price from the response
-        download_resp = self._postWrapper(
-            KrxStock.PRICE_CSV_DOWNLOAD_URL,
-            headers=download_request_headers,
-            data=download_request_payload
-        )
-        price_csv = StringIO(download_resp.content.decode(KrxStock.PRICE_CSV_ENCODING))
-        price_csv_parsed = csv.DictReader(price_csv)
+        isu_cds = {stockkey: self._get_isu_cd(stockkey, stock) for stockkey, stock in self.stockgrp_info['stocks'].items()}
 
-        # access stockgrp_info element
+        # only download prices which are not available from the price cache. one download per market
+        # prices are cached by isuCd (as the market) since the same stockkey may name different stocks in other reports
+        stockkeys_by_market = {}
         for stockkey, stock in self.stockgrp_info['stocks'].items():
-            if stockkey == 'GLD':
-                # extract price from CSV. We only need the most recent price (the top row)
-                for price_record in price_csv_parsed:
-                    stock['price'] = float(price_record['종가'])
-                    logger.info(f'Current price of {stockkey} is {stock["price"]} {stock["currency"]}')
-                    break  # for the case we have more than one record (this happens when it has just passed midnight)
-            else:
-                error_msg = f'KrxStock currently supports only \'GLD\' as a stocks member. However {stockkey} given'
-                logger.error(error_msg)
-                raise Exception(error_msg)
+            if not self._load_cached_price(stockkey, isu_cds[stockkey]):
+                market = stock.get('krxMarket', krxdata.KrxMarketData.DEFAULT_MARKET)
+                stockkeys_by_market.setdefault(market, []).append(stockkey)
+        for market, stockkeys in stockkeys_by_market.items():
+            prices = krxdata.market_data.get_prices({isu_cds[stockkey] for stockkey in stockkeys}, market)
+            for stockkey in stockkeys:
+                self._store_live_price(stockkey, isu_cds[stockkey], prices[isu_cds[stockkey]])
+
+        for stockkey, stock in self.stockgrp_info['stocks'].items():
+            if 'price' in stock.keys():
+                logger.info(f'Current price of {stockkey} is {stock["price"]} {stock["currency"]} ({stock["priceSource"]})')
 
+    @metrics.instrumented()
     def update_all(self):  # call order is crucial
         self._update_holdings()  # before _derive_appraisement and prices collection
-        self._collect_otp()  # before _collect_prices
-        self._collect_prices()  # before _derive_appraisement
+        self._collect_prices()  # before _derive_appraisement. downloads only prices not cached
         self._update_ca_invested()  # after _update_holdings
         self._derive_appraisement()
@@ -0,0 +1,21 @@
+''' units allocated within a budget '''
+import warnings
+import numpy as np
+import allocator
+
+
+def test_buying_needs_are_scaled_to_the_budget():
+    units, leftover = allocator.allocate_units([300.0, 100.0, -50.0], [10.0, 25.0, 5.0], [False, True, False], 150.0)
+
+    # buying needs of 400 funded by the budget and 50 of selling are scaled by 0.5
+    np.testing.assert_array_equal(units, [15.0, 2.0, -10.0])
+    assert leftover == 0.0
+
+
+def test_no_buying_needs_are_kept():
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')  # e.g. a RuntimeWarning of a division by zero
+        units, leftover = allocator.allocate_units([-30.0, -12.0], [10.0, 4.0], [False, True], -100.0)
+
+    np.testing.assert_array_equal(units, [-3.0, -3.0])
+    assert leftover == -58.0
@@ -0,0 +1,121 @@
+''' cross-check backtest.run_backtest() against reports chained by Portfolio.distribute_saving() '''
+import json
+import numpy as np
+import pytest
+import backtest
+import portfolio
+import reportmodel
+import stockwrapper
+
+
+SAVING_IN_KRW = 1500000.0
+SAVING_IN_USD = 300.0
+EXCHANGE_RATES = [1300.0, 1342.5, 1288.0, 1401.25, 1365.0, 1320.0]
+# (stockgroupkey, stockkey, currency, weight, initial holdings, prices of each period)
+STOCKS = [
+    ('OTHER', 'KRW_STOCK', 'KRW', 0.3, 12, [61200.0, 59800.0, 63400.0, 60100.0, 58700.0, 62500.0]),
+    ('OTHER', 'USD_STOCK', 'USD', 0.25, 7, [412.3, 398.7, 421.05, 430.9, 405.2, 417.6]),
+    ('CoinGecko', 'BTC', 'USD', 0.25, 0.0123, [61250.0, 58800.0, 63900.0, 66100.0, 60500.0, 64200.0]),
+    ('CoinGecko', 'KRW_COIN', 'KRW', 0.2, 3.5, [812.0, 790.5, 845.25, 801.0, 833.5, 820.0])
+]
+
+
+def root_report(strategy: str) -> dict:
+    stockgroups = {}
+    for stockgroupkey, stockkey, currency, weight, holdings, prices in STOCKS:
+        stockgroups.setdefault(stockgroupkey, {'stocks': {}})['stocks'][stockkey] = {
+            'weight': weight,
+            'currency': currency,
+            'holdings': holdings,
+            'price': prices[0],
+            'cumSumCaInvested': 100.0,
+            'need2investCA': 20.0
+        }
+
+    return {'strategy': strategy, 'stockgroups': stockgroups}
+
+
+def refresh_stockgroups(ref_report: dict, period: int, exchange_rate: float) -> dict:
+    ''' refreshed stockgroups of a period as the stockgroup handlers give, with the prices of STOCKS and every
+    need2investInUnits of the ref report executed in full '''
+    prices = {stockkey: prices[period] for _, stockkey, _, _, _, prices in STOCKS}
+    refreshed_stockgroups = {}
+    for stockgroupkey, stockgroup in ref_report['stockgroups'].items():
+        stockgroup = reportmodel.copy_stockgroup(stockgroup)
+        for stockkey, stock in stockgroup['stocks'].items():
+            stock['price'] = prices[stockkey]
+            if 'need2investInUnits' in stock.keys():
+                stock['actualInvestedInUnits'] = stock['need2investInUnits']
+        stockgroup_handler = stockwrapper.BaseStock(exchange_rate, None, stockgroup)
+        stockgroup_handler.update_all()
+        refreshed_stockgroups[stockgroupkey] = stockgroup_handler.get_stockgrp()
+
+    return refreshed_stockgroups
+
+
+def chain_reports(strategy: str, tmp_path) -> list:
+    ''' reports derived period by period, each from the previous one '''
+    ref_report = root_report(strategy)
+    reports = []
+    for period, exchange_rate in enumerate(EXCHANGE_RATES):
+        ref_report_path = str(tmp_path / f'report_{period}.json')
+        with open(ref_report_path, 'w') as f:
+            json.dump(ref_report, f)
+
+        my_portfolio = portfolio.Portfolio(ref_report_path, 'secrets.json', 'tokens.json', SAVING_IN_KRW, SAVING_IN_USD,
+                                           exchange_rate=exchange_rate)
+        my_portfolio.distribute_saving(refresh_stockgroups(my_portfolio.ref_report, period, exchange_rate))
+        reports.append(my_portfolio.this_report)
+        ref_report = my_portfolio.this_report
+
+    return reports
+
+
+def report_column(reports: list, field: str) -> np.ndarray:
+    ''' [T, n] array of a field of the stocks of the reports '''
+    return np.array([[stock[field] for stockgroup in report['stockgroups'].values()
+                      for stock in stockgroup['stocks'].values()] for report in reports], dtype=float)
+
+
+@pytest.mark.parametrize('strategy', ['CA', 'VA'])
+def test_run_backtest_matches_chained_reports(strategy, tmp_path):
+    reports = chain_reports(strategy, tmp_path)
+
+    state = backtest.initial_state_from_report(root_report(strategy))
+    assert state['stockkeys'] == [(stockgroupkey, stockkey) for stockgroupkey, stockkey, _, _, _, _ in STOCKS]
+    exchange_rates = np.array(EXCHANGE_RATES)
+    result = backtest.run_backtest(
+        strategy,
+        state['weights'],
+        np.array([prices for _, _, _, _, _, prices in STOCKS]).T,
+        exchange_rates,
+        SAVING_IN_KRW / exchange_rates + SAVING_IN_USD,
+        state['is_krw'],
+        state['fractional'],
+        state['initial_holdings'],
+        state['initial_cum_sum_ca_invested'],
+        state['initial_need2invest_ca'],
+        state['initial_need2invest'],
+        state['initial_cum_inv_deviation']
+    )
+
+    for field in ('holdings', 'appraisement', 'cumSumCaInvested', 'need2investCA', 'need2invest', 'need2investInUnits'):
+        np.testing.assert_array_equal(result[field], report_column(reports, field), err_msg=field)
+    if strategy == 'VA':
+        np.testing.assert_array_equal(result['need2invest'], report_column(reports, 'need2investVA'))
+
+    # USD spent by executing need2investInUnits at the price of the period
+    units = report_column(reports, 'need2investInUnits')
+    prices = report_column(reports, 'price')
+    is_krw = np.array([currency == 'KRW' for _, _, currency, _, _, _ in STOCKS])
+    cash_flow = units * np.where(is_krw, prices / exchange_rates[:, np.newaxis], prices)
+    np.testing.assert_array_equal(result['cash_flow'], cash_flow)
+    np.testing.assert_array_equal(result['total_cash_flow'], cash_flow.sum(axis=-1))
+
+    np.testing.assert_allclose(result['cum_inv_deviation'], report_column(reports, 'cum_inv_deviation'),
+                               rtol=1e-9, atol=1e-6)
+
+    # fractional stocks are invested fractionally, the others in whole units
+    fractional_units = units[:, state['fractional']]
+    assert not np.array_equal(fractional_units, np.round(fractional_units))
+    np.testing.assert_array_equal(units[:, ~state['fractional']], np.round(units[:, ~state['fractional']]))
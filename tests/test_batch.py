@@ -0,0 +1,78 @@
+''' paths of the batch entries of a manifest '''
+import json
+import os
+import batch
+
+
+DEFAULTS = {
+    'secrets_path': 'secrets.json',
+    'tokens_path': os.path.join('run', 'tokens.json'),
+    'saving_in_krw': 1000000.0,
+    'saving_in_usd': 0.0
+}
+
+
+def write_manifest(manifest_dir, manifest: dict) -> str:
+    manifest_path = str(manifest_dir / 'manifest.json')
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+    return manifest_path
+
+
+def test_paths_of_defaults_are_kept(tmp_path):
+    manifest_path = write_manifest(tmp_path, {'portfolios': [{'ref_report_path': 'a.json', 'output_report_path': 'out/a.json'}]})
+
+    entry, = batch.load_entries(manifest_path, None, DEFAULTS)
+
+    assert entry.ref_report_path == str(tmp_path / 'a.json')
+    assert entry.output_report_path == str(tmp_path / 'out' / 'a.json')
+    assert entry.secrets_path == DEFAULTS['secrets_path']
+    assert entry.tokens_path == DEFAULTS['tokens_path']
+
+
+def test_paths_of_manifest_are_resolved(tmp_path):
+    manifest_path = write_manifest(tmp_path, {
+        'defaults': {'secrets_path': 'shared/secrets.json', 'saving_in_usd': 100},
+        'portfolios': [
+            {'ref_report_path': 'a.json'},
+            {'ref_report_path': 'b.json', 'secrets_path': '/etc/b_secrets.json', 'tokens_path': 'b_tokens.json'}
+        ]
+    })
+
+    entry_a, entry_b = batch.load_entries(manifest_path, 'out', DEFAULTS)
+
+    assert entry_a.output_report_path == os.path.join('out', 'a.json')
+    assert entry_a.secrets_path == str(tmp_path / 'shared' / 'secrets.json')
+    assert entry_a.tokens_path == DEFAULTS['tokens_path']
+    assert entry_a.saving_in_usd == 100.0
+    assert entry_b.secrets_path == '/etc/b_secrets.json'
+    assert entry_b.tokens_path == str(tmp_path / 'b_tokens.json')
+
+
+class PrefetchedPortfolio:
+    ''' the part of Portfolio read by prefetch_market_data() '''
+    def __init__(self, ref_report: dict):
+        self.ref_report = ref_report
+
+
+def test_prefetch_keeps_stocks_of_different_markets(tmp_path, monkeypatch):
+    # GLD names the gold of the default isuCd in one portfolio and an emission allowance in the other
+    import krxdata
+    import marketcache
+
+    prices = {'KRD040200002': 101000.0, 'KRA000000001': 12000.0}
+    monkeypatch.setattr(krxdata.market_data, 'get_prices',
+                        lambda isu_cds, market: {isu_cd: prices[isu_cd] for isu_cd in isu_cds})
+    entries = [batch.BatchEntry('a.json', 'out/a.json', 'secrets.json', 'tokens.json', 0.0, 0.0),
+               batch.BatchEntry('b.json', 'out/b.json', 'secrets.json', 'tokens.json', 0.0, 0.0)]
+    entries[0].portfolio = PrefetchedPortfolio({'stockgroups': {'KRX': {'stocks': {'GLD': {'currency': 'KRW'}}}}})
+    entries[1].portfolio = PrefetchedPortfolio(
+        {'stockgroups': {'KRX': {'stocks': {'GLD': {'currency': 'KRW', 'isuCd': 'KRA000000001', 'krxMarket': 'emission'}}}}})
+    price_cache = marketcache.PriceCache(str(tmp_path), 'refresh')
+
+    batch.prefetch_market_data(entries, 1300.0, price_cache)
+
+    price_cache.mode = 'cached-only'
+    assert price_cache.get('KRX', 'GLD', 'KRD040200002')[0] == 101000.0
+    assert price_cache.get('KRX', 'GLD', 'KRA000000001')[0] == 12000.0
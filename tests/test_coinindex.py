@@ -0,0 +1,50 @@
+''' the CoinGecko coin index built from the coin list '''
+import httpclient
+import coinindex
+import stockwrapper
+
+
+class CoinListTransport:
+    ''' answers the coin list with a few coins '''
+    def __init__(self):
+        self.urls = []
+
+    def request(self, method, url, **kwargs):
+        self.urls.append(url)
+        return CoinListResponse()
+
+    def close(self):
+        pass
+
+
+class CoinListResponse:
+    status_code = 200
+
+    def json(self):
+        return [{'id': 'bitcoin', 'symbol': 'btc'}, {'id': 'ethereum', 'symbol': 'eth'},
+                {'id': 'ethereum-wormhole', 'symbol': 'eth'}]
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.num_acquired = 0
+
+    def acquire(self):
+        self.num_acquired += 1
+
+
+def test_coin_list_is_rate_limited_with_price_queries(tmp_path, monkeypatch):
+    limiter = CountingLimiter()
+    monkeypatch.setattr(stockwrapper.GeckoStock, 'RATE_LIMITER', limiter)
+    transport = CoinListTransport()
+    old_transport = httpclient.transport
+    httpclient.set_transport(transport)
+    try:
+        coin_index = coinindex.CoinIndex(str(tmp_path))
+        coin_ids = coin_index.coin_ids('ETH')
+    finally:
+        httpclient.set_transport(old_transport)
+
+    assert transport.urls == [coinindex.CoinIndex.COIN_LIST_URL]
+    assert limiter.num_acquired == 1
+    assert sorted(coin_ids) == ['ethereum', 'ethereum-wormhole']
@@ -0,0 +1,112 @@
+''' cross-check reports recomputed by IncrementalReport against reports derived from scratch with the same inputs '''
+import json
+import pytest
+import incremental
+import portfolio
+import reportmodel
+import stockwrapper
+
+
+SAVING_IN_KRW = 1500000.0
+SAVING_IN_USD = 300.0
+EXCHANGE_RATE = 1342.5
+# (stockgroupkey, stockkey, currency, weight, holdings, price)
+STOCKS = [
+    ('OTHER', 'KRW_STOCK', 'KRW', 0.3, 12, 61200.0),
+    ('OTHER', 'USD_STOCK', 'USD', 0.25, 7, 412.3),
+    ('CoinGecko', 'BTC', 'USD', 0.25, 0.0123, 61250.0),
+    ('CoinGecko', 'KRW_COIN', 'KRW', 0.2, 3.5, 812.0)
+]
+
+
+def ref_report(strategy: str) -> dict:
+    stockgroups = {}
+    for stockgroupkey, stockkey, currency, weight, holdings, price in STOCKS:
+        stockgroups.setdefault(stockgroupkey, {'stocks': {}})['stocks'][stockkey] = {
+            'weight': weight,
+            'currency': currency,
+            'holdings': holdings,
+            'price': price,
+            'cumSumCaInvested': 100.0,
+            'need2investCA': 20.0,
+            'need2invest': 25.0,
+            'cum_inv_deviation': 3.0
+        }
+
+    return {'strategy': strategy, 'exchange_rate': 1300.0, 'stockgroups': stockgroups}
+
+
+def derive(ref_report_path: str, allocation: str, saving_in_krw: float, saving_in_usd: float, exchange_rate: float,
+           changes: dict) -> portfolio.Portfolio:
+    ''' a Portfolio derived from scratch. changes: (stockgroupkey, stockkey) -> fields overriding those of the ref report '''
+    my_portfolio = portfolio.Portfolio(ref_report_path, 'secrets.json', 'tokens.json', saving_in_krw, saving_in_usd,
+                                       exchange_rate=exchange_rate, unit_allocation=allocation)
+    refreshed_stockgroups = {}
+    for stockgroupkey, stockgroup in my_portfolio.ref_report['stockgroups'].items():
+        stockgroup = reportmodel.copy_stockgroup(stockgroup)
+        for stockkey, stock in stockgroup['stocks'].items():
+            stock.update(changes.get((stockgroupkey, stockkey), {}))
+        stockgroup_handler = stockwrapper.BaseStock(exchange_rate, None, stockgroup)
+        stockgroup_handler.update_all()
+        refreshed_stockgroups[stockgroupkey] = stockgroup_handler.get_stockgrp()
+    my_portfolio.distribute_saving(refreshed_stockgroups)
+
+    return my_portfolio
+
+
+def assert_same_reports(report, expected_report):
+    assert report.keys() == expected_report.keys()
+    for key in report.keys():
+        if key != 'stockgroups':
+            assert report[key] == expected_report[key], key
+    for stockgroupkey, stockgroup in expected_report['stockgroups'].items():
+        for stockkey, expected_stock in stockgroup['stocks'].items():
+            stock = report['stockgroups'][stockgroupkey]['stocks'][stockkey]
+            assert stock.keys() == expected_stock.keys(), stockkey
+            for field, value in expected_stock.items():
+                assert stock[field] == value, f'{field} of {stockkey}'
+
+
+@pytest.mark.parametrize('allocation', ['round', 'budget'])
+@pytest.mark.parametrize('strategy', ['CA', 'VA'])
+def test_recompute_matches_fresh_derivation(strategy, allocation, tmp_path):
+    ref_report_path = str(tmp_path / 'ref_report.json')
+    with open(ref_report_path, 'w') as f:
+        json.dump(ref_report(strategy), f)
+
+    incremental_report = incremental.IncrementalReport(
+        derive(ref_report_path, allocation, SAVING_IN_KRW, SAVING_IN_USD, EXCHANGE_RATE, {}))
+    saving_in_krw, saving_in_usd, exchange_rate, changes = SAVING_IN_KRW, SAVING_IN_USD, EXCHANGE_RATE, {}
+
+    # each input in turn. the changes pile up
+    steps = [
+        ('prices of one group',
+         lambda: incremental_report.update_prices('OTHER', {'KRW_STOCK': 59800.0, 'USD_STOCK': 421.05}),
+         {('OTHER', 'KRW_STOCK'): {'price': 59800.0}, ('OTHER', 'USD_STOCK'): {'price': 421.05}}),
+        ('holdings', lambda: incremental_report.update_holdings('CoinGecko', {'BTC': 0.0151, 'KRW_COIN': 4.25}),
+         {('CoinGecko', 'BTC'): {'holdings': 0.0151}, ('CoinGecko', 'KRW_COIN'): {'holdings': 4.25}}),
+        ('exchange rate', lambda: incremental_report.update_exchange_rate(1401.25), {}),
+        ('saving', lambda: incremental_report.update_saving(saving_in_krw=2000000.0, saving_in_usd=150.0), {}),
+        ('weights', lambda: incremental_report.update_weights('OTHER', {'KRW_STOCK': 0.2, 'USD_STOCK': 0.35}),
+         {('OTHER', 'KRW_STOCK'): {'weight': 0.2}, ('OTHER', 'USD_STOCK'): {'weight': 0.35}})
+    ]
+    for name, update, step_changes in steps:
+        update()
+        if name == 'exchange rate':
+            exchange_rate = 1401.25
+        elif name == 'saving':
+            saving_in_krw, saving_in_usd = 2000000.0, 150.0
+        for stockkey, fields in step_changes.items():
+            changes.setdefault(stockkey, {}).update(fields)
+
+        report = incremental_report.recompute()
+        expected = derive(ref_report_path, allocation, saving_in_krw, saving_in_usd, exchange_rate, changes)
+        assert_same_reports(report, expected.this_report)
+
+    # refetching a stockgroup brings its prices back to those of the ref report
+    incremental_report.refresh_stockgroup('OTHER')
+    for stockkey in (('OTHER', 'KRW_STOCK'), ('OTHER', 'USD_STOCK')):
+        changes[stockkey].pop('price')
+    report = incremental_report.recompute()
+    expected = derive(ref_report_path, allocation, saving_in_krw, saving_in_usd, exchange_rate, changes)
+    assert_same_reports(report, expected.this_report)
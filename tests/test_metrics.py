@@ -0,0 +1,46 @@
+''' retries of the retry loops of the callers recorded by the HTTP metrics '''
+import httpclient
+import metrics
+import stockwrapper
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, headers: dict = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = '{}'
+        self.content = b'{}'
+        self.request = None
+
+
+class FakeTransport:
+    ''' answers with the given status codes in turn '''
+    def __init__(self, status_codes: list):
+        self.status_codes = list(status_codes)
+
+    def request(self, method, url, **kwargs):
+        return FakeResponse(self.status_codes.pop(0), {'retry-after': '0'})
+
+    def close(self):
+        pass
+
+
+def test_gecko_rate_limited_retries_are_recorded(tmp_path):
+    old_transport = httpclient.transport
+    httpclient.set_transport(FakeTransport([429, 429, 200]))
+    recorder = metrics.enable()
+    try:
+        stock_handler = stockwrapper.GeckoStock(1300.0, None, {'stocks': {}})
+        res = stock_handler._getWrapper('https://api.coingecko.com/api/v3/simple/price')
+        prometheus_fname = str(tmp_path / 'metrics.prom')
+        metrics.write(prometheus_fname=prometheus_fname)
+    finally:
+        metrics.disable()
+        httpclient.set_transport(old_transport)
+
+    assert res.status_code == 200
+    assert [(record['status'], record['retries']) for record in recorder.records if record['kind'] == 'http'] \
+        == [(429, 0), (429, 1), (200, 2)]
+    with open(prometheus_fname) as f:
+        retries_lines = [line for line in f.read().splitlines() if line.startswith('vacacalculator_http_retries_total{')]
+    assert sorted(line.split(',status=')[1] for line in retries_lines) == ['"200"} 1', '"429"} 1']
@@ -0,0 +1,31 @@
+''' units derived from the prices of PortfolioArrays '''
+import numpy as np
+import pytest
+import portfolioarrays
+
+
+def arrays_of(prices: list) -> portfolioarrays.PortfolioArrays:
+    stocks = {f'S{i}': {'weight': 1.0 / len(prices), 'currency': 'USD', 'holdings': 1, 'price': price,
+                        'appraisement': price, 'cumSumCaInvested': 10.0}
+              for i, price in enumerate(prices)}
+    arrays = portfolioarrays.PortfolioArrays({'OTHER': {'stocks': stocks}}, 1300.0)
+    arrays.distribute_saving_CA(100.0)
+
+    return arrays
+
+
+@pytest.mark.parametrize('price', [0.0, -1.0])
+def test_non_positive_price_is_rejected(price):
+    arrays = arrays_of([2.0, price])
+
+    with pytest.raises(ValueError, match='S1 of OTHER'):
+        arrays.derive_units_to_invest('round')
+    with pytest.raises(ValueError, match='S1 of OTHER'):
+        arrays.rounded_units_of(np.array([1]))
+
+
+def test_positive_prices_are_rounded():
+    arrays = arrays_of([3.0, 7.0])
+    arrays.derive_units_to_invest('round')
+
+    np.testing.assert_array_equal(arrays.need2invest_in_units, [17.0, 7.0])
@@ -0,0 +1,118 @@
+''' prices streamed from the stand-in quote feed into a LivePortfolio '''
+import json
+import time
+import pytest
+import httpclient
+import portfolio
+import pricestream
+import reportmodel
+import standin
+import stockwrapper
+
+
+EXCHANGE_RATE = 1342.5
+# (stockkey, market, currency, weight, holdings, price)
+STOCKS = [
+    ('005930', 'DOM', 'KRW', 0.6, 12, 71000.0),
+    ('AAPL', 'NAS', 'USD', 0.4, 7, 212.5)
+]
+
+
+def derive(tmp_path) -> portfolio.Portfolio:
+    ''' a Portfolio derived from a ref report of the stocks (prices of the ref report as those of today) '''
+    ref_report = {'strategy': 'VA', 'stockgroups': {'OTHER': {'stocks': {
+        stockkey: {'market': market, 'currency': currency, 'weight': weight, 'holdings': holdings, 'price': price,
+                   'cumSumCaInvested': 1000.0, 'need2investCA': 100.0}
+        for stockkey, market, currency, weight, holdings, price in STOCKS
+    }}}}
+    ref_report_path = str(tmp_path / 'ref_report.json')
+    with open(ref_report_path, 'w') as f:
+        json.dump(ref_report, f)
+
+    my_portfolio = portfolio.Portfolio(ref_report_path, 'secrets.json', 'tokens.json', 1000000.0, 0.0,
+                                       exchange_rate=EXCHANGE_RATE)
+    stockgroup_handler = stockwrapper.BaseStock(EXCHANGE_RATE, None,
+                                                reportmodel.copy_stockgroup(my_portfolio.ref_report['stockgroups']['OTHER']))
+    stockgroup_handler.update_all()
+    my_portfolio.distribute_saving({'OTHER': stockgroup_handler.get_stockgrp()})
+
+    return my_portfolio
+
+
+@pytest.fixture
+def stand_in(tmp_path):
+    ''' stand-in server (approval keys) and quote feed sending bursts of 5 ticks of a stock per frame. the feed starts
+    off the prices of the ref report so that every tick reprices its stock '''
+    server = standin.start_server()
+    feed = standin.StandInQuoteFeed(fixture={'prices': {'005930': 75000.0, 'AAPL': 230.0}}, tick_interval_in_sec=0.01,
+                                    ticks_per_frame=5).start()
+    old_transport = httpclient.transport
+    httpclient.set_transport(standin.StandInTransport(server.url, httpclient.default_pool))
+    yield feed
+    httpclient.set_transport(old_transport)
+    feed.stop()
+    server.shutdown()
+
+
+def test_ticks_coalesce_and_reprice(stand_in, tmp_path, monkeypatch):
+    monkeypatch.setattr(pricestream.KisPriceStream, 'MAX_QUEUE', 4)
+    secrets_path = str(tmp_path / 'secrets.json')
+    with open(secrets_path, 'w') as f:
+        json.dump({'KisSecrets': {'APP_KEY': 'app key', 'APP_SECRET': 'app secret'}}, f)
+
+    live_portfolio = pricestream.LivePortfolio(derive(tmp_path), 'OTHER')
+    tick_buffer = pricestream.TickBuffer([stockkey for stockkey, _, _, _, _, _ in STOCKS])
+    stream = pricestream.KisPriceStream(secrets_path, {stockkey: market for stockkey, market, _, _, _, _ in STOCKS},
+                                        tick_buffer, stand_in.url).start()
+    try:
+        # nothing is taken meanwhile, so every tick but the latest of each stock coalesces
+        deadline = time.monotonic() + 10.0
+        while tick_buffer.num_ticks < 50 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # the client reads at most MAX_QUEUE frames ahead of parsing
+        assert stream.websocket.recv_messages.high == 4
+        with tick_buffer.condition:
+            num_ticks, num_coalesced = tick_buffer.num_ticks, tick_buffer.num_coalesced
+            ticks = tick_buffer.take()
+    finally:
+        stream.stop()
+        tick_buffer.close()
+
+    assert num_ticks >= 50
+    assert ticks.keys() == {'005930', 'AAPL'}
+    assert num_coalesced == num_ticks - len(ticks)
+
+    units_before = {stockkey: stock['need2investInUnits'] for stockkey, stock in live_portfolio.stocks.items()}
+    changes = live_portfolio.apply(ticks)
+
+    assert live_portfolio.num_applied == 2
+    report = live_portfolio.snapshot()
+    stocks = report['stockgroups']['OTHER']['stocks']
+    for stockkey, _, currency, _, holdings, _ in STOCKS:
+        assert stocks[stockkey]['price'] == ticks[stockkey]
+        price_usd = ticks[stockkey] / EXCHANGE_RATE if currency == 'KRW' else ticks[stockkey]
+        assert stocks[stockkey]['appraisement'] == pytest.approx(holdings * price_usd)
+        assert stocks[stockkey]['need2investInUnits'] == round(stocks[stockkey]['need2invest'] / price_usd)
+    assert report['total_appraisement'] == pytest.approx(sum(stock['appraisement'] for stock in stocks.values()))
+    # changes tell the stocks whose units changed and their units before
+    assert {stockkey: units for _, stockkey, units in changes} == {
+        stockkey: units for stockkey, units in units_before.items() if units != stocks[stockkey]['need2investInUnits']
+    }
+
+
+def test_malformed_records_are_skipped(tmp_path):
+    secrets_path = str(tmp_path / 'secrets.json')
+    with open(secrets_path, 'w') as f:
+        json.dump({'KisSecrets': {'APP_KEY': 'app key', 'APP_SECRET': 'app secret'}}, f)
+    tick_buffer = pricestream.TickBuffer(['005930'])
+    stream = pricestream.KisPriceStream(secrets_path, {'005930': 'DOM'}, tick_buffer)
+
+    record = ['0'] * 46
+    record[0], record[2] = '005930', '71500'
+    stream._parse_ticks(f'0|H0STCNT0|003|{"^".join(record)}^005930^093000')  # the last two records are short
+    record[2] = 'N/A'
+    stream._parse_ticks(f'0|H0STCNT0|001|{"^".join(record)}')
+    stream._parse_ticks('0|H0STCNT0')
+
+    assert tick_buffer.take(timeout=0.0) == {'005930': 71500.0}
+    assert tick_buffer.num_ticks == 1
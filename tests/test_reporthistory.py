@@ -0,0 +1,18 @@
+''' per-stock values of the reports stored in a report history '''
+from datetime import date
+import reporthistory
+
+
+def test_price_usd_is_derived_when_stored(tmp_path):
+    history = reporthistory.ReportHistory(str(tmp_path / 'history.sqlite3'))
+    for report_date, exchange_rate, krw_price, usd_price in ((date(2024, 1, 1), 1300.0, 65000.0, 412.5),
+                                                             (date(2024, 2, 1), 1250.0, 70000.0, 420.0)):
+        history.append({'strategy': 'VA', 'exchange_rate': exchange_rate, 'stockgroups': {'KIS': {'stocks': {
+            'KRW_STOCK': {'currency': 'KRW', 'price': krw_price},
+            'USD_STOCK': {'currency': 'USD', 'price': usd_price},
+            'NO_PRICE': {'currency': 'USD'}
+        }}}}, report_date)
+
+    assert [entry['priceUsd'] for entry in history.stock_series('KRW_STOCK', ('priceUsd',))] == [50.0, 56.0]
+    assert [entry['priceUsd'] for entry in history.stock_series('USD_STOCK', ('priceUsd',))] == [412.5, 420.0]
+    assert [entry['priceUsd'] for entry in history.stock_series('NO_PRICE', ('priceUsd',))] == [None, None]
@@ -0,0 +1,46 @@
+''' ref reports a query of the service may name '''
+import os
+import pytest
+import service
+
+
+@pytest.fixture
+def engine(tmp_path):
+    ref_report_dir = tmp_path / 'refs'
+    ref_report_dir.mkdir()
+    for fname in ('default.json', 'other.json'):
+        (ref_report_dir / fname).write_text('{}')
+    (tmp_path / 'outside.json').write_text('{}')
+
+    engine = service.Engine(str(ref_report_dir / 'default.json'), 'secrets.json', 'tokens.json', 0.0, 0.0, 1, 'round',
+                            str(tmp_path / 'cache'), ref_report_dir=str(ref_report_dir))
+    yield engine
+    engine.close()
+
+
+def test_default_and_ref_report_dir_are_served(engine, tmp_path):
+    ref_report_dir = os.path.realpath(tmp_path / 'refs')
+
+    assert engine._resolve() == os.path.join(ref_report_dir, 'default.json')
+    assert engine._resolve(str(tmp_path / 'refs' / 'default.json')) == os.path.join(ref_report_dir, 'default.json')
+    assert engine._resolve('other.json') == os.path.join(ref_report_dir, 'other.json')
+    assert engine._resolve(str(tmp_path / 'refs' / 'other.json')) == os.path.join(ref_report_dir, 'other.json')
+
+
+@pytest.mark.parametrize('ref_report_path', ['../outside.json', '/etc/passwd', 'refs/../../outside.json'])
+def test_other_paths_are_rejected(engine, ref_report_path):
+    with pytest.raises(ValueError):
+        engine._state(ref_report_path)
+
+
+def test_only_default_without_ref_report_dir(tmp_path):
+    (tmp_path / 'default.json').write_text('{}')
+    (tmp_path / 'other.json').write_text('{}')
+    engine = service.Engine(str(tmp_path / 'default.json'), 'secrets.json', 'tokens.json', 0.0, 0.0, 1, 'round',
+                            str(tmp_path / 'cache'))
+    try:
+        assert engine._resolve(str(tmp_path / 'default.json')) == os.path.realpath(tmp_path / 'default.json')
+        with pytest.raises(ValueError):
+            engine._resolve(str(tmp_path / 'other.json'))
+    finally:
+        engine.close()